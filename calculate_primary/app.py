@@ -1,13 +1,27 @@
 # SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 
+from datetime import timedelta
+
 from fastapi import FastAPI
 from fastramqpi.main import FastRAMQPI
 
 from calculate_primary import events
+from calculate_primary.audit import PrimaryAudit
+from calculate_primary.circuit import CircuitBreaker
+from calculate_primary.concurrency import AdaptiveLimiter
+from calculate_primary.concurrency import Batcher
 from calculate_primary.config import Settings
 from calculate_primary.depends import GraphQLClient
+from calculate_primary.digests import DigestStore
+from calculate_primary.lanes import LaneClassifier
+from calculate_primary.main import PersonRecalculator
 from calculate_primary.main import _setup_updater
+from calculate_primary.poison import ParkingQueue
+from calculate_primary.poison import PoisonPersons
+from calculate_primary.sweep import FullSweep
+from calculate_primary.sweep import HighWaterMark
+from calculate_primary.sweep import Reconciliation
 
 
 def create_app() -> FastAPI:
@@ -21,10 +35,93 @@ def create_app() -> FastAPI:
     updater = _setup_updater(
         settings,
     )
-    fastramqpi.add_context(settings=settings, updater=updater)
+    limiter = AdaptiveLimiter(
+        min_limit=settings.concurrency_min,
+        max_limit=settings.concurrency_max,
+        latency_target=settings.concurrency_latency_target,
+        interactive_share=settings.concurrency_interactive_share,
+    )
+    breaker = CircuitBreaker(
+        failure_threshold=settings.circuit_failure_threshold,
+        reset_timeout=settings.circuit_reset_timeout,
+    )
+    updater.helper.guards.append(breaker.before_request)
+    updater.helper.observers.append(limiter.observe)
+    updater.helper.observers.append(breaker.observe)
+    poison = PoisonPersons(
+        max_attempts=settings.poison_max_attempts,
+        max_size=settings.poison_cache_size,
+    )
 
     # MO AMQP
     mo_amqp_system = fastramqpi.get_amqpsystem()
+    classifier = LaneClassifier(
+        bulk_actors=settings.lane_bulk_actors,
+        burst_threshold=settings.lane_burst_threshold,
+        burst_window=settings.lane_burst_window,
+    )
+    recalculator = PersonRecalculator(
+        updater,
+        limiter,
+        breaker,
+        poison,
+        mo_amqp_system.publish_message,
+        history_cache_size=settings.history_cache_size,
+        watermark_cache_size=settings.watermark_cache_size,
+        history_horizon=(
+            timedelta(days=settings.history_horizon_days)
+            if settings.history_horizon_days is not None
+            else None
+        ),
+        digests=(
+            DigestStore(settings.digest_store_path)
+            if settings.digest_store_path is not None
+            else None
+        ),
+    )
+    fastramqpi.add_context(
+        settings=settings,
+        updater=updater,
+        classifier=classifier,
+        batcher=Batcher(window=settings.batch_window, max_size=settings.batch_max_size),
+        recalculator=recalculator,
+    )
+    # Declared before the AMQP system starts consuming events, which may park persons
+    parking_queue = ParkingQueue(
+        mo_amqp_system, f"{settings.fastramqpi.amqp.queue_prefix}_parked"
+    )
+    fastramqpi.add_lifespan_manager(parking_queue, priority=900)
+    if settings.history_full_sweep_interval is not None:
+        full_sweep = FullSweep(
+            recalculator,
+            interval=settings.history_full_sweep_interval,
+            shards=settings.person_shards,
+            shard=settings.person_shard,
+        )
+        fastramqpi.add_lifespan_manager(full_sweep, priority=1200)
+    if settings.reconcile_interval is not None:
+        reconciliation = Reconciliation(
+            recalculator,
+            fastramqpi.get_context(),
+            interval=settings.reconcile_interval,
+            mark=HighWaterMark(settings.reconcile_state_path),
+            overlap=timedelta(seconds=settings.reconcile_overlap),
+            shards=settings.person_shards,
+            shard=settings.person_shard,
+        )
+        fastramqpi.add_lifespan_manager(reconciliation, priority=1200)
+    if settings.audit_interval is not None:
+        audit = PrimaryAudit(
+            recalculator,
+            fastramqpi.get_context(),
+            interval=settings.audit_interval,
+            shards=settings.person_shards,
+            shard=settings.person_shard,
+        )
+        fastramqpi.add_lifespan_manager(audit, priority=1200)
     mo_amqp_system.router.registry.update(events.router.registry)
+    # Persons are handed over to queues per lane, even without sharding
+    person_router = events.create_person_router(settings.person_shard)
+    mo_amqp_system.router.registry.update(person_router.registry)
 
     return fastramqpi.get_app()
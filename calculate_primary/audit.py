@@ -0,0 +1,156 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Organisation-wide audit of current primary engagements.
+
+Rather than deciding the primaries of every person, as check_all does, the
+current engagements of the whole organisation are paged through once, and the
+primary classes they hold are compared to the primary MO itself computes. This is
+a quick health signal of whether a full recalculation is needed at all.
+
+NOTE: Engagements excluded by the calculate_filters of an integration are audited
+all the same, thus a person may be found without a primary where check_all finds
+nothing to decide between.
+"""
+from collections import defaultdict
+from collections.abc import Collection
+from datetime import date
+from typing import Any
+from uuid import UUID
+
+import structlog
+from prometheus_client import Gauge
+
+from calculate_primary.main import PersonRecalculator
+from calculate_primary.sharding import shard_for
+from calculate_primary.sweep import PeriodicSweep
+
+logger = structlog.stdlib.get_logger()
+
+NO_PRIMARY = "No primary"
+TOO_MANY_PRIMARIES = "Too many primaries"
+DISAGREES_WITH_MO = "Primary disagrees with MO"
+FINDINGS = (NO_PRIMARY, TOO_MANY_PRIMARIES, DISAGREES_WITH_MO)
+
+audit_persons_gauge = Gauge(
+    "primary_audit_persons",
+    "Number of persons with each finding in the last primary audit",
+    ["finding"],
+)
+last_audit = Gauge("primary_audit_last", "Timestamp of the last primary audit")
+
+
+def _finding(primaries: int, computed: int, agreeing: int) -> str | None:
+    """Finding of a person, given the counts of its current engagements.
+
+    Args:
+        primaries: Number of engagements with one of the primary classes.
+        computed: Number of engagements MO computes to be the primary.
+        agreeing: Number of engagements which are both.
+
+    Returns:
+        The finding, or None if the person has exactly one primary, agreed upon.
+    """
+    if primaries == 0:
+        return NO_PRIMARY
+    if primaries > 1:
+        return TOO_MANY_PRIMARIES
+    if computed != 1 or agreeing != 1:
+        return DISAGREES_WITH_MO
+    return None
+
+
+async def audit_primaries(
+    graphql_client: Any,
+    primary_types: Collection[str],
+    page_size: int = 500,
+    report: Any = None,
+) -> dict[UUID, str]:
+    """Find the persons whose current engagements do not have a single primary.
+
+    Only a few counters are kept per person, whatever the number of engagements,
+    and no per-person requests are made.
+
+    Args:
+        graphql_client: The GraphQL client to page through engagements with.
+        primary_types: UUIDs of the primary classes, see updater.primary.
+        page_size: Number of engagements to read per page.
+        report: Report to write the findings to, see report.py.
+
+    Returns:
+        Dictionary from UUID of each person with a finding to the finding.
+    """
+    primary_types = set(map(str, primary_types))
+    # Person to the counts of _finding
+    counts: dict[UUID, list[int]] = defaultdict(lambda: [0, 0, 0])
+    cursor = None
+    while True:
+        page = await graphql_client.get_current_primaries(
+            cursor=cursor, limit=page_size
+        )
+        for engagement in page.objects:
+            current = engagement.current
+            if current is None:
+                continue
+            primary = (
+                current.primary is not None
+                and str(current.primary.uuid) in primary_types
+            )
+            for person in current.person:
+                person_counts = counts[person.uuid]
+                person_counts[0] += primary
+                person_counts[1] += current.is_primary
+                person_counts[2] += primary and current.is_primary
+        cursor = page.page_info.next_cursor
+        if cursor is None:
+            break
+
+    findings = {}
+    today = date.today()
+    for person_uuid, person_counts in counts.items():
+        finding = _finding(*person_counts)
+        if finding is None:
+            continue
+        findings[person_uuid] = finding
+        if report is not None:
+            report.finding(str(person_uuid), today, finding)
+    logger.info("Audited primaries", persons=len(counts), findings=len(findings))
+    return findings
+
+
+class PrimaryAudit(PeriodicSweep):
+    """Lifespan manager periodically auditing the primaries of all persons.
+
+    Only the persons of this replica's shard are logged and counted, thus the
+    primary_audit_persons gauges of all replicas sum to the organisation total.
+    Nothing is recalculated, that being left to the operator.
+    """
+
+    def __init__(
+        self,
+        recalculator: PersonRecalculator,
+        context: dict,
+        interval: float,
+        page_size: int = 500,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(recalculator, interval, **kwargs)
+        # The GraphQL client is only in the context once FastRAMQPI has started
+        self.context = context
+        self.page_size = page_size
+
+    async def sweep(self) -> None:
+        """Audit the primaries of all persons, and count the findings."""
+        findings = await audit_primaries(
+            self.context["graphql_client"],
+            self.recalculator.updater.primary,
+            page_size=self.page_size,
+        )
+        totals = dict.fromkeys(FINDINGS, 0)
+        for person_uuid, finding in findings.items():
+            if shard_for(person_uuid, self.shards) != self.shard:
+                continue
+            logger.info("Audit finding", person_uuid=person_uuid, finding=finding)
+            totals[finding] += 1
+        for finding, total in totals.items():
+            audit_persons_gauge.labels(finding=finding).set(total)
+        last_audit.set_to_current_time()
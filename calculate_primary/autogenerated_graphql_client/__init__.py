@@ -1,4 +1,4 @@
-# Generated by ariadne-codegen on 2024-08-08 08:47
+# Generated by ariadne-codegen on 2026-10-19 07:10
 
 from .async_base_client import AsyncBaseClient
 from .base_model import BaseModel
@@ -11,11 +11,52 @@ from .exceptions import GraphQLClientGraphQLError
 from .exceptions import GraphQLClientGraphQLMultiError
 from .exceptions import GraphQLClientHttpError
 from .exceptions import GraphQlClientInvalidResponseError
+from .get_changed_engagements import GetChangedEngagements
+from .get_changed_engagements import GetChangedEngagementsEngagements
+from .get_changed_engagements import GetChangedEngagementsEngagementsObjects
+from .get_changed_engagements import (
+    GetChangedEngagementsEngagementsObjectsRegistrations,
+)
+from .get_changed_engagements import GetChangedEngagementsEngagementsObjectsValidities
+from .get_changed_engagements import (
+    GetChangedEngagementsEngagementsObjectsValiditiesPerson,
+)
+from .get_changed_engagements import GetChangedEngagementsEngagementsPageInfo
+from .get_current_primaries import GetCurrentPrimaries
+from .get_current_primaries import GetCurrentPrimariesEngagements
+from .get_current_primaries import GetCurrentPrimariesEngagementsObjects
+from .get_current_primaries import GetCurrentPrimariesEngagementsObjectsCurrent
+from .get_current_primaries import GetCurrentPrimariesEngagementsObjectsCurrentPerson
+from .get_current_primaries import GetCurrentPrimariesEngagementsObjectsCurrentPrimary
+from .get_current_primaries import GetCurrentPrimariesEngagementsObjectsCurrentValidity
+from .get_current_primaries import GetCurrentPrimariesEngagementsPageInfo
 from .get_engagement_person import GetEngagementPerson
 from .get_engagement_person import GetEngagementPersonEngagements
 from .get_engagement_person import GetEngagementPersonEngagementsObjects
+from .get_engagement_person import GetEngagementPersonEngagementsObjectsRegistrations
 from .get_engagement_person import GetEngagementPersonEngagementsObjectsValidities
 from .get_engagement_person import GetEngagementPersonEngagementsObjectsValiditiesPerson
+from .get_engagement_person import (
+    GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements,
+)
+from .get_engagement_person import (
+    GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsEngagementType,
+)
+from .get_engagement_person import (
+    GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsPrimary,
+)
+from .get_engagement_person import (
+    GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsValidity,
+)
+from .get_engagements import GetEngagements
+from .get_engagements import GetEngagementsEngagements
+from .get_engagements import GetEngagementsEngagementsObjects
+from .get_engagements import GetEngagementsEngagementsObjectsValidities
+from .get_engagements import GetEngagementsEngagementsObjectsValiditiesEngagementType
+from .get_engagements import GetEngagementsEngagementsObjectsValiditiesPerson
+from .get_engagements import GetEngagementsEngagementsObjectsValiditiesPrimary
+from .get_engagements import GetEngagementsEngagementsObjectsValiditiesValidity
+from .get_engagements import GetEngagementsEngagementsPageInfo
 from .input_types import AddressCreateInput
 from .input_types import AddressFilter
 from .input_types import AddressRegistrationFilter
@@ -175,11 +216,40 @@ __all__ = [
     "FacetsBoundClassFilter",
     "FileFilter",
     "FileStore",
+    "GetChangedEngagements",
+    "GetChangedEngagementsEngagements",
+    "GetChangedEngagementsEngagementsObjects",
+    "GetChangedEngagementsEngagementsObjectsRegistrations",
+    "GetChangedEngagementsEngagementsObjectsValidities",
+    "GetChangedEngagementsEngagementsObjectsValiditiesPerson",
+    "GetChangedEngagementsEngagementsPageInfo",
+    "GetCurrentPrimaries",
+    "GetCurrentPrimariesEngagements",
+    "GetCurrentPrimariesEngagementsObjects",
+    "GetCurrentPrimariesEngagementsObjectsCurrent",
+    "GetCurrentPrimariesEngagementsObjectsCurrentPerson",
+    "GetCurrentPrimariesEngagementsObjectsCurrentPrimary",
+    "GetCurrentPrimariesEngagementsObjectsCurrentValidity",
+    "GetCurrentPrimariesEngagementsPageInfo",
     "GetEngagementPerson",
     "GetEngagementPersonEngagements",
     "GetEngagementPersonEngagementsObjects",
+    "GetEngagementPersonEngagementsObjectsRegistrations",
     "GetEngagementPersonEngagementsObjectsValidities",
     "GetEngagementPersonEngagementsObjectsValiditiesPerson",
+    "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements",
+    "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsEngagementType",
+    "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsPrimary",
+    "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsValidity",
+    "GetEngagements",
+    "GetEngagementsEngagements",
+    "GetEngagementsEngagementsObjects",
+    "GetEngagementsEngagementsObjectsValidities",
+    "GetEngagementsEngagementsObjectsValiditiesEngagementType",
+    "GetEngagementsEngagementsObjectsValiditiesPerson",
+    "GetEngagementsEngagementsObjectsValiditiesPrimary",
+    "GetEngagementsEngagementsObjectsValiditiesValidity",
+    "GetEngagementsEngagementsPageInfo",
     "GraphQLClient",
     "GraphQLClientError",
     "GraphQLClientGraphQLError",
@@ -1,11 +1,24 @@
-# Generated by ariadne-codegen on 2024-08-08 08:47
+# Generated by ariadne-codegen on 2026-10-19 07:10
 # Source: queries.graphql
 
+from datetime import datetime
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Union
 from uuid import UUID
 
 from .async_base_client import AsyncBaseClient
+from .base_model import UNSET
+from .base_model import UnsetType
+from .get_changed_engagements import GetChangedEngagements
+from .get_changed_engagements import GetChangedEngagementsEngagements
+from .get_current_primaries import GetCurrentPrimaries
+from .get_current_primaries import GetCurrentPrimariesEngagements
 from .get_engagement_person import GetEngagementPerson
 from .get_engagement_person import GetEngagementPersonEngagements
+from .get_engagements import GetEngagements
+from .get_engagements import GetEngagementsEngagements
 
 
 def gql(q: str) -> str:
@@ -13,23 +26,174 @@ def gql(q: str) -> str:
 
 
 class GraphQLClient(AsyncBaseClient):
-    async def get_engagement_person(self, uuid: UUID) -> GetEngagementPersonEngagements:
+    async def get_engagement_person(
+        self,
+        uuids: List[UUID],
+        from_date: Union[Optional[datetime], UnsetType] = UNSET,
+        registered_at: Union[Optional[datetime], UnsetType] = UNSET,
+    ) -> GetEngagementPersonEngagements:
         query = gql(
             """
-            query GetEngagementPerson($uuid: UUID!) {
-              engagements(filter: {uuids: [$uuid], from_date: null, to_date: null}) {
+            query GetEngagementPerson($uuids: [UUID!]!, $from_date: DateTime, $registered_at: DateTime) {
+              engagements(filter: {uuids: $uuids, from_date: null, to_date: null}) {
                 objects {
+                  uuid
                   validities(start: null, end: null) {
                     person {
                       uuid
+                      engagements(filter: {from_date: $from_date, to_date: null}) {
+                        uuid
+                        user_key
+                        fraction
+                        primary {
+                          uuid
+                        }
+                        engagement_type {
+                          uuid
+                        }
+                        validity {
+                          from
+                          to
+                        }
+                      }
                     }
                   }
+                  registrations(filter: {start: $registered_at, end: null}) {
+                    actor
+                    start
+                  }
                 }
               }
             }
             """
         )
-        variables: dict[str, object] = {"uuid": uuid}
+        variables: dict[str, object] = {
+            "uuids": uuids,
+            "from_date": from_date,
+            "registered_at": registered_at,
+        }
         response = await self.execute(query=query, variables=variables)
         data = self.get_data(response)
         return GetEngagementPerson.parse_obj(data).engagements
+
+    async def get_engagements(
+        self,
+        cursor: Union[Optional[Any], UnsetType] = UNSET,
+        limit: Union[Optional[Any], UnsetType] = UNSET,
+    ) -> GetEngagementsEngagements:
+        query = gql(
+            """
+            query GetEngagements($cursor: Cursor, $limit: int) {
+              engagements(
+                cursor: $cursor
+                limit: $limit
+                filter: {from_date: null, to_date: null}
+              ) {
+                objects {
+                  validities(start: null, end: null) {
+                    uuid
+                    user_key
+                    fraction
+                    primary {
+                      uuid
+                    }
+                    engagement_type {
+                      uuid
+                    }
+                    validity {
+                      from
+                      to
+                    }
+                    person {
+                      uuid
+                    }
+                  }
+                }
+                page_info {
+                  next_cursor
+                }
+              }
+            }
+            """
+        )
+        variables: dict[str, object] = {"cursor": cursor, "limit": limit}
+        response = await self.execute(query=query, variables=variables)
+        data = self.get_data(response)
+        return GetEngagements.parse_obj(data).engagements
+
+    async def get_changed_engagements(
+        self,
+        since: datetime,
+        cursor: Union[Optional[Any], UnsetType] = UNSET,
+        limit: Union[Optional[Any], UnsetType] = UNSET,
+    ) -> GetChangedEngagementsEngagements:
+        query = gql(
+            """
+            query GetChangedEngagements($since: DateTime!, $cursor: Cursor, $limit: int) {
+              engagements(
+                cursor: $cursor
+                limit: $limit
+                filter: {from_date: null, to_date: null}
+              ) {
+                objects {
+                  validities(start: null, end: null) {
+                    person {
+                      uuid
+                    }
+                  }
+                  registrations(filter: {start: $since, end: null}) {
+                    start
+                  }
+                }
+                page_info {
+                  next_cursor
+                }
+              }
+            }
+            """
+        )
+        variables: dict[str, object] = {
+            "since": since,
+            "cursor": cursor,
+            "limit": limit,
+        }
+        response = await self.execute(query=query, variables=variables)
+        data = self.get_data(response)
+        return GetChangedEngagements.parse_obj(data).engagements
+
+    async def get_current_primaries(
+        self,
+        cursor: Union[Optional[Any], UnsetType] = UNSET,
+        limit: Union[Optional[Any], UnsetType] = UNSET,
+    ) -> GetCurrentPrimariesEngagements:
+        query = gql(
+            """
+            query GetCurrentPrimaries($cursor: Cursor, $limit: int) {
+              engagements(cursor: $cursor, limit: $limit) {
+                objects {
+                  current {
+                    uuid
+                    is_primary
+                    primary {
+                      uuid
+                    }
+                    person {
+                      uuid
+                    }
+                    validity {
+                      from
+                      to
+                    }
+                  }
+                }
+                page_info {
+                  next_cursor
+                }
+              }
+            }
+            """
+        )
+        variables: dict[str, object] = {"cursor": cursor, "limit": limit}
+        response = await self.execute(query=query, variables=variables)
+        data = self.get_data(response)
+        return GetCurrentPrimaries.parse_obj(data).engagements
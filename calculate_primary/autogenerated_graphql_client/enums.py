@@ -1,4 +1,4 @@
-# Generated by ariadne-codegen on 2024-08-08 08:47
+# Generated by ariadne-codegen on 2026-10-19 06:07
 # Source: schema.graphql
 
 from enum import Enum
@@ -0,0 +1,49 @@
+# Generated by ariadne-codegen on 2026-10-19 07:10
+# Source: queries.graphql
+
+from datetime import datetime
+from typing import Any
+from typing import List
+from typing import Optional
+from uuid import UUID
+
+from .base_model import BaseModel
+
+
+class GetChangedEngagements(BaseModel):
+    engagements: "GetChangedEngagementsEngagements"
+
+
+class GetChangedEngagementsEngagements(BaseModel):
+    objects: List["GetChangedEngagementsEngagementsObjects"]
+    page_info: "GetChangedEngagementsEngagementsPageInfo"
+
+
+class GetChangedEngagementsEngagementsObjects(BaseModel):
+    validities: List["GetChangedEngagementsEngagementsObjectsValidities"]
+    registrations: List["GetChangedEngagementsEngagementsObjectsRegistrations"]
+
+
+class GetChangedEngagementsEngagementsObjectsValidities(BaseModel):
+    person: List["GetChangedEngagementsEngagementsObjectsValiditiesPerson"]
+
+
+class GetChangedEngagementsEngagementsObjectsValiditiesPerson(BaseModel):
+    uuid: UUID
+
+
+class GetChangedEngagementsEngagementsObjectsRegistrations(BaseModel):
+    start: datetime
+
+
+class GetChangedEngagementsEngagementsPageInfo(BaseModel):
+    next_cursor: Optional[Any]
+
+
+GetChangedEngagements.update_forward_refs()
+GetChangedEngagementsEngagements.update_forward_refs()
+GetChangedEngagementsEngagementsObjects.update_forward_refs()
+GetChangedEngagementsEngagementsObjectsValidities.update_forward_refs()
+GetChangedEngagementsEngagementsObjectsValiditiesPerson.update_forward_refs()
+GetChangedEngagementsEngagementsObjectsRegistrations.update_forward_refs()
+GetChangedEngagementsEngagementsPageInfo.update_forward_refs()
@@ -0,0 +1,60 @@
+# Generated by ariadne-codegen on 2026-10-19 06:37
+# Source: queries.graphql
+
+from datetime import datetime
+from typing import Any
+from typing import List
+from typing import Optional
+from uuid import UUID
+
+from pydantic import Field
+
+from .base_model import BaseModel
+
+
+class GetCurrentPrimaries(BaseModel):
+    engagements: "GetCurrentPrimariesEngagements"
+
+
+class GetCurrentPrimariesEngagements(BaseModel):
+    objects: List["GetCurrentPrimariesEngagementsObjects"]
+    page_info: "GetCurrentPrimariesEngagementsPageInfo"
+
+
+class GetCurrentPrimariesEngagementsObjects(BaseModel):
+    current: Optional["GetCurrentPrimariesEngagementsObjectsCurrent"]
+
+
+class GetCurrentPrimariesEngagementsObjectsCurrent(BaseModel):
+    uuid: UUID
+    is_primary: bool
+    primary: Optional["GetCurrentPrimariesEngagementsObjectsCurrentPrimary"]
+    person: List["GetCurrentPrimariesEngagementsObjectsCurrentPerson"]
+    validity: "GetCurrentPrimariesEngagementsObjectsCurrentValidity"
+
+
+class GetCurrentPrimariesEngagementsObjectsCurrentPrimary(BaseModel):
+    uuid: UUID
+
+
+class GetCurrentPrimariesEngagementsObjectsCurrentPerson(BaseModel):
+    uuid: UUID
+
+
+class GetCurrentPrimariesEngagementsObjectsCurrentValidity(BaseModel):
+    from_: datetime = Field(alias="from")
+    to: Optional[datetime]
+
+
+class GetCurrentPrimariesEngagementsPageInfo(BaseModel):
+    next_cursor: Optional[Any]
+
+
+GetCurrentPrimaries.update_forward_refs()
+GetCurrentPrimariesEngagements.update_forward_refs()
+GetCurrentPrimariesEngagementsObjects.update_forward_refs()
+GetCurrentPrimariesEngagementsObjectsCurrent.update_forward_refs()
+GetCurrentPrimariesEngagementsObjectsCurrentPrimary.update_forward_refs()
+GetCurrentPrimariesEngagementsObjectsCurrentPerson.update_forward_refs()
+GetCurrentPrimariesEngagementsObjectsCurrentValidity.update_forward_refs()
+GetCurrentPrimariesEngagementsPageInfo.update_forward_refs()
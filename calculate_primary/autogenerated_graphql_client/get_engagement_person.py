@@ -1,9 +1,13 @@
-# Generated by ariadne-codegen on 2024-08-08 08:47
+# Generated by ariadne-codegen on 2026-10-19 06:10
 # Source: queries.graphql
 
+from datetime import datetime
 from typing import List
+from typing import Optional
 from uuid import UUID
 
+from pydantic import Field
+
 from .base_model import BaseModel
 
 
@@ -16,7 +20,9 @@ class GetEngagementPersonEngagements(BaseModel):
 
 
 class GetEngagementPersonEngagementsObjects(BaseModel):
+    uuid: UUID
     validities: List["GetEngagementPersonEngagementsObjectsValidities"]
+    registrations: List["GetEngagementPersonEngagementsObjectsRegistrations"]
 
 
 class GetEngagementPersonEngagementsObjectsValidities(BaseModel):
@@ -25,6 +31,46 @@ class GetEngagementPersonEngagementsObjectsValidities(BaseModel):
 
 class GetEngagementPersonEngagementsObjectsValiditiesPerson(BaseModel):
     uuid: UUID
+    engagements: List[
+        "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements"
+    ]
+
+
+class GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements(BaseModel):
+    uuid: UUID
+    user_key: str
+    fraction: Optional[int]
+    primary: Optional[
+        "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsPrimary"
+    ]
+    engagement_type: (
+        "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsEngagementType"
+    )
+    validity: "GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsValidity"
+
+
+class GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsPrimary(
+    BaseModel
+):
+    uuid: UUID
+
+
+class GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsEngagementType(
+    BaseModel
+):
+    uuid: UUID
+
+
+class GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsValidity(
+    BaseModel
+):
+    from_: datetime = Field(alias="from")
+    to: Optional[datetime]
+
+
+class GetEngagementPersonEngagementsObjectsRegistrations(BaseModel):
+    actor: UUID
+    start: datetime
 
 
 GetEngagementPerson.update_forward_refs()
@@ -32,3 +78,8 @@ GetEngagementPersonEngagements.update_forward_refs()
 GetEngagementPersonEngagementsObjects.update_forward_refs()
 GetEngagementPersonEngagementsObjectsValidities.update_forward_refs()
 GetEngagementPersonEngagementsObjectsValiditiesPerson.update_forward_refs()
+GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements.update_forward_refs()
+GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsPrimary.update_forward_refs()
+GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsEngagementType.update_forward_refs()
+GetEngagementPersonEngagementsObjectsValiditiesPersonEngagementsValidity.update_forward_refs()
+GetEngagementPersonEngagementsObjectsRegistrations.update_forward_refs()
@@ -0,0 +1,67 @@
+# Generated by ariadne-codegen on 2026-10-19 06:23
+# Source: queries.graphql
+
+from datetime import datetime
+from typing import Any
+from typing import List
+from typing import Optional
+from uuid import UUID
+
+from pydantic import Field
+
+from .base_model import BaseModel
+
+
+class GetEngagements(BaseModel):
+    engagements: "GetEngagementsEngagements"
+
+
+class GetEngagementsEngagements(BaseModel):
+    objects: List["GetEngagementsEngagementsObjects"]
+    page_info: "GetEngagementsEngagementsPageInfo"
+
+
+class GetEngagementsEngagementsObjects(BaseModel):
+    validities: List["GetEngagementsEngagementsObjectsValidities"]
+
+
+class GetEngagementsEngagementsObjectsValidities(BaseModel):
+    uuid: UUID
+    user_key: str
+    fraction: Optional[int]
+    primary: Optional["GetEngagementsEngagementsObjectsValiditiesPrimary"]
+    engagement_type: "GetEngagementsEngagementsObjectsValiditiesEngagementType"
+    validity: "GetEngagementsEngagementsObjectsValiditiesValidity"
+    person: List["GetEngagementsEngagementsObjectsValiditiesPerson"]
+
+
+class GetEngagementsEngagementsObjectsValiditiesPrimary(BaseModel):
+    uuid: UUID
+
+
+class GetEngagementsEngagementsObjectsValiditiesEngagementType(BaseModel):
+    uuid: UUID
+
+
+class GetEngagementsEngagementsObjectsValiditiesValidity(BaseModel):
+    from_: datetime = Field(alias="from")
+    to: Optional[datetime]
+
+
+class GetEngagementsEngagementsObjectsValiditiesPerson(BaseModel):
+    uuid: UUID
+
+
+class GetEngagementsEngagementsPageInfo(BaseModel):
+    next_cursor: Optional[Any]
+
+
+GetEngagements.update_forward_refs()
+GetEngagementsEngagements.update_forward_refs()
+GetEngagementsEngagementsObjects.update_forward_refs()
+GetEngagementsEngagementsObjectsValidities.update_forward_refs()
+GetEngagementsEngagementsObjectsValiditiesPrimary.update_forward_refs()
+GetEngagementsEngagementsObjectsValiditiesEngagementType.update_forward_refs()
+GetEngagementsEngagementsObjectsValiditiesValidity.update_forward_refs()
+GetEngagementsEngagementsObjectsValiditiesPerson.update_forward_refs()
+GetEngagementsEngagementsPageInfo.update_forward_refs()
@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Circuit breaker around requests against MO."""
+import asyncio
+import threading
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import structlog
+from prometheus_client import Enum
+
+logger = structlog.stdlib.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+circuit_state = Enum(
+    "recalculate_mo_circuit",
+    "State of the circuit breaker around MO requests",
+    states=[CLOSED, OPEN, HALF_OPEN],
+)
+
+
+class CircuitOpenError(Exception):
+    """Thrown when a request against MO is attempted while the circuit is open.
+
+    This means MO has recently failed repeatedly, and is given time to recover.
+    """
+
+    pass
+
+
+class CircuitBreaker:
+    """Circuit breaker stopping work against MO while MO is failing.
+
+    The circuit opens after failure_threshold consecutive failed MO requests.
+    While open, MO requests fail fast and recalculations wait instead of starting.
+    After reset_timeout seconds the circuit turns half-open, and a single probe
+    recalculation is let through: if its requests succeed the circuit closes and
+    work resumes, if they fail the circuit opens again. A probe which ends without
+    any outcome, e.g. as its recalculation was skipped, lets another one through.
+
+    Example:
+        breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+        helper.guards.append(breaker.before_request)
+        helper.observers.append(breaker.observe)
+        async with breaker.slot():
+            ...
+    """
+
+    def __init__(
+        self, failure_threshold: int, reset_timeout: float, poll_interval: float = 1.0
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.poll_interval = poll_interval
+
+        # Requests are made and observed from the worker threads
+        self._lock = threading.Lock()
+        self._failures = 0
+        # Token of the caller holding the half-open probe, if any
+        self._probe: object | None = None
+        self._set_state(CLOSED)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        self._changed_at = time.monotonic()
+        self._probe = None
+        circuit_state.state(state)
+
+    def _current_state(self) -> str:
+        """Current state, with timeouts applied. Must be called holding the lock."""
+        expired = time.monotonic() - self._changed_at >= self.reset_timeout
+        if self._state == OPEN and expired:
+            logger.info("Circuit half-open, awaiting probe")
+            self._set_state(HALF_OPEN)
+        elif self._state == HALF_OPEN and self._probe is not None and expired:
+            # The probe never reported back, let another one through
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def observe(self, started_at: float, ok: bool) -> None:
+        """Update the circuit with the outcome of a single MO request.
+
+        Args:
+            started_at: Monotonic time at which the request was started.
+            ok: Whether the request succeeded.
+        """
+        with self._lock:
+            if ok:
+                self._failures = 0
+                if self._state != CLOSED:
+                    logger.info("Circuit closed, MO has recovered")
+                    self._set_state(CLOSED)
+                return
+
+            self._failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (
+                state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                logger.warning("Circuit opened, MO is failing", failures=self._failures)
+                self._set_state(OPEN)
+
+    def before_request(self) -> None:
+        """Fail fast, instead of making MO requests while the circuit is open.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        with self._lock:
+            if self._current_state() == OPEN:
+                raise CircuitOpenError()
+
+    def _claim(self) -> object | None:
+        """Claim a slot, returning CLOSED, a token of the probe claimed, or None."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return CLOSED
+            if state == HALF_OPEN and self._probe is None:
+                self._probe = object()
+                return self._probe
+            return None
+
+    def _try_acquire(self) -> bool:
+        return self._claim() is not None
+
+    def _release(self, claim: object) -> None:
+        with self._lock:
+            # Unless the probe already reported back, or expired
+            if self._probe is claim:
+                self._probe = None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait until the circuit is closed, or this caller is the half-open probe.
+
+        The probe is released on exit, whether or not it made any MO requests.
+        """
+        while (claim := self._claim()) is None:
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            self._release(claim)
+
+    async def wait_until_not_open(self) -> None:
+        """Wait while the circuit is open, without claiming the half-open probe."""
+        while self.state == OPEN:
+            await asyncio.sleep(self.poll_interval)
@@ -1,27 +1,56 @@
 # SPDX-FileCopyrightText: Magenta ApS
 #
 # SPDX-License-Identifier: MPL-2.0
+import collections
 import datetime
+import hashlib
+import heapq
+import json
+import time
 from abc import ABC
 from abc import abstractmethod
+from bisect import bisect_left
+from bisect import insort
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from functools import partial
+from functools import total_ordering
 from operator import itemgetter
+from typing import Callable
 from typing import Union
 from uuid import UUID
 
+import requests
 import structlog
-from more_itertools import ilen
+from more_itertools import chunked
+from more_itertools import one
 from more_itertools import only
 from more_itertools import pairwise
 from os2mo_helpers.mora_helpers import MoraHelper
+from prometheus_client import Counter
 from ra_utils.deprecation import deprecated
 from ra_utils.tqdm_wrapper import tqdm
+from tenacity import Retrying
+from tenacity import retry_if_exception
+from tenacity import stop_after_delay
+from tenacity import wait_random_exponential
 
+from calculate_primary import scoring
 from calculate_primary.config import Settings
 
 logger = structlog.stdlib.get_logger()
 
+# Number of users whose primaries are decided at once by batched scoring
+SCORING_BATCH_SIZE = 1000
+
+# Number of users checked at once by check_all, unless given
+CHECK_CONCURRENCY = 10
+
+stable_primary_counter = Counter(
+    "recalculate_stable_primary",
+    "Number of primary flips avoided by keeping an equally ranked current primary",
+)
+
 
 def get_engagement_updater(integration):
     if integration == "DEFAULT":
@@ -63,7 +92,344 @@ def noop(*args, **kwargs):
     pass
 
 
+def is_transient(exception: BaseException) -> bool:
+    """Decide whether exception is a transient MO failure, worth retrying.
+
+    Args:
+        exception: The exception raised by a request against MO.
+
+    Returns:
+        boolean: True for connection errors, timeouts and server errors.
+                 False otherwise.
+    """
+    if isinstance(exception, requests.exceptions.HTTPError):
+        response = exception.response
+        return response is not None and response.status_code >= 500
+    return isinstance(
+        exception,
+        (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    )
+
+
+def find_cut_dates(mo_engagements, no_past=False):
+    """Find dates with changes in an engagement history already read from MO.
+
+    Mirrors MoraHelper.find_cut_dates, without reading the history itself.
+
+    Args:
+        mo_engagements: The entire engagement history of a user.
+        no_past: Disregard engagements in the past.
+
+    Returns:
+        list: List of datetimes with changes in engagement history.
+    """
+    dates = set()
+    for engagement in _skip_past(mo_engagements, no_past):
+        start, end = _validity_window(engagement["validity"])
+        # Clamped like MoraHelper does, as Python has no love for dates like 1900
+        dates.add(max(start, datetime.datetime(1930, 1, 1)))
+        dates.add(end)
+    return sorted(dates)
+
+
+def changed_window(old_engagements, new_engagements):
+    """Find the window of time in which two engagement histories differ.
+
+    Primary engagements only need to be decided anew within this window, as the
+    engagements valid at any date outside of it are the same in both histories.
+
+    Args:
+        old_engagements: The engagement history of a user, as it was.
+        new_engagements: The engagement history of the user, as it is now.
+
+    Returns:
+        2-tuple of datetimes, the start and (exclusive) end of the window, or None
+        if the histories are identical.
+    """
+    old = {json.dumps(e, sort_keys=True): e for e in old_engagements}
+    new = {json.dumps(e, sort_keys=True): e for e in new_engagements}
+    changed = [e for key, e in (old | new).items() if key not in old or key not in new]
+    if not changed:
+        return None
+    windows = [_validity_window(e["validity"]) for e in changed]
+    return min(start for start, _ in windows), max(end for _, end in windows)
+
+
+@total_ordering
+class Descending:
+    """Sort key wrapper reversing the order of value, e.g. to find maxima by min."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class ActiveEngagements:
+    """The engagements of a history valid at a date, swept forwards through time.
+
+    Engagements are activated and expired as the date advances, rather than
+    selected from the entire history at each date, thus sweeping n engagements
+    over k dates takes O((n + k) log n) rather than O(n * k).
+
+    Active engagements are also kept in a heap ordered by rank, if given, making
+    the lowest ranked active engagement available in O(log n) as well.
+
+    The signature of each engagement, if given, is computed once as it is
+    activated, and the signature of all active engagements is kept along with them,
+    see MOPrimaryEngagementUpdater._decision_signature.
+
+    Example:
+        active = ActiveEngagements(mo_engagements, rank=updater._primary_rank)
+        for date in find_cut_dates(mo_engagements):
+            active.advance(date)
+            print(date, active.engagements, active.top())
+    """
+
+    def __init__(self, mo_engagements, rank=None, signature=None):
+        self._engagements = list(mo_engagements)
+        self._windows = [_validity_window(e["validity"]) for e in self._engagements]
+        self._rank = rank
+        self._signature = signature
+        # Indices of engagements not yet started, latest start first
+        self._pending = sorted(
+            range(len(self._engagements)),
+            key=lambda i: self._windows[i][0],
+            reverse=True,
+        )
+        # Indices of active engagements, in order of the history
+        self._active = []
+        self._signatures = {}
+        self._ends = []
+        self._ranked = []
+        self._date = None
+        # The engagements and signature of the active engagements, until changed
+        self._cached = None
+        self._cached_signature = None
+
+    def advance(self, date):
+        """Advance to date, which must not be before the previous date."""
+        assert self._date is None or self._date <= date
+        self._date = date
+        while self._pending and self._windows[self._pending[-1]][0] <= date:
+            i = self._pending.pop()
+            end = self._windows[i][1]
+            if end <= date:
+                continue
+            insort(self._active, i)
+            self._changed()
+            if self._signature is not None:
+                self._signatures[i] = self._signature(self._engagements[i])
+            heapq.heappush(self._ends, (end, i))
+            if self._rank is not None:
+                # Ties are broken by order in the history, like min and max do
+                heapq.heappush(self._ranked, (self._rank(self._engagements[i]), i))
+        while self._ends and self._ends[0][0] <= date:
+            _, i = heapq.heappop(self._ends)
+            del self._active[bisect_left(self._active, i)]
+            self._signatures.pop(i, None)
+            self._changed()
+
+    def _changed(self):
+        self._cached = None
+        self._cached_signature = None
+
+    def _is_active(self, i):
+        j = bisect_left(self._active, i)
+        return j < len(self._active) and self._active[j] == i
+
+    @property
+    def engagements(self):
+        """The engagements valid at the date, in order of the history.
+
+        The same list is returned until the active engagements change, and must
+        thus not be modified.
+        """
+        if self._cached is None:
+            self._cached = [self._engagements[i] for i in self._active]
+        return self._cached
+
+    @property
+    def signature(self):
+        """Tuple of the signatures of the engagements valid at the date, in order."""
+        if self._cached_signature is None:
+            self._cached_signature = tuple(self._signatures[i] for i in self._active)
+        return self._cached_signature
+
+    def top(self):
+        """The lowest ranked engagement valid at the date, if any."""
+        # Expired engagements are only removed from the heap once on top
+        while self._ranked and not self._is_active(self._ranked[0][1]):
+            heapq.heappop(self._ranked)
+        return self._engagements[self._ranked[0][1]] if self._ranked else None
+
+
+def _freeze(value):
+    """Hashable equivalent of value, with dictionaries and lists as tuples."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(map(_freeze, value))
+    return value
+
+
+def _engagements_key(mo_engagements):
+    """Key identifying a set of engagement validities of the same history."""
+    return tuple((e["uuid"], e["validity"]["from"]) for e in mo_engagements)
+
+
+def _validity_window(validity):
+    """Start and (exclusive) end datetime of an engagement validity."""
+    if validity["to"]:
+        end = _parse_date(validity["to"]) + datetime.timedelta(days=1)
+    else:
+        end = datetime.datetime(9999, 12, 30, 0, 0)
+    return _parse_date(validity["from"]), end
+
+
+def _parse_date(value, default=None):
+    if value is None:
+        return default
+    return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+
+def _skip_past(mo_engagements, no_past):
+    if not no_past:
+        return mo_engagements
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    return [
+        e for e in mo_engagements if _parse_date(e["validity"]["to"], today) >= today
+    ]
+
+
+class InstrumentedMoraHelper(MoraHelper):
+    """MoraHelper which guards and reports every request made against MO.
+
+    Guards are called before each request, and may raise to prevent it.
+    Observers are called with the monotonic time at which the request started and
+    whether it succeeded. Both are called from whichever thread made the request.
+
+    Requests time out after timeout seconds, so a hung MO cannot hold a thread
+    forever. Lookups raise HTTPError on any server error before decoding the
+    response, as gateways answer 502-504 with bodies that are not JSON, and they
+    are not retried by the helper itself, leaving retries to the caller.
+
+    A single helper is shared by all threads working against MO, i.e. the workers
+    of check_all and apply_plan, and event-driven recalculations, as MoraHelper is
+    safe to share. Every request is made by a call of requests.get or .post of its
+    own, with headers fetched for it, and the cache is only ever assigned to, which
+    is atomic. Guards and observers must be thread-safe.
+    """
+
+    def __init__(self, *args, timeout: float | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.guards: list[Callable[[], None]] = []
+        self.observers: list[Callable[[float, bool], None]] = []
+
+    def _guard(self):
+        for guard in self.guards:
+            guard()
+
+    def _notify(self, started_at, ok):
+        for observer in self.observers:
+            observer(started_at, ok)
+
+    def _lookup(
+        self,
+        uuid,
+        url,
+        at=None,
+        validity=None,
+        only_primary=False,
+        use_cache=None,
+        calculate_primary=False,
+    ):
+        """Mirror of MoraHelper._mo_lookup, with a timeout and without retries."""
+        if use_cache is None:
+            use_cache = self.default_cache
+
+        params = {}
+        if calculate_primary:
+            params["calculate_primary"] = 1
+        if only_primary:
+            params["only_primary_uuid"] = 1
+        if at:
+            params["at"] = at
+        elif validity:
+            params["validity"] = validity
+
+        full_url = self.host + url.format(uuid)
+        cache_id = full_url + str(validity)
+        if (cache_id in self.cache) and use_cache:
+            return self.cache[cache_id]
+
+        headers = self.get_auth_headers()
+        response = requests.get(
+            full_url, headers=headers, params=params, timeout=self.timeout
+        )
+        if response.status_code == 401:
+            msg = "Missing Authorization"
+            if headers:
+                msg = "Authorization not accepted"
+            raise requests.exceptions.RequestException(msg)
+        # MO answers lookups of deleted objects with a 500, which is to be decoded
+        deleted = response.status_code == 500 and "has been deleted" in response.text
+        if response.status_code >= 500 and not deleted:
+            response.raise_for_status()
+
+        return_dict = response.json()
+        self.cache[cache_id] = return_dict
+        return return_dict
+
+    def _mo_lookup(self, *args, **kwargs):
+        self._guard()
+        started_at = time.monotonic()
+        try:
+            return_dict = self._lookup(*args, **kwargs)
+        except Exception:
+            self._notify(started_at, False)
+            raise
+        self._notify(started_at, True)
+        return return_dict
+
+    def _mo_post(self, url, payload, force=True):
+        self._guard()
+        started_at = time.monotonic()
+        params = {"force": 1} if force else {}
+        try:
+            response = requests.post(
+                self.host + url,
+                headers=self.get_auth_headers(),
+                params=params,
+                json=payload,
+                timeout=self.timeout,
+            )
+        except Exception:
+            self._notify(started_at, False)
+            raise
+        # Client errors are answers to the request, not signs of MO struggling
+        self._notify(started_at, response.status_code < 500)
+        return response
+
+
 class MOPrimaryEngagementUpdater(ABC):
+    # Rank of an engagement when finding the primary, the lowest ranked engagement
+    # being the primary, as a method taking the engagement. Should be provided by
+    # subclasses, for _find_primary and the sweep of recalculate_user to share.
+    _primary_rank = None
+
+    # Engagement attributes which primary decisions depend on, or None for all
+    # attributes but the validity. Should be narrowed by subclasses, to maximize
+    # reuse of decisions, see _decision_signature.
+    decision_attributes: tuple[str, ...] | None = None
+
     def __init__(self, settings: Settings):
         self.settings = settings
         self.helper = self._get_mora_helper(settings)
@@ -73,17 +439,63 @@ class MOPrimaryEngagementUpdater(ABC):
         self.check_filters = []
         self.calculate_filters = []
 
+        # Retry transient failures of single requests, instead of failing (and
+        # later redoing) the entire recalculation. Retries are jittered to avoid
+        # synchronised retry storms, and bounded by a total time budget.
+        # NOTE: The helper does not retry anything itself, see InstrumentedMoraHelper.
+        self._retrying = Retrying(
+            retry=retry_if_exception(is_transient),
+            wait=wait_random_exponential(
+                multiplier=0.5, max=settings.mo_retry_max_wait
+            ),
+            stop=stop_after_delay(settings.mo_retry_budget),
+            before_sleep=self._log_retry,
+            reraise=True,
+        )
+
         self.primary_types, self.primary = self._find_primary_types()
+        # What decides primaries besides the engagements, see history_digest
+        self._decision_settings = json.dumps(
+            [
+                settings.integration,
+                list(map(str, settings.eng_types_primary_order)),
+                self.primary_types,
+                list(map(str, self.primary)),
+            ],
+            sort_keys=True,
+            default=str,
+        )
+
+        if settings.batched_scoring:
+            # Fail on startup, rather than on the first bulk recalculation
+            scoring.require_numpy()
+
+    @staticmethod
+    def _log_retry(retry_state):
+        logger.warning(
+            "Retrying MO request",
+            attempt=retry_state.attempt_number,
+            exception=str(retry_state.outcome.exception()),
+        )
+
+    def _retry(self, func, *args, **kwargs):
+        """Call func, retrying transient MO failures according to settings.
+
+        Must only be used for reads and idempotent writes.
+        """
+        # The retrying object keeps per-call state, thus copy it for each call
+        return self._retrying.copy()(func, *args, **kwargs)
 
     def _get_mora_helper(self, settings: Settings):
         """Construct a MoraHelper object."""
-        return MoraHelper(
+        return InstrumentedMoraHelper(
             hostname=settings.fastramqpi.mo_url,
             auth_server=settings.fastramqpi.auth_server,
             client_id=settings.fastramqpi.client_id,
             client_secret=settings.fastramqpi.client_secret.get_secret_value(),
             auth_realm=settings.fastramqpi.auth_realm,
             use_cache=False,
+            timeout=settings.mo_request_timeout,
         )
 
     def _get_person(self, cpr=None, uuid=None, mo_person=None):
@@ -116,7 +528,8 @@ class MOPrimaryEngagementUpdater(ABC):
 
     def _read_engagement(self, user_uuid, date):
         """Fetch all engagements for user_uuid at date."""
-        mo_engagements = self.helper.read_user_engagements(
+        mo_engagements = self._retry(
+            self.helper.read_user_engagements,
             user=user_uuid,
             at=date,
             only_primary=True,  # Do not read extended info from MO.
@@ -124,6 +537,73 @@ class MOPrimaryEngagementUpdater(ABC):
         )
         return mo_engagements
 
+    def _read_history(self, user_uuid):
+        """Fetch the entire engagement history of user_uuid, in a single read."""
+        return self._retry(
+            self.helper.read_user_engagements,
+            user=user_uuid,
+            read_all=True,
+            only_primary=True,
+            use_cache=False,
+        )
+
+    def read_engagement_digest(self, user_uuid):
+        """Digest of the entire engagement history of user_uuid, as read from MO.
+
+        Args:
+            user_uuid: UUID of the user to digest engagements of.
+
+        Returns:
+            str: A hex digest, which changes whenever the engagements change.
+        """
+        mo_engagements = self._read_history(user_uuid)
+        # Sort the engagements, as the order returned by MO is of no significance
+        serialized = sorted(json.dumps(e, sort_keys=True) for e in mo_engagements)
+        return hashlib.sha256("\n".join(serialized).encode()).hexdigest()
+
+    def history_digest(self, mo_engagements):
+        """Digest of the state of an engagement history relevant to primaries.
+
+        Unlike read_engagement_digest, attributes irrelevant to deciding the
+        primary, see decision_attributes, are ignored. The settings and primary
+        classes which decide the primary are digested as well, so histories
+        verified under other ones are not taken as verified.
+
+        Args:
+            mo_engagements: The entire engagement history of a user.
+
+        Returns:
+            str: A hex digest, which changes whenever the relevant state changes.
+        """
+
+        def relevant(engagement):
+            if self.decision_attributes is None:
+                return engagement
+            attributes = (*self.decision_attributes, "validity")
+            return {k: engagement.get(k) for k in attributes}
+
+        serialized = sorted(
+            json.dumps(relevant(e), sort_keys=True, default=str) for e in mo_engagements
+        )
+        serialized.insert(0, self._decision_settings)
+        return hashlib.sha256("\n".join(serialized).encode()).hexdigest()
+
+    def primary_decision(self, mo_engagements):
+        """The validities of the primary engagements in an engagement history.
+
+        Args:
+            mo_engagements: The entire engagement history of a user.
+
+        Returns:
+            list: Sorted 3-lists of engagement UUID, from and to date.
+        """
+        primaries = (
+            [e["uuid"], e["validity"]["from"], e["validity"]["to"]]
+            for e in mo_engagements
+            if (e.get("primary") or {}).get("uuid") in self.primary
+        )
+        return sorted(primaries, key=str)
+
     @abstractmethod
     def _find_primary_types(self):
         """Find primary classes for the underlying implementation.
@@ -196,35 +676,30 @@ class MOPrimaryEngagementUpdater(ABC):
                 primary_count: Number of primaries found.
                 filtered_primary_count: Number of primaries passing check_filters.
         """
-        # Count number of engagements
-        mo_engagements = list(mo_engagements)
-        engagement_count = len(mo_engagements)
-
-        # Count number of primary engagements, by filtering on self.primary
-        primary_mo_engagements = list(
-            filter(
-                lambda eng: eng["primary"]["uuid"] in self.primary,
-                mo_engagements,
-            )
-        )
-        primary_count = len(primary_mo_engagements)
-
-        # Count number of primary engagements, by filtering out special primaries
-        # What consistutes a 'special primary' depend on the subclass implementation
-        for filter_func in check_filters:
-            primary_mo_engagements = filter(
-                partial(filter_func, user_uuid), primary_mo_engagements
-            )
-        filtered_primary_count = ilen(primary_mo_engagements)
+        # Counted in a single pass, as this is done for every date of every user
+        engagement_count = primary_count = filtered_primary_count = 0
+        for engagement in mo_engagements:
+            engagement_count += 1
+            # Count number of primary engagements, by filtering on self.primary
+            if engagement["primary"]["uuid"] not in self.primary:
+                continue
+            primary_count += 1
+            # Count number of primary engagements, by filtering out special primaries
+            # What consistutes a 'special primary' depend on the subclass
+            # implementation
+            if all(filter_func(user_uuid, engagement) for filter_func in check_filters):
+                filtered_primary_count += 1
 
         return engagement_count, primary_count, filtered_primary_count
 
-    def _check_user(self, check_filters, user_uuid):
+    def _check_user(self, check_filters, user_uuid, history=None):
         """Check the users primary engagement(s).
 
         Args:
             check_filters: A list of predicate functions from (user_uuid, eng).
             user_uuid: UUID of the user to check.
+            history: The entire engagement history of the user, as read by
+                read_user_engagements with read_all. Read from MO if not given.
 
         Returns:
             Dictionary:
@@ -232,10 +707,19 @@ class MOPrimaryEngagementUpdater(ABC):
                 value: A 3-tuple, from _count_primary_engagements.
         """
         # List of cut dates, excluding the very last one
-        date_list = self.helper.find_cut_dates(uuid=user_uuid)
+        if history is not None:
+            date_list = find_cut_dates(history)
+            active = ActiveEngagements(history)
+
+            def read_engagement(date):
+                active.advance(date)
+                return active.engagements
+        else:
+            date_list = self._retry(self.helper.find_cut_dates, uuid=user_uuid)
+            read_engagement = partial(self._read_engagement, user_uuid)
         date_list = date_list[:-1]
         # Map all our dates, to their corresponding engagements.
-        mo_engagements = map(partial(self._read_engagement, user_uuid), date_list)
+        mo_engagements = map(read_engagement, date_list)
         # Map mo_engagements to primary counts
         primary_counts = map(
             partial(self._count_primary_engagements, check_filters, user_uuid),
@@ -244,12 +728,14 @@ class MOPrimaryEngagementUpdater(ABC):
         # Create dicts from cut_dates --> primary_counts
         return dict(zip(date_list, primary_counts))
 
-    def _check_user_outputter(self, check_filters, user_uuid):
+    def _check_user_outputter(self, check_filters, user_uuid, history=None):
         """Check the users primary engagement(s).
 
         Args:
             check_filters: A list of predicate functions from (user_uuid, eng).
             user_uuid: UUID of the user to check.
+            history: The entire engagement history of the user, as read by
+                read_user_engagements with read_all. Read from MO if not given.
 
         Returns:
             Generator of output 4-tuples:
@@ -272,40 +758,51 @@ class MOPrimaryEngagementUpdater(ABC):
                 return (logger.info, "Only one non-special primary")
             return (print, "Too many primaries")
 
-        user_results = self._check_user(check_filters, user_uuid)
+        user_results = self._check_user(check_filters, user_uuid, history)
         for date, (e_count, p_count, fp_count) in user_results.items():
             outputter, string = to_output(e_count, p_count, fp_count)
             yield outputter, string, user_uuid, date
 
-    def _check_user_strings(self, check_filters, user_uuid):
+    def _check_user_strings(self, check_filters, user_uuid, history=None):
         """Check the users primary engagement(s).
 
         Args:
             check_filters: A list of predicate functions from (user_uuid, eng).
             user_uuid: UUID of the user to check.
+            history: The entire engagement history of the user, as read by
+                read_user_engagements with read_all. Read from MO if not given.
 
         Returns:
             Generator of output 2-tuples:
                 outputter: Function to output strings to
                 string: Formatted output string
         """
-        outputs = self._check_user_outputter(check_filters, user_uuid)
+        outputs = self._check_user_outputter(check_filters, user_uuid, history)
         for outputter, string, user_uuid, date in outputs:
             final_string = string + " for {} at {}".format(user_uuid, date.date())
             yield outputter, final_string
 
-    def check_user(self, user_uuid):
+    def check_user(self, user_uuid, history=None, report=None):
         """Check the users primary engagement(s).
 
-        Prints messages to stdout / log as side-effect.
+        Prints messages to stdout / log as side-effect, unless report is given.
 
         Args:
             user_uuid: UUID of the user to check.
+            history: The entire engagement history of the user, as read by
+                read_user_engagements with read_all. Read from MO if not given.
+            report: Report to write findings to instead, see report.py.
 
         Returns:
             None
         """
-        outputs = self._check_user_strings(self.check_filters, user_uuid)
+        if report is not None:
+            outputs = self._check_user_outputter(self.check_filters, user_uuid, history)
+            for outputter, string, user_uuid, date in outputs:
+                if string:
+                    report.finding(user_uuid, date.date(), string)
+            return
+        outputs = self._check_user_strings(self.check_filters, user_uuid, history)
         for outputter, string in outputs:
             outputter(string)
 
@@ -315,11 +812,12 @@ class MOPrimaryEngagementUpdater(ABC):
         # Kept solely for backwards compatability
         return self.recalculate_user(*args, **kwargs)
 
-    def _decide_primary(self, mo_engagements):
+    def _decide_primary(self, mo_engagements, find_primary=None):
         """Decide which of the engagements in mo_engagements is the primary one.
 
         Args:
             mo_engagements: List of engagements
+            find_primary: Replacement for _find_primary, e.g. already knowing it.
 
         Returns:
             2-tuple:
@@ -347,12 +845,65 @@ class MOPrimaryEngagementUpdater(ABC):
         #
         # The calulcation of primary engagement depends on the underlying
         # implementation, thus we simply call self._find_primary here.
-        primary = self._find_primary(mo_engagements)
+        primary = (find_primary or self._find_primary)(mo_engagements)
+        if primary and self.settings.prefer_current_primary:
+            primary = self._prefer_current_primary(mo_engagements, primary)
         if primary:
             return primary, "primary"
         raise NoPrimaryFound()
 
-    def _ensure_primary(self, engagement, primary_type_uuid, validity):
+    def _prefer_current_primary(self, mo_engagements, primary):
+        """Prefer the current primary engagement over an equally ranked primary.
+
+        Ties are broken arbitrarily by _find_primary, and thus not necessarily in
+        favour of the engagement MO already holds as primary, which would then be
+        flipped for no reason, producing needless edits and events.
+
+        Args:
+            mo_engagements: List of engagements
+            primary: The UUID of the primary engagement found by _find_primary.
+
+        Returns:
+            UUID: The UUID of the current primary engagement if it is ranked equal
+                  to primary, otherwise primary.
+        """
+        if self._primary_rank is None:
+            return primary
+        is_primary = partial(self._predicate_primary_is, "primary")
+        current = [e for e in mo_engagements if is_primary(e)]
+        if len(current) != 1 or current[0]["uuid"] == primary:
+            return primary
+        found = one(e for e in mo_engagements if e["uuid"] == primary)
+        if self._primary_rank(current[0]) != self._primary_rank(found):
+            return primary
+        logger.debug("Keeping equally ranked current primary", uuid=current[0]["uuid"])
+        return current[0]["uuid"]
+
+    def _decision_signature(self, mo_engagements):
+        """Signature of the inputs to deciding the primary among mo_engagements.
+
+        Engagements with equal signatures are guaranteed equal decisions, even if
+        valid at different dates.
+
+        Args:
+            mo_engagements: List of engagements
+
+        Returns:
+            tuple: A hashable signature of the engagements, in order.
+        """
+        return tuple(map(self._engagement_signature, mo_engagements))
+
+    def _engagement_signature(self, engagement):
+        """Hashable signature of the inputs to deciding the primary of engagement.
+
+        The values of the decision_attributes, in order, or of every attribute but
+        the validity if not narrowed by the integration.
+        """
+        if self.decision_attributes is None:
+            return _freeze({k: v for k, v in engagement.items() if k != "validity"})
+        return tuple(_freeze(engagement.get(k)) for k in self.decision_attributes)
+
+    def _ensure_primary(self, engagement, primary_type_uuid, validity, plan=None):
         """Ensure that engagement has the right primary_type.
 
         Assuming the engagement already has the correct primary_type this method
@@ -363,6 +914,7 @@ class MOPrimaryEngagementUpdater(ABC):
             engagement: The engagement to (potentially) update.
             primary_type_uuid: The primary type to ensure the engagement has.
             validity: The validity of the change (if made).
+            plan: Callable to hand the change to instead of making it, see plan.py.
 
         Returns:
             boolean: True if a change is made, False otherwise.
@@ -383,8 +935,35 @@ class MOPrimaryEngagementUpdater(ABC):
         }
         logger.debug("Edit payload: {}".format(payload))
 
+        if plan is not None:
+            primary_type_keys = {uuid: key for key, uuid in self.primary_types.items()}
+            current_key = primary_type_keys.get(engagement["primary"]["uuid"])
+            plan(
+                {
+                    "engagement": engagement["uuid"],
+                    "validity": validity,
+                    "primary": primary_type_uuid,
+                    "reason": "{} -> {}".format(
+                        current_key, primary_type_keys.get(primary_type_uuid)
+                    ),
+                }
+            )
+            return True
+
+        return self.write_edit(payload)
+
+    def write_edit(self, payload):
+        """Write an edit of an engagement to MO, unless running dry.
+
+        Args:
+            payload: The edit payload for MO's details/edit endpoint.
+
+        Returns:
+            boolean: True if a change is made, False otherwise.
+        """
         if not self.settings.dry_run:
-            response = self.helper._mo_post("details/edit", payload)
+            # Setting the primary type is idempotent, and thus safe to retry
+            response = self._retry(self._post_edit, payload)
             assert response.status_code in (200, 400)
             if response.status_code == 400:
                 # XXX: This shouldn't happen due to the previous check?
@@ -392,37 +971,52 @@ class MOPrimaryEngagementUpdater(ABC):
                 return False
         return True
 
-    def recalculate_user(self, user_uuid: Union[UUID, str], no_past=False):
-        """(Re)calculate primary engagement for the entire history the user."""
+    def _post_edit(self, payload):
+        """Post an edit to MO, raising on server errors so they can be retried."""
+        response = self.helper._mo_post("details/edit", payload)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    def recalculate_user(
+        self,
+        user_uuid: Union[UUID, str],
+        no_past=False,
+        mo_engagements=None,
+        window=None,
+        plan=None,
+        find_primary=None,
+    ):
+        """(Re)calculate primary engagement for the entire history the user.
+
+        Args:
+            user_uuid: UUID of the user to recalculate.
+            no_past: Do not recalculate the past.
+            mo_engagements: The entire engagement history of the user, as read by
+                read_user_engagements with read_all. Read from MO if not given.
+            window: Start and (exclusive) end datetime of the only part of the
+                history to recalculate and write, e.g. as found by changed_window.
+                Everything if not given.
+            plan: Callable to hand edits to instead of making them, see plan.py.
+            find_primary: Replacement for _find_primary, e.g. as found by
+                _batched_primaries for the same history.
+
+        Returns:
+            Dictionary from user_uuid to the number of edits made.
+        """
         user_uuid = str(user_uuid)
+        history = mo_engagements
+        prepare_mo_engagements = partial(self._prepare_engagements, user_uuid, no_past)
 
         def fetch_mo_engagements(date):
             """Fetch engagements which are active at 'date' and fulfill our filters.
 
             Also ensures that the 'primary' attribute is set on all engagements.
             """
-
-            def ensure_primary(engagement):
-                """Ensure that engagement has a primary field."""
-                # TODO: It would seem this happens for leaves, should we make a
-                #       special type for this?
-                # TODO: What does the above even mean? - Help?
-                if not engagement["primary"]:
-                    engagement["primary"] = {"uuid": self.primary_types["non_primary"]}
-                return engagement
-
-            # Fetch engagements
-            mo_engagements = self._read_engagement(user_uuid, date)
-            # Filter unwanted engagements
-            for filter_func in self.calculate_filters:
-                mo_engagements = filter(
-                    partial(filter_func, user_uuid, no_past), mo_engagements
-                )
-            # Enrich engagements with primary, if required
-            mo_engagements = map(ensure_primary, mo_engagements)
-            mo_engagements = list(mo_engagements)
-
-            return mo_engagements
+            if active is not None:
+                active.advance(date)
+                return active.engagements
+            return prepare_mo_engagements(self._read_engagement(user_uuid, date))
 
         def calculate_validity(start, end):
             """Construct engagement primarity validity from start and end date."""
@@ -441,11 +1035,51 @@ class MOPrimaryEngagementUpdater(ABC):
 
         logger.info("Calculate primary engagement: {}".format(user_uuid))
         number_of_edits = 0
+        # Cut dates are often caused by changes irrelevant to primarity, thus the
+        # same engagements tend to be decided between over and over again
+        decisions = {}
 
         # Find a list of dates with changes in engagement, and for each change
         # decide which engagement is the primary between that and the next change.
-        date_list = self.helper.find_cut_dates(user_uuid, no_past=no_past)
+        active = None
+        if history is not None:
+            date_list = find_cut_dates(history, no_past=no_past)
+            # Filters do not depend on the date, thus the entire history can be
+            # filtered up front, and then swept over the cut dates. Copied as the
+            # engagements are enriched.
+            active = ActiveEngagements(
+                prepare_mo_engagements(map(dict, history)),
+                rank=self._primary_rank,
+                signature=self._engagement_signature,
+            )
+        else:
+            date_list = self._retry(
+                self.helper.find_cut_dates, user_uuid, no_past=no_past
+            )
+
+        def find_active_primary(mo_engagements):
+            """Equal to _find_primary, without considering every engagement."""
+            return active.top()["uuid"]
+
+        if find_primary is None and active is not None:
+            if self._primary_rank is not None:
+                find_primary = find_active_primary
+
+        ensure_primary = self._ensure_primary
+        if plan is not None:
+
+            def plan_edit(edit):
+                plan({"person": user_uuid, **edit})
+
+            ensure_primary = partial(self._ensure_primary, plan=plan_edit)
+
         for start, end in pairwise(date_list):
+            if window is not None:
+                if end <= window[0] or start >= window[1]:
+                    continue
+                # The engagements are the same throughout the interval, thus the
+                # decision is too, and only needs to be written within the window
+                start, end = max(start, window[0]), min(end, window[1])
             logger.info("Recalculate primary, date: {}".format(start))
 
             mo_engagements = fetch_mo_engagements(start)
@@ -457,11 +1091,31 @@ class MOPrimaryEngagementUpdater(ABC):
 
             # Decide which of the mo_engagements is the primary one, and also what
             # kind of primary it is, fixed_primary or just primary
-            try:
-                primary_uuid, primary_type_key = self._decide_primary(mo_engagements)
-            except NoPrimaryFound:
-                logger.warning(f"Unable to determine primary for {user_uuid}")
-                primary_uuid = None
+            if active is not None:
+                signature = active.signature
+            else:
+                signature = self._decision_signature(mo_engagements)
+            if signature not in decisions:
+                # The primary found before preferring the current primary, if any
+                found = []
+
+                def find_and_record(mo_engagements):
+                    primary = (find_primary or self._find_primary)(mo_engagements)
+                    found.append(primary)
+                    return primary
+
+                try:
+                    primary_uuid, primary_type_key = self._decide_primary(
+                        mo_engagements, find_and_record
+                    )
+                    kept = primary_type_key == "primary" and found[-1] != primary_uuid
+                    decisions[signature] = (primary_uuid, primary_type_key, kept)
+                except NoPrimaryFound:
+                    logger.warning(f"Unable to determine primary for {user_uuid}")
+                    decisions[signature] = (None, None, False)
+            else:
+                logger.debug("Reusing decision for unchanged engagements")
+            primary_uuid, primary_type_key, kept = decisions[signature]
 
             validity = calculate_validity(start, end)
 
@@ -475,37 +1129,222 @@ class MOPrimaryEngagementUpdater(ABC):
                 if engagement["uuid"] == primary_uuid:
                     primary_type_uuid = self.primary_types[primary_type_key]
 
-                changed = self._ensure_primary(engagement, primary_type_uuid, validity)
+                changed = ensure_primary(engagement, primary_type_uuid, validity)
                 if changed:
                     number_of_edits += 1
+                elif kept and engagement["uuid"] == primary_uuid:
+                    # The edits flipping the primary were skipped
+                    stable_primary_counter.inc()
 
         return_dict = {user_uuid: number_of_edits}
         return return_dict
 
-    def check_all(self):
-        """Check all users for the existence of primary engagements."""
-        print("Reading all users from MO...")
-        all_users = self.helper.read_all_users()
-        print("OK")
-        for user in tqdm(all_users):
-            self.check_user(user["uuid"])
+    def _prepare_engagements(self, user_uuid, no_past, mo_engagements):
+        """Filter engagements, and ensure the 'primary' attribute is set on all."""
+
+        def ensure_primary(engagement):
+            """Ensure that engagement has a primary field."""
+            # TODO: It would seem this happens for leaves, should we make a
+            #       special type for this?
+            # TODO: What does the above even mean? - Help?
+            if not engagement["primary"]:
+                engagement["primary"] = {"uuid": self.primary_types["non_primary"]}
+            return engagement
+
+        # Filter unwanted engagements
+        for filter_func in self.calculate_filters:
+            mo_engagements = filter(
+                partial(filter_func, user_uuid, no_past), mo_engagements
+            )
+        # Enrich engagements with primary, if required
+        mo_engagements = map(ensure_primary, mo_engagements)
+        mo_engagements = list(mo_engagements)
+
+        return mo_engagements
+
+    def _batched_primaries(self, histories, no_past=False):
+        """Find the primaries of all intervals of many users by a single sort.
+
+        The intervals and their engagements are exactly those of recalculate_user
+        given the same histories, and the primaries those found by _find_primary,
+        see scoring.find_primaries.
 
-    def recalculate_all(self, no_past=False):
-        """Recalculate all users primary engagements."""
+        Args:
+            histories: Dictionary from user UUID to its engagement history.
+            no_past: Do not recalculate the past.
+
+        Returns:
+            Dictionary from user UUID to a replacement for _find_primary, to be
+            given to recalculate_user along with the history of the user.
+        """
+        rows = []
+        groups = {}
+        for person, (user_uuid, history) in enumerate(histories.items()):
+            active = ActiveEngagements(
+                self._prepare_engagements(user_uuid, no_past, map(dict, history))
+            )
+            for interval, date in enumerate(find_cut_dates(history, no_past)[:-1]):
+                active.advance(date)
+                engagements = active.engagements
+                rows.extend((person, interval, e) for e in engagements)
+                groups[person, interval] = _engagements_key(engagements)
+
+        columns = scoring.EngagementColumns.from_engagements(
+            rows,
+            self.primary_types["fixed_primary"],
+            self.settings.eng_types_primary_order,
+        )
+        primaries = scoring.find_primaries(self.settings.integration, columns)
+        found = [{} for _ in histories]
+        for person, interval, row in zip(
+            primaries.person, primaries.interval, primaries.row
+        ):
+            found[person][groups[person, interval]] = rows[row][2]["uuid"]
+
+        def find_primary(primaries, mo_engagements):
+            return primaries[_engagements_key(mo_engagements)]
+
+        return {
+            user_uuid: partial(find_primary, primaries)
+            for user_uuid, primaries in zip(histories, found)
+        }
+
+    def _all_user_uuids(self, store=None):
+        """UUIDs of all users, of the store if given, otherwise read from MO."""
+        if store is not None:
+            return list(map(str, store.persons()))
         print("Reading all users from MO...")
         all_users = self.helper.read_all_users()
         print("OK")
+        return list(map(itemgetter("uuid"), all_users))
+
+    def check_all(self, store=None, report=None, concurrency=CHECK_CONCURRENCY):
+        """Check all users for the existence of primary engagements.
+
+        The entire engagement history of each user is read once, rather than at
+        every cut date, and up to concurrency users are checked at once. Findings
+        are output in the order of the users regardless.
+
+        Args:
+            store: EngagementStore to read engagement histories from, rather
+                than reading them from MO user by user.
+            report: Report to write findings to, rather than printing them.
+            concurrency: Maximum number of users to check at once.
+
+        Returns:
+            Counter of the number of findings of each kind, over all users and
+            dates, e.g. "No primary".
+        """
+
+        def check(user_uuid):
+            if store is not None:
+                history = store.history(UUID(user_uuid))
+            else:
+                history = self._read_history(user_uuid)
+            return list(
+                self._check_user_outputter(self.check_filters, user_uuid, history)
+            )
+
+        user_uuids = self._all_user_uuids(store)
+        findings = collections.Counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = executor.map(check, user_uuids)
+            for outputs in tqdm(results, total=len(user_uuids)):
+                for outputter, string, user_uuid, date in outputs:
+                    if not string:
+                        continue
+                    findings[string] += 1
+                    if report is not None:
+                        report.finding(user_uuid, date.date(), string)
+                    else:
+                        outputter(
+                            string + " for {} at {}".format(user_uuid, date.date())
+                        )
+        return findings
+
+    def recalculate_all(self, no_past=False, store=None, digests=None, plan=None):
+        """Recalculate all users primary engagements.
+
+        Args:
+            no_past: Do not recalculate the past.
+            store: EngagementStore to read engagement histories from, rather
+                than reading them from MO user by user.
+            digests: DigestStore of verified users, to skip users verified since
+                their history last changed, and record users found correct.
+            plan: Callable to hand edits to instead of making them, see plan.py.
+        """
+        self.recalculate_users(
+            self._all_user_uuids(store), no_past, store, digests, plan
+        )
+
+    def recalculate_users(
+        self, user_uuids, no_past=False, store=None, digests=None, plan=None
+    ):
+        """Recalculate the primary engagements of the users given by user_uuids.
+
+        Args:
+            user_uuids: UUIDs of the users to recalculate.
+            no_past: Do not recalculate the past.
+            store: EngagementStore to read engagement histories from, rather
+                than reading them from MO user by user.
+            digests: DigestStore of verified users, to skip users verified since
+                their history last changed, and record users found correct.
+            plan: Callable to hand edits to instead of making them, see plan.py.
+        """
         edit_status = {}
-        all_users = tqdm(all_users)
-        all_users = map(itemgetter("uuid"), all_users)
-        for user_uuid in all_users:
-            try:
-                status = self.recalculate_user(user_uuid, no_past=no_past)
-                edit_status.update(status)
-            except MultipleFixedPrimaries:
-                print("{} has conflicting fixed primaries".format(user_uuid))
-            except Exception as exp:
-                print("Exception while processing {}: {}".format(user_uuid, exp))
+        skipped = 0
+        batched = self.settings.batched_scoring
+        user_uuids = tqdm(list(map(str, user_uuids)))
+        for chunk in chunked(user_uuids, SCORING_BATCH_SIZE if batched else 1):
+            # User UUID to its history, if read, and the digest of it, if any
+            histories = {}
+            for user_uuid in chunk:
+                try:
+                    history = None
+                    if store is not None:
+                        history = store.history(UUID(user_uuid))
+                    elif digests is not None or batched:
+                        history = self._read_history(user_uuid)
+                    verified = None
+                    if digests is not None:
+                        verified = self.history_digest(history)
+                        if digests.get(user_uuid) == verified:
+                            skipped += 1
+                            continue
+                    histories[user_uuid] = (history, verified)
+                except Exception as exp:
+                    print("Exception while processing {}: {}".format(user_uuid, exp))
+
+            find_primaries = {}
+            if batched and histories:
+                try:
+                    find_primaries = self._batched_primaries(
+                        {user_uuid: h for user_uuid, (h, _) in histories.items()},
+                        no_past,
+                    )
+                except Exception:
+                    # Every user of the batch is still decided on its own
+                    logger.exception("Batched scoring failed", users=len(histories))
+
+            for user_uuid, (history, verified) in histories.items():
+                try:
+                    status = self.recalculate_user(
+                        user_uuid,
+                        no_past=no_past,
+                        mo_engagements=history,
+                        plan=plan,
+                        find_primary=find_primaries.get(user_uuid),
+                    )
+                    edit_status.update(status)
+                    # Recalculating only the future verifies just that
+                    if verified is not None and not no_past and status[user_uuid] == 0:
+                        digests.record(
+                            user_uuid, verified, self.primary_decision(history)
+                        )
+                except MultipleFixedPrimaries:
+                    print("{} has conflicting fixed primaries".format(user_uuid))
+                except Exception as exp:
+                    print("Exception while processing {}: {}".format(user_uuid, exp))
 
         total_non_edits = 0
         total_edits = 0
@@ -515,3 +1354,5 @@ class MOPrimaryEngagementUpdater(ABC):
             total_edits += number_of_edits
         print("Total non-edits: {}".format(total_non_edits))
         print("Total edits: {}".format(total_edits))
+        if digests is not None:
+            print("Total verified skips: {}".format(skipped))
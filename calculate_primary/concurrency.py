@@ -0,0 +1,291 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Concurrency control for event-driven recalculations."""
+import asyncio
+import math
+import threading
+import time
+from collections.abc import AsyncIterator
+from collections.abc import Awaitable
+from collections.abc import Callable
+from collections.abc import Hashable
+from contextlib import asynccontextmanager
+from contextlib import suppress
+from typing import Any
+from typing import Generic
+from typing import TypeVar
+
+import structlog
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+from calculate_primary.lanes import BULK
+from calculate_primary.lanes import INTERACTIVE
+from calculate_primary.lanes import LANES
+
+logger = structlog.stdlib.get_logger()
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+merged_counter = Counter(
+    "recalculate_merged", "Number of recalculations merged into a pending one"
+)
+concurrency_limit_gauge = Gauge(
+    "recalculate_concurrency_limit", "Current limit on concurrent recalculations"
+)
+batch_size_histogram = Histogram(
+    "event_batch_size",
+    "Number of events handled per batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+in_flight_gauge = Gauge(
+    "recalculate_in_flight", "Number of running recalculations", ["lane"]
+)
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    """Mark the exception of future as retrieved, even if nobody awaited it."""
+    if not future.cancelled():
+        future.exception()
+
+
+class CoalescingLock:
+    """Keyed lock which runs at most one call per key at a time.
+
+    Calls arriving while a call for the same key is running are merged into a
+    single follow-up call, which is started once the running call completes, and
+    whose result is shared by all of the merged calls.
+
+    Example:
+        person_locks = CoalescingLock()
+        await person_locks.run(person_uuid, recalculate)
+    """
+
+    def __init__(self) -> None:
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._pending: dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Run func exclusively for key, or merge into an already pending call.
+
+        Args:
+            key: The exclusivity key, i.e. the UUID of a person.
+            func: Coroutine function to run once the key is free.
+
+        Returns:
+            The result of func, or of the pending call this call was merged into.
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            logger.debug("Merging into pending call", key=key)
+            merged_counter.inc()
+            # Shield the shared future, so cancelling one caller cancels no others
+            return await asyncio.shield(pending)
+
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        self._pending[key] = future
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Once running, calls arriving from now on require a new follow-up
+                del self._pending[key]
+                result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            # Garbage collect the lock, unless a follow-up call is waiting for it
+            if key not in self._pending and not lock.locked():
+                self._locks.pop(key, None)
+        return result
+
+
+class AdaptiveLimiter:
+    """Limit on concurrent recalculations, adapted to how well MO is coping.
+
+    The limit is controlled using additive-increase/multiplicative-decrease (AIMD):
+    Every MO request which succeeds within latency_target grows the limit by one
+    per limit requests, while every slow or failed request shrinks it by backoff.
+    Only one decrease is made per round-trip, i.e. requests started before the
+    last decrease cannot decrease the limit again, so a burst of failures from
+    requests already in flight is only counted once.
+
+    Slots are handed out by lane: Waiting interactive recalculations always go
+    before waiting bulk ones, and an interactive_share of the limit is reserved for
+    interactive recalculations, so they never wait for a full batch of bulk ones.
+
+    Example:
+        limiter = AdaptiveLimiter(min_limit=1, max_limit=10, latency_target=1.0)
+        helper.observers.append(limiter.observe)
+        async with limiter.slot(INTERACTIVE):
+            ...
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        backoff: float = 0.5,
+        interactive_share: float = 0.0,
+    ) -> None:
+        assert 1 <= min_limit <= max_limit
+        assert 0.0 < backoff < 1.0
+        assert 0.0 <= interactive_share <= 1.0
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.interactive_share = interactive_share
+
+        # Observations arrive from the worker threads making the MO requests
+        self._lock = threading.Lock()
+        self._limit = float(min_limit)
+        self._last_decrease = -math.inf
+        concurrency_limit_gauge.set(self._limit)
+
+        self._in_flight = dict.fromkeys(LANES, 0)
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current number of recalculations allowed to run concurrently."""
+        return int(self._limit)
+
+    def observe(self, started_at: float, ok: bool) -> None:
+        """Adapt the limit to the outcome of a single MO request.
+
+        Args:
+            started_at: Monotonic time at which the request was started.
+            ok: Whether the request succeeded.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if ok and now - started_at <= self.latency_target:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            elif started_at >= self._last_decrease:
+                self._last_decrease = now
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                logger.info("Backing off", limit=self.limit)
+            concurrency_limit_gauge.set(self._limit)
+
+    @asynccontextmanager
+    async def slot(self, lane: str = BULK) -> AsyncIterator[None]:
+        """Wait until the limit allows another recalculation in lane, and hold it.
+
+        Args:
+            lane: The priority lane of the recalculation.
+        """
+        async with self._condition:
+            self._waiting[lane] += 1
+            try:
+                # A raised limit is picked up at the next release, which always
+                # comes as the limit is at least one, and waiting requires one in
+                # flight, or an interactive waiter, which is in flight next.
+                await self._condition.wait_for(lambda: self._may_start(lane))
+            finally:
+                self._waiting[lane] -= 1
+                # Bulk work may have been waiting for us, even if we were cancelled
+                self._condition.notify_all()
+            self._in_flight[lane] += 1
+            in_flight_gauge.labels(lane=lane).set(self._in_flight[lane])
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight[lane] -= 1
+                in_flight_gauge.labels(lane=lane).set(self._in_flight[lane])
+                self._condition.notify_all()
+
+    def _may_start(self, lane: str) -> bool:
+        limit = self.limit
+        if sum(self._in_flight.values()) >= limit:
+            return False
+        if lane == INTERACTIVE:
+            return True
+        # Keep the reserved share free, but never starve bulk work completely
+        reserved = min(math.ceil(limit * self.interactive_share), limit - 1)
+        return (
+            self._waiting[INTERACTIVE] == 0 and self._in_flight[BULK] < limit - reserved
+        )
+
+
+class Batcher(Generic[T, R]):
+    """Gather items submitted within a short window, to handle them in one call.
+
+    The first item submitted opens a batch, which is closed window seconds later,
+    or as soon as it holds max_size items. The batch is then handled by a single
+    call of the func given with its first item, which returns a result per item,
+    and every submitter receives the result for its own item.
+
+    Example:
+        batcher = Batcher(window=1.0, max_size=100)
+        persons = await batcher.submit(engagement_uuid, resolve_persons)
+    """
+
+    def __init__(self, window: float, max_size: int) -> None:
+        self.window = window
+        self.max_size = max_size
+        self._batch: list[tuple[T, asyncio.Future]] | None = None
+        self._full = asyncio.Event()
+        self._flushes: set[asyncio.Task] = set()
+
+    async def submit(self, item: T, func: Callable[[list[T]], Awaitable[list[R]]]) -> R:
+        """Add item to the open batch, and wait for the batch to be handled.
+
+        Args:
+            item: The item to handle.
+            func: Coroutine function handling a batch, if item opens it.
+
+        Returns:
+            The result of func for item.
+        """
+        future: asyncio.Future[R] = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        if self._batch is None:
+            self._batch = []
+            self._full = asyncio.Event()
+            flush = asyncio.create_task(self._flush(self._batch, self._full, func))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        self._batch.append((item, future))
+        if len(self._batch) >= self.max_size:
+            self._batch = None
+            self._full.set()
+        # Shield the shared batch, so cancelling one submitter cancels no others
+        return await asyncio.shield(future)
+
+    async def _flush(
+        self,
+        batch: list[tuple[T, asyncio.Future]],
+        full: asyncio.Event,
+        func: Callable[[list[T]], Awaitable[list[R]]],
+    ) -> None:
+        with suppress(TimeoutError):
+            await asyncio.wait_for(full.wait(), self.window)
+        if self._batch is batch:
+            self._batch = None
+        batch_size_histogram.observe(len(batch))
+        try:
+            results = await func([item for item, _ in batch])
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as exception:
+            for _, future in batch:
+                future.set_exception(exception)
+            return
+        for (_, future), result in zip(batch, results, strict=True):
+            future.set_result(result)
@@ -1,13 +1,19 @@
 # SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 
+from pathlib import Path
 from typing import Literal
 from uuid import UUID
 
 from fastramqpi.config import Settings as _FastRAMQPISettings
 from fastramqpi.ramqp.config import AMQPConnectionSettings as _AMQPConnectionSettings
 from pydantic import BaseSettings
+from pydantic import Field
+from pydantic import NonNegativeFloat
+from pydantic import NonNegativeInt
+from pydantic import PositiveFloat
 from pydantic import PositiveInt
+from pydantic import root_validator
 
 
 # https://git.magenta.dk/rammearkitektur/FastRAMQPI#multilayer-exchanges
@@ -35,3 +41,122 @@ class Settings(BaseSettings):
     # Wait delay_amqp seconds before processing messages to help avoid race conditions
     # between integrations (see motivation on https://redmine.magenta.dk/issues/61815)
     delay_amqp: PositiveInt = 10
+
+    # Engagement events arriving within batch_window seconds of each other are
+    # resolved to persons by a single GraphQL query, of at most batch_max_size events.
+    # NOTE: Messages are only acknowledged once their batch is resolved, thus a batch
+    # can never hold more than the AMQP prefetch_count messages. To batch more, raise
+    # fastramqpi.amqp.prefetch_count along with batch_max_size.
+    batch_window: NonNegativeFloat = 1.0
+    batch_max_size: PositiveInt = 10
+
+    # Remember the engagement history each person was last recalculated from, for up
+    # to history_cache_size persons, and only recalculate the window of time in which
+    # it has since changed. Other persons are recalculated in full.
+    history_cache_size: PositiveInt = 10_000
+
+    # Remember when the last recalculation of each person started, for up to
+    # watermark_cache_size persons, skipping events it already covers. Events of
+    # other persons are never skipped as covered.
+    watermark_cache_size: PositiveInt = 100_000
+
+    # Bound event-driven recalculations to the last history_horizon_days days of
+    # history, reading and writing nothing before then, and recalculate the entire
+    # history of all persons every history_full_sweep_interval seconds instead.
+    # Both are disabled if not set.
+    history_horizon_days: PositiveInt | None = None
+    history_full_sweep_interval: PositiveInt | None = None
+
+    # Every reconcile_interval seconds recalculate the persons of engagements
+    # registered since the last reconciliation, catching any missed events. The
+    # point in time reconciled up to is kept in a file at reconcile_state_path, if
+    # given, otherwise it is lost on restart. Disabled if not set.
+    reconcile_interval: PositiveInt | None = None
+    reconcile_state_path: Path | None = None
+    # The point in time reconciled up to is kept reconcile_overlap seconds behind the
+    # local clock, as it is compared to the registration times of MO.
+    reconcile_overlap: NonNegativeInt = 300
+
+    # Every audit_interval seconds audit the current primaries of all persons, as
+    # computed by MO, logging and counting persons without exactly one primary,
+    # but recalculating nothing. Disabled if not set.
+    audit_interval: PositiveInt | None = None
+
+    # Remember persons verified to have correct primaries in an SQLite database at
+    # digest_store_path, skipping them until their engagement history changes, also
+    # across restarts. Every replica must be given its own database. Disabled if
+    # not set.
+    digest_store_path: Path | None = None
+
+    # Keep the engagement currently marked primary, if it ties with the best
+    # candidate, instead of flipping the primary between equally ranked engagements.
+    prefer_current_primary: bool = False
+
+    # Decide the primaries of bulk recalculations, e.g. recalculate_all, for a batch
+    # of users at a time by a single sort, rather than interval by interval. Requires
+    # NumPy, as installed by the scoring extra.
+    batched_scoring: bool = False
+
+    # Distribute recalculations across replicas by consistent hashing of person UUIDs.
+    # Each replica must be given its own person_shard in range(person_shards), and
+    # recalculates only the persons of that shard. With a single shard all persons
+    # are recalculated by every replica, from their shared person queues.
+    person_shards: PositiveInt = 1
+    person_shard: NonNegativeInt = 0
+
+    # Recalculations run concurrently up to an adaptive limit between concurrency_min
+    # and concurrency_max, which grows while MO answers requests within
+    # concurrency_latency_target seconds, and backs off when it does not.
+    # NOTE: The limit can never exceed the AMQP prefetch_count.
+    concurrency_min: PositiveInt = 1
+    concurrency_max: PositiveInt = 10
+    concurrency_latency_target: PositiveFloat = 2.0
+
+    # Interactive edits are recalculated before bulk work, and concurrency_interactive_share
+    # of the concurrency limit is reserved for them. Changes made by lane_bulk_actors
+    # (i.e. the UUIDs of importing integrations), or by any actor making more than
+    # lane_burst_threshold changes within lane_burst_window seconds, are bulk work.
+    concurrency_interactive_share: float = Field(0.2, ge=0.0, le=1.0)
+    lane_bulk_actors: list[UUID] = []
+    lane_burst_threshold: PositiveInt = 20
+    lane_burst_window: PositiveFloat = 10.0
+
+    # Stop working against MO after circuit_failure_threshold consecutive failed
+    # requests, and probe whether it has recovered every circuit_reset_timeout seconds.
+    circuit_failure_threshold: PositiveInt = 5
+    circuit_reset_timeout: PositiveFloat = 30.0
+
+    # Retry transient failures of single MO requests with jittered exponential
+    # backoff of up to mo_retry_max_wait seconds, for at most mo_retry_budget seconds.
+    mo_retry_max_wait: PositiveFloat = 5.0
+    mo_retry_budget: PositiveFloat = 60.0
+
+    # Give up on single MO requests not answered within mo_request_timeout seconds.
+    mo_request_timeout: PositiveFloat = 30.0
+
+    # Park persons after poison_max_attempts consecutive failed recalculations,
+    # skipping their events until their engagement data changes. At most
+    # poison_cache_size persons are remembered.
+    poison_max_attempts: PositiveInt = 5
+    poison_cache_size: PositiveInt = 10_000
+
+    @root_validator(skip_on_failure=True)
+    def check_person_shard(cls, values: dict) -> dict:
+        if values["person_shard"] >= values["person_shards"]:
+            raise ValueError("person_shard must be less than person_shards")
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def check_batch_max_size(cls, values: dict) -> dict:
+        if values["batch_max_size"] > values["fastramqpi"].amqp.prefetch_count:
+            raise ValueError(
+                "batch_max_size must not exceed fastramqpi.amqp.prefetch_count, "
+                "as batches are limited by the unacknowledged messages"
+            )
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def check_concurrency(cls, values: dict) -> dict:
+        if values["concurrency_min"] > values["concurrency_max"]:
+            raise ValueError("concurrency_min must not exceed concurrency_max")
+        return values
@@ -5,12 +5,16 @@ import datetime
 
 import structlog
 
+from calculate_primary.common import Descending
 from calculate_primary.common import MOPrimaryEngagementUpdater
 
 logger = structlog.stdlib.get_logger()
 
 
 class DefaultPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
+    # The attributes used by _decide_primary and _find_primary
+    decision_attributes = ("uuid", "user_key", "fraction", "primary")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -53,18 +57,17 @@ class DefaultPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
 
         return primary_dict, primary_list
 
-    def _find_primary(self, mo_engagements):
-        if not mo_engagements:
-            return None
-
+    def _primary_rank(self, engagement):
         # The primary engagement is the engagement with the highest occupation rate.
         # - The occupation rate is found as 'fraction' on the engagement.
         #
         # If two engagements have the same occupation rate, the tie is broken by
         # picking by user-key.
-        primary_engagement = max(
-            mo_engagements,
-            # Sort first by fraction, then reversely by user_key integer
-            key=lambda eng: (eng.get("fraction") or 0, eng["user_key"]),
-        )
+        return Descending((engagement.get("fraction") or 0, engagement["user_key"]))
+
+    def _find_primary(self, mo_engagements):
+        if not mo_engagements:
+            return None
+
+        primary_engagement = min(mo_engagements, key=self._primary_rank)
         return primary_engagement["uuid"]
@@ -5,13 +5,21 @@ from typing import Annotated
 from fastapi import Depends
 from fastramqpi.depends import from_user_context
 from fastramqpi.ramqp.depends import from_context
+from fastramqpi.ramqp.mo import MOAMQPSystem as _MOAMQPSystem
 
 from calculate_primary.autogenerated_graphql_client import (
     GraphQLClient as _GraphQLClient,
 )
 from calculate_primary.common import MOPrimaryEngagementUpdater
+from calculate_primary.concurrency import Batcher
 from calculate_primary.config import Settings as _Settings
+from calculate_primary.lanes import LaneClassifier as _LaneClassifier
+from calculate_primary.main import PersonRecalculator
 
 GraphQLClient = Annotated[_GraphQLClient, Depends(from_context("graphql_client"))]
+AMQPSystem = Annotated[_MOAMQPSystem, Depends(from_context("amqpsystem"))]
 Settings = Annotated[_Settings, Depends(from_user_context("settings"))]
 Updater = Annotated[MOPrimaryEngagementUpdater, Depends(from_user_context("updater"))]
+Recalculator = Annotated[PersonRecalculator, Depends(from_user_context("recalculator"))]
+LaneClassifier = Annotated[_LaneClassifier, Depends(from_user_context("classifier"))]
+EngagementBatcher = Annotated[Batcher, Depends(from_user_context("batcher"))]
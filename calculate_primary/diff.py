@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Find the persons whose primaries could have changed between two snapshots.
+
+Prints the UUIDs of the persons, one per line, or recalculates them against MO,
+as a cheap safety net for missed events without touching every person.
+
+Example:
+    python -m calculate_primary.diff yesterday.snapshot today.snapshot --recalculate
+"""
+import argparse
+from pathlib import Path
+from typing import get_args
+
+from calculate_primary.common import get_engagement_updater
+from calculate_primary.config import Settings
+from calculate_primary.main import _setup_updater
+from calculate_primary.store import EngagementStore
+from calculate_primary.store import changed_persons
+
+
+def main(argv: list[str] | None = None) -> None:
+    integrations = get_args(Settings.__fields__["integration"].outer_type_)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old", type=Path, help="Snapshot of the engagements before")
+    parser.add_argument("new", type=Path, help="Snapshot of the engagements after")
+    parser.add_argument(
+        "--integration",
+        choices=integrations,
+        help="Compare only attributes relevant to the integration, all if not given, "
+        "or that configured by the environment when recalculating",
+    )
+    parser.add_argument(
+        "--recalculate",
+        action="store_true",
+        help="Recalculate the persons, as configured by the environment",
+    )
+    args = parser.parse_args(argv)
+
+    settings = Settings() if args.recalculate else None
+    integration = settings.integration if settings is not None else args.integration
+    attributes = None
+    if integration is not None:
+        attributes = get_engagement_updater(integration).decision_attributes
+    old = EngagementStore.open_snapshot(args.old)
+    new = EngagementStore.open_snapshot(args.new)
+    persons = changed_persons(old, new, attributes)
+    if settings is None:
+        for person in persons:
+            print(person)
+        return
+
+    # Histories are read from MO rather than the snapshot, which may be outdated
+    updater = _setup_updater(settings)
+    updater.recalculate_users(persons)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Persistent store of persons verified to have correct primary engagements."""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from uuid import UUID
+
+import structlog
+
+logger = structlog.stdlib.get_logger()
+
+
+class DigestStore:
+    """Per-person digests of engagement histories verified by a recalculation.
+
+    A person is verified when recalculating it made no edits, at which point the
+    digest of its engagement history (see history_digest) is recorded together
+    with the decided primaries. Until the history changes, and thus its digest,
+    recalculating the person again is pointless.
+
+    Histories which were just edited are never recorded, as their digest is of a
+    state which no longer exists, and which would be wrongly considered verified
+    if it was ever restored.
+
+    The store is an SQLite database in WAL mode, so opening it is cheap and it
+    survives restarts. It is safe for use from multiple threads of one process,
+    which is to be the only writer, i.e. every replica needs its own database.
+
+    Example:
+        digests = DigestStore(path)
+        if digests.get(person_uuid) != updater.history_digest(mo_engagements):
+            ...
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # Losing the very latest records on power loss merely costs recalculating
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS verified (
+                    person TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    decision TEXT NOT NULL,
+                    verified_at TEXT NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM verified"
+            ).fetchone()
+        return count
+
+    def get(self, person: UUID) -> str | None:
+        """Digest of the history person was last verified with, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT digest FROM verified WHERE person = ?", (str(person),)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def decision(self, person: UUID) -> list | None:
+        """The primaries of person when it was last verified, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT decision FROM verified WHERE person = ?", (str(person),)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def record(self, person: UUID, digest: str, decision: list) -> None:
+        """Record that person was verified with the history given by digest.
+
+        Args:
+            person: UUID of the verified person.
+            digest: Digest of the engagement history it was verified with.
+            decision: The primaries of the history, see primary_decision.
+        """
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT INTO verified (person, digest, decision, verified_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (person) DO UPDATE SET
+                    digest = excluded.digest,
+                    decision = excluded.decision,
+                    verified_at = excluded.verified_at
+                """,
+                (
+                    str(person),
+                    digest,
+                    json.dumps(decision),
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,44 +1,228 @@
 # SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
 # SPDX-License-Identifier: MPL-2.0
 import asyncio
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone
+from functools import partial
+from typing import Annotated
+from uuid import UUID
 
 import structlog
-from fastramqpi.ramqp.depends import RateLimit
+from fastapi import Depends
+from fastramqpi.ramqp.depends import RoutingKey
+from fastramqpi.ramqp.depends import get_payload_as_type
+from fastramqpi.ramqp.mo import MOAMQPSystem
 from fastramqpi.ramqp.mo import MORouter
 from fastramqpi.ramqp.mo import PayloadUUID
-from more_itertools import only
+from pydantic import BaseModel
 
 from calculate_primary import depends
-from calculate_primary.main import calculate_user
+from calculate_primary.autogenerated_graphql_client import (
+    GetEngagementPersonEngagements,
+)
+from calculate_primary.autogenerated_graphql_client import (
+    GetEngagementPersonEngagementsObjectsValiditiesPersonEngagements as EngagementHistoryEngagement,
+)
+from calculate_primary.autogenerated_graphql_client import GraphQLClient
+from calculate_primary.config import Settings
+from calculate_primary.lanes import BULK
+from calculate_primary.lanes import INTERACTIVE
+from calculate_primary.lanes import LANES
+from calculate_primary.lanes import LaneClassifier
+from calculate_primary.main import EngagementHistory
+from calculate_primary.main import PersonRecalculator
+from calculate_primary.main import RecalculationWatermarks
+from calculate_primary.sharding import shard_for
+from calculate_primary.sharding import shard_routing_key
 
 router = MORouter()
 
 logger = structlog.stdlib.get_logger()
 
 
+class PersonWork(BaseModel):
+    """Person work handed over to the queue of its lane, on the replica owning it."""
+
+    uuid: UUID
+    # Engagements whose events triggered the work, to read the history through
+    engagements: list[UUID]
+
+
 @router.register("engagement")
 async def calculate_engagement(
     engagement_uuid: PayloadUUID,
     mo: depends.GraphQLClient,
-    updater: depends.Updater,
+    amqpsystem: depends.AMQPSystem,
     settings: depends.Settings,
-    _: RateLimit,
+    recalculator: depends.Recalculator,
+    classifier: depends.LaneClassifier,
+    batcher: depends.EngagementBatcher,
 ) -> None:
     await asyncio.sleep(settings.delay_amqp)
+    # Hold on to the event, rather than failing it against MO while MO is down
+    await recalculator.breaker.wait_until_not_open()
     logger.info(
         "Processing event for engagement",
         engagement_uuid=engagement_uuid,
         delay=settings.delay_amqp,
     )
 
-    result = await mo.get_engagement_person(engagement_uuid)
-    result = only(result.objects)
-    if result is None:
-        logger.info("No related person found.", engagement_uuid=engagement_uuid)
-        return
-    uuids = {e.uuid for o in result.validities for e in o.person}
-
-    logger.info("Found related person(s)", person_uuids=uuids)
-    # An engagement can be associated with multiple employees across its lifespan, although it typically isn't done.
-    for person_uuid in uuids:
-        calculate_user(updater, person_uuid)
+    handle_batch = partial(
+        _handle_engagements,
+        mo=mo,
+        amqpsystem=amqpsystem,
+        settings=settings,
+        recalculator=recalculator,
+        classifier=classifier,
+    )
+    tasks = await batcher.submit(engagement_uuid, handle_batch)
+    # Persons shared with other events of the batch are only handed over once
+    await asyncio.gather(*map(asyncio.shield, tasks))
+
+
+async def _handle_engagements(
+    events: list[UUID],
+    mo: GraphQLClient,
+    amqpsystem: MOAMQPSystem,
+    settings: Settings,
+    recalculator: PersonRecalculator,
+    classifier: LaneClassifier,
+) -> list[list[asyncio.Task]]:
+    """Resolve a batch of engagement events to persons, and hand each over once.
+
+    Args:
+        events: Engagement UUIDs, one per event.
+
+    Returns:
+        The tasks handing over the persons related to each event.
+    """
+    result = await mo.get_engagement_person(
+        list(set(events)),
+        from_date=recalculator.horizon(),
+        registered_at=datetime.now(timezone.utc),
+    )
+    engagements = {e.uuid: e for e in result.objects}
+
+    person_lanes: dict[UUID, set[str]] = defaultdict(set)
+    person_engagements: dict[UUID, set[UUID]] = defaultdict(set)
+    event_persons = []
+    for engagement_uuid in events:
+        engagement = engagements.get(engagement_uuid)
+        if engagement is None:
+            logger.info("No related person found.", engagement_uuid=engagement_uuid)
+            event_persons.append(set())
+            continue
+        # An engagement can be associated with multiple employees across its lifespan, although it typically isn't done.
+        uuids = {e.uuid for o in engagement.validities for e in o.person}
+        # The latest registration is the change which triggered the event, and
+        # normally the only one current when read
+        latest = max(engagement.registrations, key=lambda r: r.start, default=None)
+        lane = classifier.classify(latest.actor if latest is not None else None)
+        logger.info("Found related person(s)", person_uuids=uuids, lane=lane)
+        for person_uuid in uuids:
+            person_lanes[person_uuid].add(lane)
+            person_engagements[person_uuid].add(engagement_uuid)
+        event_persons.append(uuids)
+
+    async def process(person_uuid: UUID, lane: str) -> None:
+        # Hand the person over to the queue of its lane, on the replica owning it,
+        # rather than recalculating it while holding on to the engagement event.
+        # The history is read there, as the time it was read here is of no use.
+        shard = shard_for(person_uuid, settings.person_shards)
+        await amqpsystem.publish_message(
+            shard_routing_key(shard, lane),
+            PersonWork(
+                uuid=person_uuid, engagements=sorted(person_engagements[person_uuid])
+            ),
+        )
+
+    tasks = {}
+    for person_uuid, lanes in person_lanes.items():
+        # Handed over once, with the priority of the most urgent event
+        lane = INTERACTIVE if INTERACTIVE in lanes else BULK
+        tasks[person_uuid] = asyncio.create_task(process(person_uuid, lane))
+    return [[tasks[uuid] for uuid in uuids] for uuids in event_persons]
+
+
+def _histories(
+    result: GetEngagementPersonEngagements, read_at: float
+) -> dict[UUID, EngagementHistory]:
+    """Engagement histories of the persons related to the engagements read."""
+    return {
+        person.uuid: EngagementHistory(
+            read_at, [_to_mo_engagement(e) for e in person.engagements]
+        )
+        for engagement in result.objects
+        for validity in engagement.validities
+        for person in validity.person
+    }
+
+
+def _to_mo_engagement(engagement: EngagementHistoryEngagement) -> dict:
+    """Shape an engagement read via GraphQL like one read by MoraHelper."""
+
+    def to_date(value: datetime | None) -> str | None:
+        return value.date().isoformat() if value is not None else None
+
+    return {
+        "uuid": str(engagement.uuid),
+        "user_key": engagement.user_key,
+        "fraction": engagement.fraction,
+        "primary": (
+            {"uuid": str(engagement.primary.uuid)}
+            if engagement.primary is not None
+            else None
+        ),
+        "engagement_type": {"uuid": str(engagement.engagement_type.uuid)},
+        "validity": {
+            "from": to_date(engagement.validity.from_),
+            "to": to_date(engagement.validity.to),
+        },
+    }
+
+
+def create_person_router(shard: int) -> MORouter:
+    """Construct a router consuming the person work published for shard.
+
+    Each lane has a queue of its own, and thus a consumer of its own, with its own
+    prefetch_count of messages in flight, as RabbitMQ applies the prefetch_count of
+    a channel per consumer. Interactive work is thus delivered as soon as it is
+    published, however large the backlog of bulk work, and then given priority by
+    the limiter, see AdaptiveLimiter.slot.
+
+    Args:
+        shard: The shard owned by this replica.
+
+    Returns:
+        Router with a callback per lane, each with its own queue for the shard.
+    """
+    person_router = MORouter()
+
+    for queue_lane in LANES:
+        # A callback of its own per lane, as queue names are derived from them
+        async def calculate_person(
+            work: Annotated[PersonWork, Depends(get_payload_as_type(PersonWork))],
+            routing_key: RoutingKey,
+            mo: depends.GraphQLClient,
+            recalculator: depends.Recalculator,
+        ) -> None:
+            received_at = RecalculationWatermarks.now()
+            # The lane was decided by the replica receiving the engagement event
+            lane = routing_key.rsplit(".", 1)[-1]
+            logger.info("Processing event for person", person_uuid=work.uuid, lane=lane)
+            # Read the history again, covering everything received until now
+            await recalculator.breaker.wait_until_not_open()
+            read_at = RecalculationWatermarks.now()
+            result = await mo.get_engagement_person(
+                work.engagements,
+                from_date=recalculator.horizon(),
+                registered_at=datetime.now(timezone.utc),
+            )
+            # None if the person is no longer related to any of the engagements
+            history = _histories(result, read_at).get(work.uuid)
+            await recalculator.recalculate(work.uuid, received_at, lane, history)
+
+        calculate_person.__name__ = f"calculate_person_{shard}_{queue_lane}"
+        person_router.register(shard_routing_key(shard, queue_lane))(calculate_person)
+    return person_router
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Priority lanes separating interactive edits from bulk import traffic."""
+import time
+from collections import deque
+from collections.abc import Iterable
+from uuid import UUID
+
+import structlog
+from prometheus_client import Counter
+
+logger = structlog.stdlib.get_logger()
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+lane_counter = Counter(
+    "recalculate_lane_events", "Number of events classified per lane", ["lane"]
+)
+
+
+class LaneClassifier:
+    """Classify changes into priority lanes by the actor who made them.
+
+    Changes made by one of the configured bulk actors, i.e. importing
+    integrations, are bulk work. So are changes made by any actor currently making
+    more than burst_threshold changes per burst_window seconds, as no human edits
+    that fast. All other changes, typically made by hand in the MO UI, are
+    interactive work, and take priority over bulk work.
+
+    Example:
+        classifier = LaneClassifier(bulk_actors, burst_threshold=50, burst_window=10)
+        lane = classifier.classify(registration.actor)
+    """
+
+    def __init__(
+        self,
+        bulk_actors: Iterable[UUID],
+        burst_threshold: int,
+        burst_window: float,
+    ) -> None:
+        self.bulk_actors = frozenset(bulk_actors)
+        self.burst_threshold = burst_threshold
+        self.burst_window = burst_window
+        self._recent: dict[UUID | None, deque[float]] = {}
+
+    def classify(self, actor: UUID | None) -> str:
+        """Classify a change made by actor, counting it towards its burst.
+
+        Args:
+            actor: UUID of the actor who made the change, if known.
+
+        Returns:
+            The lane of the change.
+        """
+        bulk = actor in self.bulk_actors or self._in_burst(actor)
+        lane = BULK if bulk else INTERACTIVE
+        lane_counter.labels(lane=lane).inc()
+        return lane
+
+    def _in_burst(self, actor: UUID | None) -> bool:
+        now = time.monotonic()
+        recent = self._recent.setdefault(actor, deque())
+        recent.append(now)
+        while recent[0] <= now - self.burst_window:
+            recent.popleft()
+        # Only keep track of actors active within the window
+        quiet = [a for a, r in self._recent.items() if r[-1] <= now - self.burst_window]
+        for other in quiet:
+            del self._recent[other]
+        if len(recent) > self.burst_threshold:
+            logger.debug("Actor is bursting", actor=actor, changes=len(recent))
+            return True
+        return False
@@ -2,23 +2,148 @@
 #
 # SPDX-License-Identifier: MPL-2.0
 """Event-driven recalculate primary program."""
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable
+from collections.abc import Callable
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from typing import NamedTuple
 from uuid import UUID
 
+import structlog
 from prometheus_client import Counter
 from prometheus_client import Gauge
 
+from calculate_primary.circuit import CircuitBreaker
+from calculate_primary.circuit import CircuitOpenError
 from calculate_primary.common import MOPrimaryEngagementUpdater
+from calculate_primary.common import changed_window
 from calculate_primary.common import get_engagement_updater
+from calculate_primary.common import is_transient
+from calculate_primary.concurrency import AdaptiveLimiter
+from calculate_primary.concurrency import CoalescingLock
 from calculate_primary.config import Settings
+from calculate_primary.digests import DigestStore
+from calculate_primary.lanes import BULK
+from calculate_primary.lanes import INTERACTIVE
+from calculate_primary.poison import PARKED_ROUTING_KEY
+from calculate_primary.poison import PoisonPersons
+from calculate_primary.poison import parked_counter
+from calculate_primary.poison import parked_skip_counter
+
+logger = structlog.stdlib.get_logger()
 
 edit_counter = Counter("recalculate_edit", "Number of edits made")
 no_edit_counter = Counter("recalculate_no_edit", "Number of noops made")
+stale_event_counter = Counter(
+    "recalculate_stale_event", "Number of events covered by a later recalculation"
+)
+unchanged_history_counter = Counter(
+    "recalculate_unchanged_history",
+    "Number of recalculations skipped as the engagement history was unchanged",
+)
+verified_skip_counter = Counter(
+    "recalculate_verified_skip",
+    "Number of recalculations skipped as the person was verified since it changed",
+)
 last_processing = Gauge(
     "recalculate_last_processing", "Timestamp of the last processing"
 )
 
 
-def calculate_user(updater: MOPrimaryEngagementUpdater, uuid: UUID) -> None:
+class RecalculationWatermarks:
+    """Per-person watermarks of when the last completed recalculation started.
+
+    A recalculation reads the entire engagement history of a person from MO, thus
+    any event received before a recalculation of that person started is covered by
+    it, and can be acknowledged without doing any work.
+
+    Timestamps are taken from the monotonic clock of this process, rather than the
+    clock of the publisher, so the comparison is immune to clock skew.
+
+    Watermarks are kept in least-recently-recorded order, and trimmed to max_size
+    persons, thus forgetting a person merely costs recalculating it on its next
+    event, even if covered.
+    """
+
+    def __init__(self, max_size: int = 100_000) -> None:
+        self.max_size = max_size
+        self._started_at: OrderedDict[UUID, float] = OrderedDict()
+
+    @staticmethod
+    def now() -> float:
+        """Current time on the clock used for watermarks."""
+        return time.monotonic()
+
+    def is_stale(self, uuid: UUID, received_at: float) -> bool:
+        """Check whether an event has been covered by a completed recalculation.
+
+        Args:
+            uuid: UUID of the user the event relates to.
+            received_at: When the event was received, as given by `now`.
+
+        Returns:
+            True if a recalculation of the user started after the event was received
+            and has since completed, False otherwise.
+        """
+        started_at = self._started_at.get(uuid)
+        return started_at is not None and received_at < started_at
+
+    def record(self, uuid: UUID, started_at: float) -> None:
+        """Record a completed recalculation of the user started at started_at."""
+        # Recalculations may complete out of order, never move the watermark back
+        self._started_at[uuid] = max(started_at, self._started_at.get(uuid, started_at))
+        self._started_at.move_to_end(uuid)
+        while len(self._started_at) > self.max_size:
+            self._started_at.popitem(last=False)
+
+
+class RecalculatedHistories:
+    """Per-person engagement history from the last completed recalculation.
+
+    Comparing it to the current history of a person bounds a recalculation to the
+    window of time in which the history changed, see changed_window.
+
+    Histories are kept in least-recently-used order, and trimmed to max_size
+    persons, thus forgetting a person merely costs recalculating all of it.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._engagements: OrderedDict[UUID, list[dict]] = OrderedDict()
+
+    def get(self, uuid: UUID) -> list[dict] | None:
+        """The engagements uuid was last recalculated from, if remembered."""
+        return self._engagements.get(uuid)
+
+    def record(self, uuid: UUID, engagements: list[dict]) -> None:
+        """Record a completed recalculation of uuid from engagements."""
+        self._engagements[uuid] = engagements
+        self._engagements.move_to_end(uuid)
+        while len(self._engagements) > self.max_size:
+            self._engagements.popitem(last=False)
+
+
+class EngagementHistory(NamedTuple):
+    """The entire engagement history of a person, already read from MO."""
+
+    # When the read was started, as given by RecalculationWatermarks.now
+    read_at: float
+    # The engagements, shaped as read by MoraHelper.read_user_engagements
+    engagements: list[dict]
+
+
+def calculate_user(
+    updater: MOPrimaryEngagementUpdater,
+    uuid: UUID,
+    watermarks: RecalculationWatermarks | None = None,
+    history: EngagementHistory | None = None,
+    window: tuple[datetime, datetime] | None = None,
+) -> int:
     """Recalculate the user given by uuid.
 
     Called for the side-effect of making calls against MO using the updater.
@@ -26,19 +151,260 @@ def calculate_user(updater: MOPrimaryEngagementUpdater, uuid: UUID) -> None:
     Args:
         updater: The calculate primary updater instance.
         uuid: UUID for the user to recalculate.
+        watermarks: Watermarks to record the recalculation in once it completes.
+        history: Engagement history of the user to recalculate from, instead of
+            reading it from MO.
+        window: Part of the history to recalculate, see changed_window.
 
     Returns:
-        None
+        The number of edits made.
     """
     print(f"Recalculating user: {uuid}")
     last_processing.set_to_current_time()
     # TODO: An async version would be desireable
-    updates = updater.recalculate_user(uuid)
+    if history is not None:
+        # Covers just what was read, i.e. events received before the read started
+        started_at = history.read_at
+        updates = updater.recalculate_user(
+            uuid, mo_engagements=history.engagements, window=window
+        )
+    else:
+        started_at = RecalculationWatermarks.now()
+        updates = updater.recalculate_user(uuid, window=window)
+    # Only completed recalculations cover events, failed ones are retried
+    if watermarks is not None:
+        watermarks.record(uuid, started_at)
     # Update edit metrics
     for number_of_edits in updates.values():
         if number_of_edits == 0:
             no_edit_counter.inc()
         edit_counter.inc(number_of_edits)
+    return sum(updates.values())
+
+
+class PersonRecalculator:
+    """Recalculate persons on behalf of the event handlers.
+
+    Recalculations run in worker threads, to keep processing other events while
+    the updater blocks on MO, but never more than one at a time for the same
+    person, never more than the limiter currently allows in total, and not at all
+    while the circuit breaker considers MO to be down.
+
+    Persons whose recalculation keeps failing for other reasons than MO being
+    unavailable are parked, by publishing them to the parking queue, and their
+    events are skipped until their engagement data changes.
+
+    Recalculations are scheduled by priority lane, see AdaptiveLimiter.slot.
+
+    Event handlers may hand over the engagement history of the person, if they
+    already read it, in which case the recalculation uses the most recently read
+    history, unless an event without history was received after it was read.
+    Recalculations from a history are bounded to the window of time in which it
+    changed since the last recalculation of the person, and all recalculations to
+    the history_horizon, unless a full recalculation is requested.
+
+    Persons recalculated from a history without making any edits, and without
+    bounding the recalculation to a window, are recorded as verified in the digest
+    store, if given, and skipped until their history changes, even across restarts.
+    """
+
+    def __init__(
+        self,
+        updater: MOPrimaryEngagementUpdater,
+        limiter: AdaptiveLimiter,
+        breaker: CircuitBreaker,
+        poison: PoisonPersons,
+        publish: Callable[[str, Any], Awaitable[None]],
+        history_cache_size: int = 10_000,
+        watermark_cache_size: int = 100_000,
+        history_horizon: timedelta | None = None,
+        digests: DigestStore | None = None,
+    ) -> None:
+        self.updater = updater
+        self.limiter = limiter
+        self.breaker = breaker
+        self.poison = poison
+        self.publish = publish
+        self.watermarks = RecalculationWatermarks(watermark_cache_size)
+        self.person_locks = CoalescingLock()
+        # Persons with interactive work merged into their pending recalculation
+        self._interactive: set[UUID] = set()
+        # Latest history handed over for the pending recalculation of persons,
+        # or the time of the latest event received without a history
+        self._histories: dict[UUID, tuple[float, EngagementHistory | None]] = {}
+        self.recalculated = RecalculatedHistories(history_cache_size)
+        self.history_horizon = history_horizon
+        # Persons with a full recalculation merged into their pending recalculation
+        self._full: set[UUID] = set()
+        self.digests = digests
+
+    async def recalculate(
+        self,
+        person_uuid: UUID,
+        received_at: float,
+        lane: str = BULK,
+        history: EngagementHistory | None = None,
+        full: bool = False,
+    ) -> None:
+        """Recalculate the person, unless already covered since received_at.
+
+        Args:
+            person_uuid: UUID of the person to recalculate.
+            received_at: When the triggering event was received.
+            lane: The priority lane of the triggering event.
+            history: Engagement history of the person, read after received_at.
+            full: Recalculate the entire history, regardless of history_horizon.
+        """
+        # A recalculation started after we received the event has already seen it,
+        # but might not have recalculated all of the history
+        if not full and self.watermarks.is_stale(person_uuid, received_at):
+            logger.info("Skipping already covered event", person_uuid=person_uuid)
+            stale_event_counter.inc()
+            return
+
+        if lane == INTERACTIVE:
+            # Merging into a pending bulk recalculation promotes it
+            self._interactive.add(person_uuid)
+        if full:
+            self._full.add(person_uuid)
+        # A history covers every event received before it was read
+        if history is not None:
+            self._hand_over(person_uuid, history.read_at, history)
+        else:
+            self._hand_over(person_uuid, received_at, None)
+
+        async def recalculate() -> None:
+            async with self.breaker.slot():
+                lane = INTERACTIVE if person_uuid in self._interactive else BULK
+                self._interactive.discard(person_uuid)
+                async with self.limiter.slot(lane):
+                    # Take over everything handed over until now, which may include
+                    # the events of calls since merged into a follow-up call
+                    pending = self._histories.pop(person_uuid, None)
+                    full = person_uuid in self._full
+                    self._full.discard(person_uuid)
+                    if pending is None or (
+                        not full and self.watermarks.is_stale(person_uuid, pending[0])
+                    ):
+                        logger.info(
+                            "Skipping covered recalculation", person_uuid=person_uuid
+                        )
+                        stale_event_counter.inc()
+                        return
+                    try:
+                        await self._recalculate(person_uuid, pending[1], full)
+                    except BaseException:
+                        # Left for the follow-up call, or the retry of the event
+                        self._hand_over(person_uuid, *pending)
+                        if full:
+                            self._full.add(person_uuid)
+                        raise
+
+        await self.person_locks.run(person_uuid, recalculate)
+
+    def horizon(self) -> datetime | None:
+        """Start of the history recalculated on events, unless unbounded."""
+        if self.history_horizon is None:
+            return None
+        return (
+            datetime.combine(date.today(), datetime.min.time()) - self.history_horizon
+        )
+
+    def _hand_over(
+        self, person_uuid: UUID, covers: float, history: EngagementHistory | None
+    ) -> None:
+        """Hand over the events up to covers, keeping the most recent history."""
+        pending = self._histories.get(person_uuid)
+        if pending is None or covers >= pending[0]:
+            self._histories[person_uuid] = (covers, history)
+
+    async def _recalculate(
+        self, person_uuid: UUID, history: EngagementHistory | None, full: bool
+    ) -> None:
+        digest = None
+        parked_digest = self.poison.parked_digest(person_uuid)
+        if parked_digest is not None or self.poison.is_last_attempt(person_uuid):
+            # Read before recalculating, so changes made meanwhile are never missed
+            digest = await asyncio.to_thread(
+                self.updater.read_engagement_digest, person_uuid
+            )
+        if parked_digest is not None:
+            if digest == parked_digest:
+                logger.info("Skipping unchanged parked person", person_uuid=person_uuid)
+                parked_skip_counter.inc()
+                return
+            logger.info("Unparking person with changed data", person_uuid=person_uuid)
+            self.poison.unpark(person_uuid)
+
+        window = None
+        if full:
+            # Histories handed over by events are bounded to the horizon
+            history = None
+        verified = None
+        if history is not None and self.digests is not None:
+            verified = self.updater.history_digest(history.engagements)
+            if await asyncio.to_thread(self.digests.get, person_uuid) == verified:
+                logger.info("Skipping verified person", person_uuid=person_uuid)
+                verified_skip_counter.inc()
+                self.watermarks.record(person_uuid, history.read_at)
+                return
+        previous = self.recalculated.get(person_uuid) if history else None
+        if history is not None and previous is not None:
+            window = changed_window(previous, history.engagements)
+            if window is None:
+                logger.info("Skipping unchanged history", person_uuid=person_uuid)
+                unchanged_history_counter.inc()
+                self.watermarks.record(person_uuid, history.read_at)
+                return
+        horizon = None if full else self.horizon()
+        if horizon is not None:
+            start, end = window or (horizon, datetime(9999, 12, 30))
+            window = (max(start, horizon), end)
+
+        try:
+            edits = await asyncio.to_thread(
+                calculate_user,
+                self.updater,
+                person_uuid,
+                self.watermarks,
+                history,
+                window,
+            )
+        except Exception as exception:
+            # MO being unavailable says nothing about the data of the person
+            if isinstance(exception, CircuitOpenError) or is_transient(exception):
+                raise
+            failures = self.poison.record_failure(person_uuid)
+            if failures < self.poison.max_attempts:
+                raise
+            await self._park(person_uuid, digest, failures, exception)
+            return
+        self.poison.record_success(person_uuid)
+        if history is not None:
+            self.recalculated.record(person_uuid, history.engagements)
+        # Recalculating only a window verifies just that
+        if verified is not None and window is None and edits == 0:
+            decision = self.updater.primary_decision(history.engagements)
+            await asyncio.to_thread(
+                self.digests.record, person_uuid, verified, decision
+            )
+
+    async def _park(
+        self, person_uuid: UUID, digest: str, failures: int, exception: Exception
+    ) -> None:
+        reason = f"{type(exception).__name__}: {exception}"
+        logger.error(
+            "Parking person after repeated failures",
+            person_uuid=person_uuid,
+            failures=failures,
+            reason=reason,
+        )
+        await self.publish(
+            PARKED_ROUTING_KEY,
+            {"uuid": person_uuid, "reason": reason, "attempts": failures},
+        )
+        self.poison.park(person_uuid, digest)
+        parked_counter.inc()
 
 
 def _setup_updater(settings: Settings) -> MOPrimaryEngagementUpdater:
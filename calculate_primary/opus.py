@@ -11,12 +11,19 @@ logger = structlog.stdlib.get_logger()
 
 
 class OPUSPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
+    # The attributes used by _decide_primary and _find_primary
+    decision_attributes = ("uuid", "user_key", "engagement_type", "primary")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # Currently primary is set first by engagement type (order given in
         # settings) and secondly by job_id.
         # TODO: Check that configured eng_types exist
+        self._engagement_type_order = {
+            str(uuid): rank
+            for rank, uuid in enumerate(self.settings.eng_types_primary_order)
+        }
 
         def remove_missing_user_key(user_uuid, no_past, engagement):
             return "user_key" in engagement
@@ -56,21 +63,16 @@ class OPUSPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
 
         return primary_dict, primary_list
 
-    def _find_primary(self, mo_engagements):
+    def _primary_rank(self, engagement):
         # The primary engagement is the engagement with the lowest engagement type.
         # - The order of engagement types is given by self.settings.eng_types_primary_order.
         #
         # If two engagements have the same engagement_type, the tie is broken by
         # picking the one with the lowest user-key integer.
         def get_engagement_type_id(engagement):
-            if (
-                engagement["engagement_type"]["uuid"]
-                in self.settings.eng_types_primary_order
-            ):
-                return self.settings.eng_types_primary_order.index(
-                    engagement["engagement_type"]["uuid"]
-                )
-            return math.inf
+            # MO gives engagement type UUIDs as strings, unlike the settings
+            engagement_type = str(engagement["engagement_type"]["uuid"])
+            return self._engagement_type_order.get(engagement_type, math.inf)
 
         def get_engagement_order(engagement):
             try:
@@ -85,9 +87,9 @@ class OPUSPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
                 logger.exception(exp)
                 return math.inf
 
-        primary_engagement = min(
-            mo_engagements,
-            # Sort first by engagement_type, then by user_key integer
-            key=lambda eng: (get_engagement_type_id(eng), get_engagement_order(eng)),
-        )
+        # Sort first by engagement_type, then by user_key integer
+        return get_engagement_type_id(engagement), get_engagement_order(engagement)
+
+    def _find_primary(self, mo_engagements):
+        primary_engagement = min(mo_engagements, key=self._primary_rank)
         return primary_engagement["uuid"]
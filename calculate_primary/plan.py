@@ -0,0 +1,207 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Recalculate primary engagements in two phases: planning edits, then applying them.
+
+The plan phase reads and decides like a recalculation, but writes the intended
+edits to a plan file, one JSON object per line, rather than to MO. The plan can be
+reviewed, and applied later, e.g. outside office hours, with a write concurrency
+independent of the reads. An interrupted apply is resumed by running it again.
+
+Example:
+    python -m calculate_primary.plan plan primaries.jsonl --snapshot today.snapshot
+    python -m calculate_primary.plan apply primaries.jsonl --concurrency 20
+"""
+import argparse
+import hashlib
+import json
+import threading
+from collections import defaultdict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import Any
+
+import structlog
+
+from calculate_primary.common import MOPrimaryEngagementUpdater
+from calculate_primary.config import Settings
+from calculate_primary.main import _setup_updater
+from calculate_primary.store import EngagementStore
+
+logger = structlog.stdlib.get_logger()
+
+
+class PlanWriter:
+    """Write planned edits to a plan file, as they are handed to it.
+
+    Each edit is flushed as it is written, so an interrupted plan phase leaves a
+    valid, if partial, plan. The progress of applying any earlier plan at the same
+    path is discarded, as it is of no concern to the new plan.
+
+    Example:
+        with PlanWriter(path) as plan:
+            updater.recalculate_all(plan=plan)
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.count = 0
+        self._file: Any = None
+
+    def __enter__(self) -> "PlanWriter":
+        progress_path(self.path).unlink(missing_ok=True)
+        self._file = self.path.open("w")
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._file.close()
+
+    def __call__(self, edit: dict[str, Any]) -> None:
+        """Write an edit, as made by MOPrimaryEngagementUpdater._ensure_primary."""
+        self._file.write(json.dumps(edit, sort_keys=True) + "\n")
+        self._file.flush()
+        self.count += 1
+
+
+def read_plan(path: Path) -> Iterator[tuple[int, dict[str, Any]]]:
+    """Line numbers and edits of a plan file, skipping blank lines."""
+    with path.open() as plan:
+        for number, line in enumerate(plan, start=1):
+            if line.strip():
+                yield number, json.loads(line)
+
+
+def progress_path(path: Path) -> Path:
+    """Path of the file recording the lines of the plan at path already applied."""
+    return path.with_name(path.name + ".applied")
+
+
+def edit_key(number: int, edit: dict[str, Any]) -> str:
+    """Identity of the edit at line number of a plan, as kept in its progress file.
+
+    Includes a digest of the edit itself, so the progress of applying one plan is
+    never mistaken for that of another plan written to the same path.
+    """
+    digest = hashlib.sha256(json.dumps(edit, sort_keys=True).encode()).hexdigest()
+    return f"{number}:{digest}"
+
+
+def apply_plan(
+    updater: MOPrimaryEngagementUpdater, path: Path, concurrency: int = 10
+) -> int:
+    """Apply the edits of a plan file to MO, resuming any previous apply.
+
+    Edits of different engagements are written concurrently, while the edits of
+    each engagement are written one at a time in plan order, as later edits may
+    overlap earlier ones. The key of each applied edit, see edit_key, is appended
+    to the progress file, see progress_path, and skipped when applying again.
+
+    Args:
+        updater: The updater to write the edits with.
+        path: Path of the plan file.
+        concurrency: Maximum number of edits to write at once.
+
+    Returns:
+        The number of engagements whose edits failed, and which are left for the
+        next apply.
+
+    Raises:
+        ValueError: If the updater is running dry, as the edits would be recorded
+            as applied without having been written.
+    """
+    if updater.settings.dry_run:
+        raise ValueError("Refusing to apply a plan while running dry")
+    progress = progress_path(path)
+    applied = set()
+    if progress.exists():
+        applied = set(progress.read_text().split())
+
+    edits_by_engagement = defaultdict(list)
+    for number, edit in read_plan(path):
+        if edit_key(number, edit) not in applied:
+            edits_by_engagement[edit["engagement"]].append((number, edit))
+    logger.info(
+        "Applying plan",
+        path=str(path),
+        engagements=len(edits_by_engagement),
+        resumed=len(applied),
+    )
+
+    lock = threading.Lock()
+    with progress.open("a") as progress_file:
+
+        def apply_edits(edits: list[tuple[int, dict[str, Any]]]) -> None:
+            for number, edit in edits:
+                payload = {
+                    "type": "engagement",
+                    "uuid": edit["engagement"],
+                    "data": {
+                        "primary": {"uuid": edit["primary"]},
+                        "validity": edit["validity"],
+                    },
+                }
+                updater.write_edit(payload)
+                with lock:
+                    progress_file.write(edit_key(number, edit) + "\n")
+                    progress_file.flush()
+
+        failures = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(apply_edits, edits): engagement
+                for engagement, edits in edits_by_engagement.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception("Unable to apply edit", engagement=futures[future])
+                    failures += 1
+    return failures
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="phase", required=True)
+
+    plan_parser = subparsers.add_parser("plan", help="Write the edits to a plan file")
+    plan_parser.add_argument("plan", type=Path, help="Path of the plan file to write")
+    plan_parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Snapshot to read engagement histories from, rather than from MO",
+    )
+    plan_parser.add_argument(
+        "--no-past", action="store_true", help="Do not recalculate the past"
+    )
+
+    apply_parser = subparsers.add_parser("apply", help="Apply the edits of a plan")
+    apply_parser.add_argument("plan", type=Path, help="Path of the plan file to apply")
+    apply_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Maximum number of edits to write at once",
+    )
+    args = parser.parse_args(argv)
+
+    updater = _setup_updater(Settings())
+    if args.phase == "plan":
+        store = None
+        if args.snapshot is not None:
+            store = EngagementStore.open_snapshot(args.snapshot)
+        with PlanWriter(args.plan) as plan:
+            updater.recalculate_all(no_past=args.no_past, store=store, plan=plan)
+        print("Planned edits: {}".format(plan.count))
+        return
+
+    failures = apply_plan(updater, args.plan, args.concurrency)
+    if failures:
+        raise SystemExit(
+            "Edits of {} engagements failed, apply again to retry".format(failures)
+        )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
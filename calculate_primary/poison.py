@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Parking of persons whose recalculation keeps failing."""
+from collections import OrderedDict
+from types import TracebackType
+from uuid import UUID
+
+import structlog
+from aio_pika import ExchangeType
+from aio_pika import connect
+from fastramqpi.ramqp.mo import MOAMQPSystem
+from prometheus_client import Counter
+
+logger = structlog.stdlib.get_logger()
+
+PARKED_ROUTING_KEY = "calculate_primary.parked"
+
+parked_counter = Counter("recalculate_parked", "Number of persons parked")
+parked_skip_counter = Counter(
+    "recalculate_parked_skip", "Number of events skipped for unchanged parked persons"
+)
+
+
+class PoisonPersons:
+    """Bounded bookkeeping of persons whose recalculation keeps failing.
+
+    Consecutive failures are counted per person, and once max_attempts is reached
+    the person is parked along with a digest of its engagement data. Events for a
+    parked person are skipped until its engagement data changes.
+
+    Both failure counts and parked persons are kept in least-recently-used order,
+    and trimmed to max_size entries, thus forgetting a person merely costs retries.
+    """
+
+    def __init__(self, max_attempts: int, max_size: int) -> None:
+        self.max_attempts = max_attempts
+        self.max_size = max_size
+        self._failures: OrderedDict[UUID, int] = OrderedDict()
+        self._parked: OrderedDict[UUID, str] = OrderedDict()
+
+    @staticmethod
+    def _put(entries: OrderedDict, key: UUID, value, max_size: int) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > max_size:
+            entries.popitem(last=False)
+
+    def is_last_attempt(self, uuid: UUID) -> bool:
+        """Whether a failure of the next attempt for uuid will park it."""
+        return self._failures.get(uuid, 0) + 1 >= self.max_attempts
+
+    def record_failure(self, uuid: UUID) -> int:
+        """Record a failed attempt for uuid, returning the number of failures."""
+        failures = self._failures.get(uuid, 0) + 1
+        self._put(self._failures, uuid, failures, self.max_size)
+        return failures
+
+    def record_success(self, uuid: UUID) -> None:
+        """Forget earlier failures of uuid."""
+        self._failures.pop(uuid, None)
+
+    def park(self, uuid: UUID, digest: str) -> None:
+        """Park uuid, until its engagement data no longer matches digest."""
+        self._failures.pop(uuid, None)
+        self._put(self._parked, uuid, digest, self.max_size)
+
+    def parked_digest(self, uuid: UUID) -> str | None:
+        """The engagement data digest uuid was parked with, if parked."""
+        return self._parked.get(uuid)
+
+    def unpark(self, uuid: UUID) -> None:
+        """Stop skipping events for uuid."""
+        self._parked.pop(uuid, None)
+
+
+class ParkingQueue:
+    """Lifespan manager declaring the durable queue collecting parked persons.
+
+    The queue is not consumed by this program, but kept for inspection and for
+    manually requeueing persons once their data has been corrected.
+
+    The queue must be bound before the AMQP system starts consuming events, as
+    persons parked before then would otherwise be routed nowhere and lost, thus
+    it is declared through a connection of its own.
+    """
+
+    def __init__(self, amqpsystem: MOAMQPSystem, queue_name: str) -> None:
+        self.amqpsystem = amqpsystem
+        self.queue_name = queue_name
+
+    async def __aenter__(self) -> "ParkingQueue":
+        settings = self.amqpsystem.settings
+        logger.info("Declaring parking queue", queue=self.queue_name)
+        connection = await connect(str(settings.get_url()))
+        async with connection, connection.channel() as channel:
+            # Declared like the AMQP system declares it, which may not have yet
+            exchange = await channel.declare_exchange(
+                settings.exchange, ExchangeType.TOPIC, durable=True
+            )
+            queue = await channel.declare_queue(self.queue_name, durable=True)
+            await queue.bind(exchange, routing_key=PARKED_ROUTING_KEY)
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        pass
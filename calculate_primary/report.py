@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Machine-readable reports of checks, audits and dry-run recalculations.
+
+Rather than printing a line per finding, findings of check_all or
+audit_primaries and the edits a recalculation would make are written as a stream
+of records, either NDJSON or CSV, through a buffered file, ending with summary
+statistics.
+
+Example:
+    python -m calculate_primary.report check findings.csv --format csv
+    python -m calculate_primary.report audit findings.ndjson
+    python -m calculate_primary.report recalculate edits.ndjson --snapshot today.snapshot
+"""
+import argparse
+import asyncio
+import csv
+import json
+from collections import Counter
+from collections.abc import Collection
+from datetime import date
+from pathlib import Path
+from typing import Any
+from typing import Literal
+
+from calculate_primary.audit import audit_primaries
+from calculate_primary.common import CHECK_CONCURRENCY
+from calculate_primary.config import Settings
+from calculate_primary.main import _setup_updater
+from calculate_primary.snapshot import open_graphql_client
+from calculate_primary.store import EngagementStore
+
+ReportFormat = Literal["ndjson", "csv"]
+
+# Columns of CSV reports, records of every kind being flattened to these
+CSV_COLUMNS = [
+    "kind",
+    "person",
+    "date",
+    "finding",
+    "engagement",
+    "from",
+    "to",
+    "primary",
+    "reason",
+    "count",
+]
+
+# Findings are few compared to the engagements checked, but not so few that they
+# should be written one system call at a time
+BUFFER_SIZE = 1 << 20
+
+
+class Report:
+    """Buffered writer of findings and edits, counting them for the summary.
+
+    Edits are written by calling the report, making it usable as the plan of a
+    recalculation, which thus makes no edits, see recalculate_all.
+
+    Example:
+        with Report(path, "csv") as report:
+            updater.check_all(report=report)
+        print(report.findings)
+    """
+
+    def __init__(self, path: Path, report_format: ReportFormat = "ndjson") -> None:
+        self.path = path
+        self.format = report_format
+        self.findings: Counter[str] = Counter()
+        self.edits: Counter[str] = Counter()
+        self._file: Any = None
+        self._csv: Any = None
+
+    def __enter__(self) -> "Report":
+        self._file = self.path.open("w", buffering=BUFFER_SIZE, newline="")
+        if self.format == "csv":
+            self._csv = csv.DictWriter(self._file, CSV_COLUMNS)
+            self._csv.writeheader()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        try:
+            self._write_summary()
+        finally:
+            self._file.close()
+
+    def _write(self, record: dict[str, Any]) -> None:
+        if self._csv is not None:
+            self._csv.writerow(record)
+            return
+        self._file.write(json.dumps(record, default=str) + "\n")
+
+    def finding(self, person: str, at: date, finding: str) -> None:
+        """Write a finding of checking person, valid from the date at."""
+        self.findings[finding] += 1
+        self._write(
+            {"kind": "finding", "person": person, "date": at, "finding": finding}
+        )
+
+    def __call__(self, edit: dict[str, Any]) -> None:
+        """Write an edit, as made by MOPrimaryEngagementUpdater.recalculate_user."""
+        self.edits[edit["reason"]] += 1
+        record = {"kind": "edit", **edit}
+        if self._csv is not None:
+            validity = record.pop("validity")
+            record.update({"from": validity["from"], "to": validity["to"]})
+        self._write(record)
+
+    def _write_summary(self) -> None:
+        if self._csv is None:
+            self._write(
+                {
+                    "kind": "summary",
+                    "findings": dict(self.findings),
+                    "edits": dict(self.edits),
+                }
+            )
+            return
+        for finding, count in sorted(self.findings.items()):
+            self._write({"kind": "summary", "finding": finding, "count": count})
+        for reason, count in sorted(self.edits.items()):
+            self._write({"kind": "summary", "reason": reason, "count": count})
+
+
+async def write_audit(
+    settings: Settings, primary_types: Collection[str], report: Report
+) -> None:
+    async with open_graphql_client(settings) as graphql_client:
+        await audit_primaries(graphql_client, primary_types, report=report)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "mode",
+        choices=["check", "audit", "recalculate"],
+        help="Check all persons, audit their current primaries, or recalculate them "
+        "without making any edits",
+    )
+    parser.add_argument("report", type=Path, help="Path of the report to write")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        help="Snapshot to read engagement histories from, rather than from MO",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CHECK_CONCURRENCY,
+        help="Maximum number of persons to check at once",
+    )
+    args = parser.parse_args(argv)
+
+    settings = Settings()
+    updater = _setup_updater(settings)
+    store = None
+    if args.snapshot is not None:
+        store = EngagementStore.open_snapshot(args.snapshot)
+    with Report(args.report, args.format) as report:
+        if args.mode == "check":
+            updater.check_all(store=store, report=report, concurrency=args.concurrency)
+        elif args.mode == "audit":
+            asyncio.run(write_audit(settings, updater.primary, report))
+        else:
+            updater.recalculate_all(store=store, plan=report)
+    print("Findings: {}".format(sum(report.findings.values())))
+    for finding, count in sorted(report.findings.items()):
+        print("  {}: {}".format(finding, count))
+    print("Edits: {}".format(sum(report.edits.values())))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
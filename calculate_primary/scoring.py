@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Batched primary scoring over columns of engagements, for whole-organisation runs.
+
+Rather than deciding the primary among the engagements of one person in one
+interval at a time, the engagements of any number of persons and intervals are
+given as columns, and all primaries are decided at once by a single sort.
+
+Used by bulk recalculations when Settings.batched_scoring is set, see
+MOPrimaryEngagementUpdater._batched_primaries.
+
+NOTE: Requires NumPy, which is an optional dependency, installed by the scoring extra.
+"""
+from collections.abc import Iterable
+from collections.abc import Sequence
+from typing import Any
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+# User keys of SD engagements which are not integers, are only primary if no other
+# engagements are present, see SDPrimaryEngagementUpdater._primary_rank
+SD_NON_INTEGER_SCORE = 100000
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise ImportError("Batched primary scoring requires NumPy to be installed")
+
+
+def _user_key_scores(
+    user_keys: Sequence[Any],
+    default: float,
+    errors: tuple[type[Exception], ...] = (ValueError,),
+) -> "np.ndarray":
+    """Integer values of user keys, or default for user keys raising errors.
+
+    The errors are those caught by the _primary_rank of the integration, thus any
+    other error, e.g. a TypeError of a missing user key, is raised just the same.
+    """
+
+    def score(user_key: Any) -> float:
+        try:
+            return int(user_key)
+        except errors:
+            return default
+
+    return np.fromiter(map(score, user_keys), dtype=float, count=len(user_keys))
+
+
+class EngagementColumns(NamedTuple):
+    """Engagements of many persons and intervals, as one column per attribute.
+
+    Row i of every column describes the same engagement, active for the person
+    person[i] in the interval interval[i]. Together the two identify the group
+    among which a single primary is decided.
+    """
+
+    person: "np.ndarray"
+    interval: "np.ndarray"
+    fraction: "np.ndarray"
+    user_key: "np.ndarray"
+    type_rank: "np.ndarray"
+    fixed: "np.ndarray"
+
+    @classmethod
+    def from_engagements(
+        cls,
+        rows: Iterable[tuple[int, int, dict[str, Any]]],
+        fixed_primary: str,
+        eng_types_primary_order: Sequence[str] = (),
+    ) -> "EngagementColumns":
+        """Build columns from MO engagements.
+
+        Args:
+            rows: Tuples of person id, interval id and the MO engagement.
+            fixed_primary: UUID of the fixed_primary primary type.
+            eng_types_primary_order: Engagement type UUIDs in order of primarity.
+
+        Returns:
+            The columns of the engagements.
+        """
+        require_numpy()
+        order = {str(uuid): rank for rank, uuid in enumerate(eng_types_primary_order)}
+        persons, intervals, engagements = tuple(zip(*rows)) or ((), (), ())
+
+        def type_rank(engagement: dict[str, Any]) -> float:
+            engagement_type = engagement.get("engagement_type") or {}
+            return order.get(str(engagement_type.get("uuid")), np.inf)
+
+        def is_fixed(engagement: dict[str, Any]) -> bool:
+            return (engagement.get("primary") or {}).get("uuid") == fixed_primary
+
+        return cls(
+            person=np.asarray(persons, dtype=np.int64),
+            interval=np.asarray(intervals, dtype=np.int64),
+            fraction=np.asarray(
+                [e.get("fraction") or 0 for e in engagements], dtype=float
+            ),
+            # Kept as is, as converting e.g. None to "None" would change its rank
+            user_key=np.asarray([e["user_key"] for e in engagements], dtype=object),
+            type_rank=np.asarray(list(map(type_rank, engagements)), dtype=float),
+            fixed=np.asarray(list(map(is_fixed, engagements)), dtype=bool),
+        )
+
+
+def rank_keys(integration: str, columns: EngagementColumns) -> list["np.ndarray"]:
+    """Sort keys equivalent to the _primary_rank of an integration.
+
+    Args:
+        integration: The integration, as in Settings.integration.
+        columns: The engagements to rank.
+
+    Returns:
+        Sort keys, most significant first, the lowest ranked engagement being the
+        primary one.
+    """
+    require_numpy()
+    if integration == "DEFAULT":
+        # Highest fraction, then the highest user key, compared as strings
+        _, user_key_order = np.unique(columns.user_key, return_inverse=True)
+        return [-columns.fraction, -user_key_order]
+    if integration == "SD":
+        # Highest fraction, then the lowest integer user key
+        scores = _user_key_scores(columns.user_key, SD_NON_INTEGER_SCORE)
+        return [-columns.fraction, scores]
+    if integration == "OPUS":
+        # Lowest engagement type rank, then the lowest integer user key, any user
+        # key which is not an integer ranking last
+        scores = _user_key_scores(columns.user_key, np.inf, errors=(Exception,))
+        return [columns.type_rank, scores]
+    raise NotImplementedError(f"Unexpected integration: {integration}")
+
+
+class Primaries(NamedTuple):
+    """Decided primaries, one per group of person and interval."""
+
+    person: "np.ndarray"
+    interval: "np.ndarray"
+    # Row of the primary engagement in the columns
+    row: "np.ndarray"
+    # Whether the primary is fixed_primary rather than primary
+    fixed: "np.ndarray"
+    # Whether the group has multiple fixed primaries, and thus no valid primary
+    conflict: "np.ndarray"
+
+
+def find_primaries(integration: str, columns: EngagementColumns) -> Primaries:
+    """Decide the primary engagement of every group of person and interval.
+
+    Equivalent to _decide_primary on the engagements of each group: a single fixed
+    primary engagement is the primary, and otherwise the primary is the one found
+    by the _find_primary of the integration. Ties are broken by row order, just as
+    by max and min in _find_primary.
+
+    Args:
+        integration: The integration, as in Settings.integration.
+        columns: The engagements of all groups.
+
+    Returns:
+        The primaries, ordered by person and interval.
+    """
+    require_numpy()
+    if len(columns.person) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return Primaries(empty, empty, empty, empty.astype(bool), empty.astype(bool))
+
+    keys = rank_keys(integration, columns)
+    # np.lexsort sorts by its last key first and is stable, thus each group is
+    # sorted with fixed primaries first, then by rank, then by row
+    order = np.lexsort(
+        (*reversed(keys), ~columns.fixed, columns.interval, columns.person)
+    )
+    person = columns.person[order]
+    interval = columns.interval[order]
+    starts = np.flatnonzero(
+        np.r_[True, (person[1:] != person[:-1]) | (interval[1:] != interval[:-1])]
+    )
+    fixed_counts = np.add.reduceat(columns.fixed[order].astype(np.int64), starts)
+    return Primaries(
+        person=person[starts],
+        interval=interval[starts],
+        row=order[starts],
+        fixed=fixed_counts > 0,
+        conflict=fixed_counts > 1,
+    )
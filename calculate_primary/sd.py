@@ -5,6 +5,7 @@ import datetime
 
 import structlog
 
+from calculate_primary.common import Descending
 from calculate_primary.common import MOPrimaryEngagementUpdater
 
 logger = structlog.stdlib.get_logger()
@@ -71,6 +72,9 @@ def get_primary_types(helper):
 
 
 class SDPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
+    # The attributes used by _decide_primary and _find_primary
+    decision_attributes = ("uuid", "user_key", "fraction", "primary")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -98,28 +102,23 @@ class SDPrimaryEngagementUpdater(MOPrimaryEngagementUpdater):
         ]
         return primary_types, primary
 
-    def _find_primary(self, mo_engagements):
-        def set_primary_score(mo_engagement):
-            # Engagements with non-integer user_keys are only primary if no other engagements are present
-            try:
-                mo_engagement["primary_score"] = int(mo_engagement["user_key"])
-            except ValueError:
-                mo_engagement["primary_score"] = 100000
-
-        for e in mo_engagements:
-            set_primary_score(e)
-
-        if not mo_engagements:
-            return None
+    def _primary_rank(self, engagement):
+        # Engagements with non-integer user_keys are only primary if no other engagements are present
+        try:
+            primary_score = int(engagement["user_key"])
+        except ValueError:
+            primary_score = 100000
 
         # The primary engagement is the engagement with the highest occupation rate.
         # - The occupation rate is found as 'fraction' on the engagement.
         #
         # If two engagements have the same occupation rate, the tie is broken by
         # picking the one with the lowest user-key integer.
-        primary_engagement = max(
-            mo_engagements,
-            # Sort first by fraction, then reversely by user_key integer
-            key=lambda eng: (eng.get("fraction") or 0, -eng["primary_score"]),
-        )
+        return Descending(engagement.get("fraction") or 0), primary_score
+
+    def _find_primary(self, mo_engagements):
+        if not mo_engagements:
+            return None
+
+        primary_engagement = min(mo_engagements, key=self._primary_rank)
         return primary_engagement["uuid"]
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Consistent-hash sharding of persons across replicas."""
+from uuid import UUID
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash of key into one of buckets.
+
+    See "A Fast, Minimal Memory, Consistent Hash Algorithm" by Lamping and Veach.
+    When the number of buckets grows from n to n+1, only 1/(n+1) of all keys move,
+    and they all move to the new bucket.
+
+    Args:
+        key: The 64-bit key to hash.
+        buckets: The number of buckets.
+
+    Returns:
+        The bucket in range(buckets) that key hashes into.
+    """
+    assert buckets > 0
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(person_uuid: UUID, shards: int) -> int:
+    """Find the shard owning person_uuid."""
+    # Fold both halves of the UUID, as the version bits sit in the upper half
+    return jump_hash((person_uuid.int >> 64) ^ person_uuid.int, shards)
+
+
+def shard_routing_key(shard: int, lane: str = "*") -> str:
+    """Routing key for person work belonging to shard, in the given priority lane.
+
+    The default lane is a wildcard, for binding to the work of all lanes.
+    """
+    return f"calculate_primary.person.{shard}.{lane}"
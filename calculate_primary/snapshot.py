@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Write a snapshot of the engagements of the whole organisation, streamed from MO.
+
+The snapshot is what diff, plan and report read engagement histories from, rather
+than reading them from MO person by person.
+
+Example:
+    python -m calculate_primary.snapshot today.snapshot
+"""
+import argparse
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from authlib.integrations.httpx_client import AsyncOAuth2Client
+
+from calculate_primary.autogenerated_graphql_client import GraphQLClient
+from calculate_primary.config import Settings
+from calculate_primary.store import stream_snapshot
+
+# The GraphQL version used by the application, see create_app
+GRAPHQL_VERSION = 22
+
+
+@asynccontextmanager
+async def open_graphql_client(settings: Settings) -> AsyncIterator[GraphQLClient]:
+    """Authenticated GraphQL client, as constructed by FastRAMQPI for the app."""
+    fastramqpi = settings.fastramqpi
+    mo_client = AsyncOAuth2Client(
+        base_url=fastramqpi.mo_url,
+        client_id=fastramqpi.client_id,
+        client_secret=fastramqpi.client_secret.get_secret_value(),
+        grant_type="client_credentials",
+        token_endpoint=f"{fastramqpi.auth_server}/realms/{fastramqpi.auth_realm}"
+        "/protocol/openid-connect/token",
+        # Fetch a token on the first request, rather than only refreshing it
+        token={"expires_at": -1, "access_token": ""},
+        timeout=fastramqpi.graphql_timeout,
+    )
+    async with mo_client:
+        graphql_client = GraphQLClient(
+            url=f"{fastramqpi.mo_url}/graphql/v{GRAPHQL_VERSION}",
+            http_client=mo_client,
+        )
+        async with graphql_client as client:
+            yield client
+
+
+async def write_snapshot(settings: Settings, path: Path, page_size: int) -> int:
+    async with open_graphql_client(settings) as graphql_client:
+        return await stream_snapshot(graphql_client, path, page_size)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("snapshot", type=Path, help="Path of the snapshot to write")
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=500,
+        help="Number of engagements to read from MO per request",
+    )
+    args = parser.parse_args(argv)
+
+    rows = asyncio.run(write_snapshot(Settings(), args.snapshot, args.page_size))
+    print("Engagement validities: {}".format(rows))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,642 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Columnar in-memory store of the engagement histories of the whole organisation."""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Sequence
+from datetime import date
+from datetime import datetime
+from itertools import accumulate
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+import structlog
+
+from calculate_primary.autogenerated_graphql_client import (
+    GetEngagementsEngagementsObjectsValidities as EngagementValidity,
+)
+from calculate_primary.autogenerated_graphql_client import GraphQLClient
+
+logger = structlog.stdlib.get_logger()
+
+# Sentinels of the integer columns, for missing values and open-ended validities
+NONE = -1
+NO_END = date.max.toordinal()
+
+# Snapshot file layout, of little-endian int32s unless otherwise noted:
+# * Header: Magic, version, and the number of rows, persons, UUIDs, user keys and
+#   bytes of user keys.
+# * The columns, in order of EngagementStore.COLUMNS, of a value per row each.
+# * The person index: Person UUID indices, and their offsets (one more).
+# * The UUID table: UUIDs of 16 bytes each, and their indices in sorted order.
+# * The user key table: Offsets (one more), and the UTF-8 encoded user keys.
+SNAPSHOT_MAGIC = b"CPSNAP"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<6sH5I")
+
+
+class InternTable:
+    """Table of distinct values, each identified by its (integer) index."""
+
+    def __init__(self) -> None:
+        self.values: list = []
+        self._index: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value) -> int:
+        """Index of value, adding it to the table if not already present."""
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def index(self, value) -> int | None:
+        """Index of value, or None if not present."""
+        return self._index.get(value)
+
+
+class _UUIDValues(Sequence[bytes]):
+    """UUIDs of a snapshot UUID table, as bytes."""
+
+    def __init__(self, table: memoryview) -> None:
+        self._table = table
+
+    def __len__(self) -> int:
+        return len(self._table) // 16
+
+    def __getitem__(self, index: int) -> bytes:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._table[16 * index : 16 * (index + 1)].tobytes()
+
+
+class _UserKeyValues(Sequence[str]):
+    """User keys of a snapshot user key table."""
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return str(self._data[start:end], "utf-8")
+
+
+class SnapshotTable:
+    """Read-only InternTable of a snapshot, searched by bisection of its order."""
+
+    def __init__(self, values: Sequence, order: Sequence[int] = ()) -> None:
+        self.values = values
+        self._order = order
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def index(self, value) -> int | None:
+        """Index of value, or None if not present."""
+        position = bisect_left(self._order, value, key=self.values.__getitem__)
+        if position < len(self._order):
+            index = self._order[position]
+            if self.values[index] == value:
+                return index
+        return None
+
+
+def _int32_bytes(values: Sequence[int]) -> bytes:
+    values = array("i", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _to_ordinal(value: datetime | None) -> int:
+    return value.date().toordinal() if value is not None else NO_END
+
+
+def _engagement_row(
+    uuids: InternTable,
+    user_keys: InternTable,
+    person: UUID,
+    engagement: EngagementValidity,
+) -> tuple[int, ...]:
+    """Values of an engagement validity of person, in order of the store COLUMNS."""
+    return (
+        uuids.intern(person.bytes),
+        uuids.intern(engagement.uuid.bytes),
+        user_keys.intern(engagement.user_key),
+        engagement.fraction if engagement.fraction is not None else NONE,
+        (
+            uuids.intern(engagement.primary.uuid.bytes)
+            if engagement.primary is not None
+            else NONE
+        ),
+        uuids.intern(engagement.engagement_type.uuid.bytes),
+        _to_ordinal(engagement.validity.from_),
+        _to_ordinal(engagement.validity.to),
+    )
+
+
+def _person_index(person: Sequence[int]) -> tuple[array, array]:
+    """Person indices and offsets of their rows, of a person column grouped by person."""
+    persons = array("i")
+    offsets = array("i")
+    for row, index in enumerate(person):
+        if not persons or persons[-1] != index:
+            persons.append(index)
+            offsets.append(row)
+    offsets.append(len(person))
+    return persons, offsets
+
+
+def _write_snapshot_file(
+    path: Path,
+    rows: int,
+    columns: Iterable[Sequence[int]],
+    persons: Sequence[int],
+    offsets: Sequence[int],
+    uuids: InternTable,
+    user_keys: InternTable,
+) -> None:
+    """Write a snapshot file, replacing it atomically, see SNAPSHOT_MAGIC.
+
+    Args:
+        path: Path of the snapshot file.
+        rows: Number of rows.
+        columns: The columns grouped by person, in order of EngagementStore.COLUMNS,
+            each only consumed once the previous one is written.
+        persons: Person indices of the rows, in ascending order.
+        offsets: Offsets of the rows of each person, and the number of rows.
+        uuids: The interned UUIDs, as bytes.
+        user_keys: The interned user keys.
+    """
+    uuid_order = sorted(range(len(uuids)), key=uuids.values.__getitem__)
+    encoded_user_keys = [user_key.encode() for user_key in user_keys.values]
+    user_key_offsets = accumulate(map(len, encoded_user_keys), initial=0)
+    user_key_data = b"".join(encoded_user_keys)
+
+    partial_path = path.with_name(path.name + ".partial")
+    with partial_path.open("wb") as snapshot:
+        snapshot.write(
+            _SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                rows,
+                len(persons),
+                len(uuids),
+                len(user_keys),
+                len(user_key_data),
+            )
+        )
+        for column in columns:
+            snapshot.write(_int32_bytes(column))
+        snapshot.write(_int32_bytes(persons))
+        snapshot.write(_int32_bytes(offsets))
+        snapshot.write(b"".join(uuids.values))
+        snapshot.write(_int32_bytes(uuid_order))
+        snapshot.write(_int32_bytes(user_key_offsets))
+        snapshot.write(user_key_data)
+    os.replace(partial_path, path)
+    logger.info("Wrote engagement snapshot", path=str(path), rows=rows)
+
+
+class EngagementStore:
+    """Engagement validities of the whole organisation, in parallel arrays.
+
+    Every engagement validity is a row of fixed-width integer columns. UUIDs and
+    user keys are interned, and dates are stored as ordinals. Rows are grouped by
+    person once the store is frozen, and the rows of a person are found by an
+    offset index, thus the store serves the engagement history of any person,
+    shaped like read by MoraHelper, without keeping the dicts themselves around.
+
+    The store can be written to a snapshot file, which is memory-mapped when
+    opened, rather than read, thus opening even a large snapshot is instant, and
+    only the pages actually used are ever read. To write a snapshot without holding
+    the whole organisation in memory first, see stream_snapshot.
+
+    Example:
+        store = await EngagementStore.load(graphql_client)
+        updater.recalculate_user(person_uuid, mo_engagements=store.history(person_uuid))
+
+        store.write_snapshot(path)
+        store = EngagementStore.open_snapshot(path)
+    """
+
+    COLUMNS = (
+        "person",
+        "uuid",
+        "user_key",
+        "fraction",
+        "primary",
+        "engagement_type",
+        "start",
+        "end",
+    )
+
+    def __init__(self) -> None:
+        # UUIDs are interned as bytes, as UUID objects are several times larger
+        self.uuids = InternTable()
+        self.user_keys = InternTable()
+        for column in self.COLUMNS:
+            setattr(self, column, array("i"))
+        # Person indices in ascending order, and the offsets of their rows
+        self._persons = array("i")
+        self._offsets = array("i", [0])
+        self._frozen = True
+
+    def __len__(self) -> int:
+        return len(self.uuid)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the columns and offset index in bytes, excluding intern tables."""
+        columns = [getattr(self, column) for column in self.COLUMNS]
+        columns += [self._persons, self._offsets]
+        return sum(len(c) * c.itemsize for c in columns)
+
+    def add(self, person: UUID, engagement: EngagementValidity) -> None:
+        """Add an engagement validity of person to the store.
+
+        Args:
+            person: UUID of the person of the engagement.
+            engagement: The engagement validity, as read via GraphQL.
+        """
+        row = _engagement_row(self.uuids, self.user_keys, person, engagement)
+        for column, value in zip(self.COLUMNS, row):
+            getattr(self, column).append(value)
+        self._frozen = False
+
+    def freeze(self) -> None:
+        """Group the rows by person, and index the rows of each person."""
+        if self._frozen:
+            return
+        # Stable, thus keeping the order of the rows of each person
+        order = sorted(range(len(self)), key=self.person.__getitem__)
+        for column in self.COLUMNS:
+            values = getattr(self, column)
+            setattr(self, column, array("i", map(values.__getitem__, order)))
+        self._persons, self._offsets = _person_index(self.person)
+        self._frozen = True
+
+    def persons(self) -> Iterator[UUID]:
+        """UUIDs of all persons with engagements in the store."""
+        self.freeze()
+        for person in self._persons:
+            yield UUID(bytes=self.uuids.values[person])
+
+    def rows(self, person: UUID) -> range:
+        """Rows of the engagement validities of person."""
+        self.freeze()
+        index = self.uuids.index(person.bytes)
+        if index is None:
+            return range(0)
+        position = bisect_left(self._persons, index)
+        if position == len(self._persons) or self._persons[position] != index:
+            return range(0)
+        return range(self._offsets[position], self._offsets[position + 1])
+
+    def signature(self, person: UUID, columns: Sequence[str]) -> list[tuple]:
+        """The values of columns of the rows of person, in sorted order.
+
+        Unlike the rows themselves, signatures are comparable across stores.
+
+        Args:
+            person: UUID of the person.
+            columns: Names of the columns, see COLUMNS.
+
+        Returns:
+            Sorted list of a tuple of values per row, empty if the person is unknown.
+        """
+        tables = {
+            "uuid": self.uuids,
+            "primary": self.uuids,
+            "engagement_type": self.uuids,
+            "user_key": self.user_keys,
+        }
+
+        def value(column: str, row: int):
+            value = getattr(self, column)[row]
+            if column in tables and value != NONE:
+                return tables[column].values[value]
+            return value
+
+        rows = self.rows(person)
+        return sorted(tuple(value(column, row) for column in columns) for row in rows)
+
+    def history(self, person: UUID) -> list[dict]:
+        """The engagement history of person, shaped like read by MoraHelper.
+
+        Args:
+            person: UUID of the person.
+
+        Returns:
+            List of engagement validities, empty if the person is unknown.
+        """
+
+        def to_uuid(index: int) -> str:
+            return str(UUID(bytes=self.uuids.values[index]))
+
+        def to_date(ordinal: int) -> str | None:
+            return date.fromordinal(ordinal).isoformat() if ordinal != NO_END else None
+
+        return [
+            {
+                "uuid": to_uuid(self.uuid[row]),
+                "user_key": self.user_keys.values[self.user_key[row]],
+                "fraction": self.fraction[row] if self.fraction[row] != NONE else None,
+                "primary": (
+                    {"uuid": to_uuid(self.primary[row])}
+                    if self.primary[row] != NONE
+                    else None
+                ),
+                "engagement_type": {"uuid": to_uuid(self.engagement_type[row])},
+                "validity": {
+                    "from": to_date(self.start[row]),
+                    "to": to_date(self.end[row]),
+                },
+            }
+            for row in self.rows(person)
+        ]
+
+    @classmethod
+    async def load(
+        cls, graphql_client: GraphQLClient, page_size: int = 500
+    ) -> "EngagementStore":
+        """Stream the engagements of the whole organisation from MO into a store.
+
+        Args:
+            graphql_client: Client for MO's GraphQL API.
+            page_size: Number of engagements read per request.
+
+        Returns:
+            The frozen store.
+        """
+        store = cls()
+        cursor = None
+        while True:
+            page = await graphql_client.get_engagements(cursor=cursor, limit=page_size)
+            for engagement in page.objects:
+                for validity in engagement.validities:
+                    for person in validity.person:
+                        store.add(person.uuid, validity)
+            logger.debug("Loaded engagements into store", rows=len(store))
+            cursor = page.page_info.next_cursor
+            if cursor is None:
+                break
+        store.freeze()
+        logger.info(
+            "Loaded engagement store",
+            rows=len(store),
+            persons=len(store._persons),
+            nbytes=store.nbytes,
+        )
+        return store
+
+    def write_snapshot(self, path: Path) -> None:
+        """Write the store to a snapshot file, replacing it atomically.
+
+        Args:
+            path: Path of the snapshot file.
+        """
+        self.freeze()
+        _write_snapshot_file(
+            path,
+            len(self),
+            (getattr(self, column) for column in self.COLUMNS),
+            self._persons,
+            self._offsets,
+            self.uuids,
+            self.user_keys,
+        )
+
+    @classmethod
+    def open_snapshot(cls, path: Path) -> "EngagementStore":
+        """Open a snapshot file as a read-only store, by memory-mapping it.
+
+        Args:
+            path: Path of the snapshot file.
+
+        Raises:
+            ValueError: If the file is not a snapshot of a supported version.
+
+        Returns:
+            The store, backed by the snapshot file.
+        """
+        if sys.byteorder != "little":  # pragma: no cover
+            raise ValueError("Snapshots can only be opened on little-endian hosts")
+        with path.open("rb") as snapshot:
+            view = memoryview(mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(view) < _SNAPSHOT_HEADER.size:
+            raise ValueError(f"Not an engagement snapshot: {path}")
+        (
+            magic,
+            version,
+            rows,
+            persons,
+            uuids,
+            user_keys,
+            user_key_bytes,
+        ) = _SNAPSHOT_HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not an engagement snapshot: {path}")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported engagement snapshot version: {version}")
+
+        offset = _SNAPSHOT_HEADER.size
+
+        def take(size: int, typecode: str = "B") -> memoryview:
+            nonlocal offset
+            if offset + size > len(view):
+                raise ValueError(f"Truncated engagement snapshot: {path}")
+            block = view[offset : offset + size]
+            offset += size
+            return block.cast(typecode)
+
+        store = cls()
+        for column in cls.COLUMNS:
+            setattr(store, column, take(4 * rows, "i"))
+        store._persons = take(4 * persons, "i")
+        store._offsets = take(4 * (persons + 1), "i")
+        uuid_table = take(16 * uuids)
+        store.uuids = SnapshotTable(_UUIDValues(uuid_table), take(4 * uuids, "i"))
+        user_key_offsets = take(4 * (user_keys + 1), "i")
+        store.user_keys = SnapshotTable(
+            _UserKeyValues(user_key_offsets, take(user_key_bytes))
+        )
+        return store
+
+
+class SnapshotWriter:
+    """Writer of a snapshot file from engagements streamed from MO, page by page.
+
+    Unlike EngagementStore.write_snapshot, the rows are never all kept in memory.
+    Each page of rows is spilled to a file per column next to the snapshot, and
+    once all pages are written, the columns are grouped by person one at a time,
+    through memory maps of the spilled columns. Only the intern tables, and the
+    order of the rows, grow with the organisation.
+
+    Example:
+        with SnapshotWriter(path) as writer:
+            for person, engagement in page:
+                writer.add(person, engagement)
+            writer.flush()
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.rows = 0
+        self.uuids = InternTable()
+        self.user_keys = InternTable()
+        self._page = {column: array("i") for column in EngagementStore.COLUMNS}
+        self._spill: Any = None
+        self._files: dict[str, Any] = {}
+
+    def __enter__(self) -> "SnapshotWriter":
+        self._spill = tempfile.TemporaryDirectory(
+            prefix=self.path.name + ".", dir=self.path.parent
+        )
+        self._files = {
+            column: open(os.path.join(self._spill.name, column), "w+b")
+            for column in EngagementStore.COLUMNS
+        }
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: Any) -> None:
+        try:
+            if exc_type is None:
+                self._finish()
+        finally:
+            for spill_file in self._files.values():
+                spill_file.close()
+            self._spill.cleanup()
+
+    def add(self, person: UUID, engagement: EngagementValidity) -> None:
+        """Add an engagement validity of person to the current page."""
+        row = _engagement_row(self.uuids, self.user_keys, person, engagement)
+        for column, value in zip(EngagementStore.COLUMNS, row):
+            self._page[column].append(value)
+
+    def flush(self) -> None:
+        """Spill the rows of the current page to disk."""
+        for column, values in self._page.items():
+            self._files[column].write(_int32_bytes(values))
+        self.rows += len(self._page["person"])
+        self._page = {column: array("i") for column in EngagementStore.COLUMNS}
+
+    def _finish(self) -> None:
+        self.flush()
+        if self.rows == 0:
+            # Empty files cannot be memory-mapped
+            maps = {column: array("i") for column in EngagementStore.COLUMNS}
+            self._write(maps, array("i"))
+            return
+        mmaps = []
+        maps = {}
+        for column, spill_file in self._files.items():
+            spill_file.flush()
+            mmaps.append(mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ))
+            maps[column] = memoryview(mmaps[-1]).cast("i")
+        try:
+            # Stable, thus keeping the order of the rows of each person
+            order = sorted(range(self.rows), key=maps["person"].__getitem__)
+            self._write(maps, array("i", order))
+        finally:
+            for view in maps.values():
+                view.release()
+            for spill_map in mmaps:
+                spill_map.close()
+
+    def _write(self, maps: dict[str, Sequence[int]], order: Sequence[int]) -> None:
+        person = array("i", map(maps["person"].__getitem__, order))
+        persons, offsets = _person_index(person)
+
+        def columns() -> Iterator[Sequence[int]]:
+            for column in EngagementStore.COLUMNS:
+                yield array("i", map(maps[column].__getitem__, order))
+
+        _write_snapshot_file(
+            self.path,
+            self.rows,
+            columns(),
+            persons,
+            offsets,
+            self.uuids,
+            self.user_keys,
+        )
+
+
+async def stream_snapshot(
+    graphql_client: GraphQLClient, path: Path, page_size: int = 500
+) -> int:
+    """Stream the engagements of the whole organisation from MO to a snapshot file.
+
+    Args:
+        graphql_client: Client for MO's GraphQL API.
+        path: Path of the snapshot file, replaced atomically once complete.
+        page_size: Number of engagements read per request.
+
+    Returns:
+        The number of engagement validities written.
+    """
+    with SnapshotWriter(path) as writer:
+        cursor = None
+        while True:
+            page = await graphql_client.get_engagements(cursor=cursor, limit=page_size)
+            for engagement in page.objects:
+                for validity in engagement.validities:
+                    for person in validity.person:
+                        writer.add(person.uuid, validity)
+            writer.flush()
+            logger.debug("Streamed engagements to snapshot", rows=writer.rows)
+            cursor = page.page_info.next_cursor
+            if cursor is None:
+                break
+    return writer.rows
+
+
+def changed_persons(
+    old: EngagementStore, new: EngagementStore, attributes: Sequence[str] | None = None
+) -> list[UUID]:
+    """Persons whose engagement histories differ between two stores.
+
+    Only the validities and the given attributes of engagements are compared, e.g.
+    the decision_attributes of the integration, thus persons whose primaries could
+    not have changed are left out.
+
+    Args:
+        old: The store as it was, e.g. opened from yesterday's snapshot.
+        new: The store as it is now.
+        attributes: Attributes to compare, all if not given.
+
+    Raises:
+        ValueError: If attributes are not in the store.
+
+    Returns:
+        Sorted list of the UUIDs of changed persons.
+    """
+    attributes = attributes or [c for c in EngagementStore.COLUMNS if c != "person"]
+    unknown = set(attributes) - set(EngagementStore.COLUMNS)
+    if unknown:
+        raise ValueError(f"Attributes not in the engagement store: {sorted(unknown)}")
+    columns = ["start", "end", *(a for a in attributes if a not in ("start", "end"))]
+    persons = set(old.persons()) | set(new.persons())
+    return sorted(
+        person
+        for person in persons
+        if old.signature(person, columns) != new.signature(person, columns)
+    )
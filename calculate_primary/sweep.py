@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+"""Periodic recalculation of all persons, or of persons with missed changes."""
+import asyncio
+import os
+from collections.abc import Iterable
+from contextlib import suppress
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+from uuid import UUID
+
+import structlog
+from more_itertools import chunked
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+from calculate_primary.lanes import BULK
+from calculate_primary.main import PersonRecalculator
+from calculate_primary.main import RecalculationWatermarks
+from calculate_primary.sharding import shard_for
+
+logger = structlog.stdlib.get_logger()
+
+sweep_failure_counter = Counter(
+    "recalculate_sweep_failure", "Number of persons failing in sweeps"
+)
+last_sweep = Gauge("recalculate_last_sweep", "Timestamp of the last full sweep")
+last_reconciliation = Gauge(
+    "recalculate_last_reconciliation", "Timestamp of the last complete reconciliation"
+)
+
+
+class PeriodicSweep:
+    """Lifespan manager periodically recalculating a set of persons.
+
+    Subclasses decide which persons to recalculate by implementing sweep, using
+    recalculate_persons. Only persons of this replica's shard are recalculated,
+    and in the bulk lane, thus yielding to interactive events.
+    """
+
+    def __init__(
+        self,
+        recalculator: PersonRecalculator,
+        interval: float,
+        shards: int = 1,
+        shard: int = 0,
+        chunk_size: int = 100,
+    ) -> None:
+        self.recalculator = recalculator
+        self.interval = interval
+        self.shards = shards
+        self.shard = shard
+        self.chunk_size = chunk_size
+        self._task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> "PeriodicSweep":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        assert self._task is not None
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Sweep failed", sweep=type(self).__name__)
+
+    async def sweep(self) -> None:
+        raise NotImplementedError()
+
+    async def recalculate_persons(
+        self, person_uuids: Iterable[UUID], full: bool = False
+    ) -> int:
+        """Recalculate the persons of this shard among person_uuids.
+
+        Args:
+            person_uuids: UUIDs of the persons to recalculate.
+            full: Recalculate the entire history, regardless of history_horizon.
+
+        Returns:
+            The number of persons failing to recalculate.
+        """
+        person_uuids = [
+            uuid for uuid in person_uuids if shard_for(uuid, self.shards) == self.shard
+        ]
+        logger.info(
+            "Starting sweep", sweep=type(self).__name__, persons=len(person_uuids)
+        )
+        failures = 0
+        # Chunked to bound the number of waiting recalculations
+        for chunk in chunked(person_uuids, self.chunk_size):
+            received_at = RecalculationWatermarks.now()
+            results = await asyncio.gather(
+                *(
+                    self.recalculator.recalculate(uuid, received_at, BULK, full=full)
+                    for uuid in chunk
+                ),
+                return_exceptions=True,
+            )
+            for uuid, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    logger.warning("Sweep failed for person", person_uuid=uuid)
+                    failures += 1
+        sweep_failure_counter.inc(failures)
+        logger.info(
+            "Finished sweep",
+            sweep=type(self).__name__,
+            persons=len(person_uuids),
+            failures=failures,
+        )
+        return failures
+
+
+class FullSweep(PeriodicSweep):
+    """Lifespan manager periodically recalculating all persons in full.
+
+    Complements the history horizon of event-driven recalculations, by sweeping
+    the entire history of every person of this replica's shard every interval
+    seconds.
+    """
+
+    async def sweep(self) -> None:
+        """Recalculate the entire history of all persons of this shard."""
+        helper = self.recalculator.updater.helper
+        users = await asyncio.to_thread(helper.read_all_users)
+        await self.recalculate_persons(
+            map(UUID, (user["uuid"] for user in users)), full=True
+        )
+        last_sweep.set_to_current_time()
+
+
+class HighWaterMark:
+    """Point in time up to which all changes have been handled.
+
+    Kept in a file at path if given, thus surviving restarts, otherwise in memory.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self._mark: datetime | None = None
+
+    def get(self) -> datetime | None:
+        if self.path is None or not self.path.exists():
+            return self._mark
+        return datetime.fromisoformat(self.path.read_text().strip())
+
+    def set(self, mark: datetime) -> None:
+        self._mark = mark
+        if self.path is not None:
+            partial_path = self.path.with_name(self.path.name + ".partial")
+            partial_path.write_text(mark.isoformat())
+            os.replace(partial_path, self.path)
+
+
+class Reconciliation(PeriodicSweep):
+    """Lifespan manager periodically recalculating persons with missed changes.
+
+    Catches changes whose events were missed, without touching every person, by
+    asking MO for the engagements registered since the last successful
+    reconciliation, and recalculating just the persons of those.
+
+    The first reconciliation merely marks its start, as no earlier point in time is
+    known to have been reconciled. The mark only advances once every person has
+    been recalculated, thus failed reconciliations are retried in full.
+
+    The mark is taken from the local clock, and set overlap before it, so changes
+    registered by MO around the mark are not missed due to clock skew between the
+    two, or to registrations committed after the time they are registered at.
+    """
+
+    def __init__(
+        self,
+        recalculator: PersonRecalculator,
+        context: dict,
+        interval: float,
+        mark: HighWaterMark,
+        page_size: int = 500,
+        overlap: timedelta = timedelta(minutes=5),
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(recalculator, interval, **kwargs)
+        # The GraphQL client is only in the context once FastRAMQPI has started
+        self.context = context
+        self.mark = mark
+        self.page_size = page_size
+        self.overlap = overlap
+
+    async def sweep(self) -> None:
+        """Recalculate the persons of engagements registered since the mark."""
+        # Registrations made while reconciling are covered by the next one
+        now = datetime.now(timezone.utc) - self.overlap
+        since = self.mark.get()
+        if since is None:
+            logger.info("Starting reconciliation from now", mark=now)
+            self.mark.set(now)
+            return
+
+        graphql_client = self.context["graphql_client"]
+        person_uuids: set[UUID] = set()
+        cursor = None
+        while True:
+            page = await graphql_client.get_changed_engagements(
+                since, cursor=cursor, limit=self.page_size
+            )
+            for engagement in page.objects:
+                # Engagements with a registration current at since match the
+                # registration filter of MO as well, thus are picked out here
+                if not any(r.start >= since for r in engagement.registrations):
+                    continue
+                for validity in engagement.validities:
+                    person_uuids.update(person.uuid for person in validity.person)
+            cursor = page.page_info.next_cursor
+            if cursor is None:
+                break
+        logger.info("Reconciling changes", since=since, persons=len(person_uuids))
+
+        failures = await self.recalculate_persons(sorted(person_uuids))
+        if failures:
+            logger.warning("Reconciliation incomplete, keeping mark", mark=since)
+            return
+        self.mark.set(now)
+        last_reconciliation.set_to_current_time()
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+from uuid import uuid4
+
+from calculate_primary.audit import DISAGREES_WITH_MO
+from calculate_primary.audit import NO_PRIMARY
+from calculate_primary.audit import TOO_MANY_PRIMARIES
+from calculate_primary.audit import PrimaryAudit
+from calculate_primary.audit import audit_persons_gauge
+from calculate_primary.audit import audit_primaries
+from calculate_primary.autogenerated_graphql_client import (
+    GetCurrentPrimariesEngagements,
+)
+from calculate_primary.report import Report
+from calculate_primary.report import main
+from calculate_primary.sharding import shard_for
+
+PRIMARY = str(uuid4())
+NON_PRIMARY = str(uuid4())
+
+
+def _page(engagements, next_cursor=None):
+    return GetCurrentPrimariesEngagements.parse_obj(
+        {
+            "objects": [
+                {
+                    "current": {
+                        "uuid": str(uuid4()),
+                        "is_primary": is_primary,
+                        "primary": {"uuid": primary} if primary else None,
+                        "person": [{"uuid": str(person)}],
+                        "validity": {"from": "2020-01-01T00:00:00+01:00", "to": None},
+                    }
+                }
+                for person, primary, is_primary in engagements
+            ]
+            + [{"current": None}],
+            "page_info": {"next_cursor": next_cursor},
+        }
+    )
+
+
+def _organisation():
+    fine, none, many, disagreeing = (uuid4() for _ in range(4))
+    pages = [
+        _page(
+            [
+                (fine, PRIMARY, True),
+                (fine, NON_PRIMARY, False),
+                (none, NON_PRIMARY, False),
+                (many, PRIMARY, True),
+            ],
+            next_cursor="MQ==",
+        ),
+        _page(
+            [
+                (none, None, False),
+                (many, PRIMARY, False),
+                (disagreeing, PRIMARY, False),
+                (disagreeing, NON_PRIMARY, True),
+            ]
+        ),
+    ]
+    expected = {
+        none: NO_PRIMARY,
+        many: TOO_MANY_PRIMARIES,
+        disagreeing: DISAGREES_WITH_MO,
+    }
+    return pages, expected
+
+
+def test_audit_primaries_finds_persons_without_a_single_primary(tmp_path):
+    pages, expected = _organisation()
+    graphql_client = MagicMock()
+    graphql_client.get_current_primaries = AsyncMock(side_effect=pages)
+
+    with Report(tmp_path / "audit.ndjson") as report:
+        findings = asyncio.run(
+            audit_primaries(graphql_client, [PRIMARY], page_size=4, report=report)
+        )
+
+    assert findings == expected
+    assert graphql_client.get_current_primaries.call_args_list[1].kwargs == {
+        "cursor": "MQ==",
+        "limit": 4,
+    }
+    records = [
+        json.loads(line)
+        for line in (tmp_path / "audit.ndjson").read_text().splitlines()
+    ]
+    assert {r["person"]: r["finding"] for r in records[:-1]} == {
+        str(person): finding for person, finding in expected.items()
+    }
+
+
+def test_primary_audit_counts_findings_of_shard():
+    pages, expected = _organisation()
+    graphql_client = MagicMock()
+    graphql_client.get_current_primaries = AsyncMock(side_effect=pages)
+    recalculator = MagicMock()
+    recalculator.updater.primary = [PRIMARY]
+    audit = PrimaryAudit(
+        recalculator,
+        {"graphql_client": graphql_client},
+        interval=60.0,
+        shards=2,
+        shard=1,
+    )
+
+    asyncio.run(audit.sweep())
+
+    for finding in (NO_PRIMARY, TOO_MANY_PRIMARIES, DISAGREES_WITH_MO):
+        total = sum(
+            1
+            for person, found in expected.items()
+            if found == finding and shard_for(person, 2) == 1
+        )
+        assert audit_persons_gauge.labels(finding=finding)._value.get() == total
+    recalculator.recalculate.assert_not_called()
+
+
+def test_report_audit_writes_findings(tmp_path, capsys):
+    pages, expected = _organisation()
+    graphql_client = MagicMock()
+    graphql_client.get_current_primaries = AsyncMock(side_effect=pages)
+    updater = MagicMock(primary=[PRIMARY])
+
+    @asynccontextmanager
+    async def open_graphql_client(settings):
+        yield graphql_client
+
+    path = tmp_path / "audit.csv"
+    with patch("calculate_primary.report.Settings"), patch(
+        "calculate_primary.report._setup_updater", return_value=updater
+    ), patch("calculate_primary.report.open_graphql_client", open_graphql_client):
+        main(["audit", str(path), "--format", "csv"])
+
+    assert "Findings: 3" in capsys.readouterr().out
+    rows = path.read_text().splitlines()
+    assert sum(row.startswith("finding,") for row in rows) == len(expected)
+    updater.check_all.assert_not_called()
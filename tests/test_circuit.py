@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+import time
+
+import pytest
+
+from calculate_primary.circuit import CLOSED
+from calculate_primary.circuit import HALF_OPEN
+from calculate_primary.circuit import OPEN
+from calculate_primary.circuit import CircuitBreaker
+from calculate_primary.circuit import CircuitOpenError
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        breaker.observe(time.monotonic(), False)
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.0)
+
+    fail(breaker, 2)
+    breaker.observe(time.monotonic(), True)
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+    breaker.before_request()
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_circuit_turns_half_open_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    fail(breaker)
+    assert breaker.state == HALF_OPEN
+    # Probe requests are allowed
+    breaker.before_request()
+
+
+def test_circuit_half_open_lets_a_single_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    fail(breaker)
+    breaker._set_state(HALF_OPEN)
+
+    assert breaker._try_acquire() is True
+    assert breaker._try_acquire() is False
+
+
+def test_circuit_half_open_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    fail(breaker)
+    assert breaker._try_acquire() is True
+
+    breaker.observe(time.monotonic(), True)
+    assert breaker.state == CLOSED
+    assert breaker._try_acquire() is True
+    assert breaker._try_acquire() is True
+
+
+def test_circuit_half_open_reopens_on_failure():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60.0)
+    fail(breaker, 5)
+    breaker._set_state(HALF_OPEN)
+
+    fail(breaker)
+    assert breaker.state == OPEN
+    assert breaker._try_acquire() is False
+
+
+def test_circuit_slot_waits_while_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0, poll_interval=0)
+    fail(breaker)
+
+    async def hold():
+        async with breaker.slot():
+            pass
+
+    async def main():
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        breaker.observe(time.monotonic(), True)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+
+
+def test_circuit_slot_releases_probe_without_outcome():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    fail(breaker)
+    breaker._set_state(HALF_OPEN)
+
+    async def main():
+        # The probe is skipped, without making any requests
+        async with breaker.slot():
+            assert breaker._try_acquire() is False
+        assert breaker.state == HALF_OPEN
+        async with breaker.slot():
+            breaker.observe(time.monotonic(), True)
+        assert breaker.state == CLOSED
+
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from uuid import uuid4
+
+from calculate_primary.digests import DigestStore
+
+
+def test_digest_store_persists_latest_record(tmp_path):
+    person, other = uuid4(), uuid4()
+    digests = DigestStore(tmp_path / "digests.db")
+    assert digests.get(person) is None
+    assert digests.decision(person) is None
+
+    digests.record(person, "old", [])
+    digests.record(person, "new", [["engagement", "2024-01-01", None]])
+    digests.record(other, "other", [])
+    digests.close()
+
+    digests = DigestStore(tmp_path / "digests.db")
+    assert len(digests) == 2
+    assert digests.get(person) == "new"
+    assert digests.decision(person) == [["engagement", "2024-01-01", None]]
+    assert digests.get(other) == "other"
@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from collections import deque
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+from more_itertools import one
+
+from calculate_primary.autogenerated_graphql_client import (
+    GetEngagementPersonEngagements,
+)
+from calculate_primary.events import PersonWork
+from calculate_primary.events import _handle_engagements
+from calculate_primary.events import create_person_router
+from calculate_primary.lanes import BULK
+from calculate_primary.lanes import INTERACTIVE
+from calculate_primary.lanes import LaneClassifier
+from calculate_primary.sharding import shard_for
+from calculate_primary.sharding import shard_routing_key
+
+
+def _engagement(engagement_uuid, person_uuid, actor):
+    history = {
+        "uuid": str(engagement_uuid),
+        "user_key": "1",
+        "fraction": None,
+        "primary": None,
+        "engagement_type": {"uuid": str(actor)},
+        "validity": {"from": "2024-01-01T00:00:00+01:00", "to": None},
+    }
+    return {
+        "uuid": str(engagement_uuid),
+        "validities": [
+            {"person": [{"uuid": str(person_uuid), "engagements": [history]}]}
+        ],
+        "registrations": [{"actor": str(actor), "start": "2024-01-01T00:00:00+00:00"}],
+    }
+
+
+def test_handle_engagements_hands_each_person_over_once():
+    person, other = uuid4(), uuid4()
+    importer, user = uuid4(), uuid4()
+    engagements = [uuid4(), uuid4(), uuid4()]
+    mo = MagicMock()
+    mo.get_engagement_person = AsyncMock(
+        return_value=GetEngagementPersonEngagements.parse_obj(
+            {
+                "objects": [
+                    _engagement(engagements[0], person, importer),
+                    _engagement(engagements[1], person, user),
+                    _engagement(engagements[2], other, importer),
+                ]
+            }
+        )
+    )
+    amqpsystem = MagicMock()
+    amqpsystem.publish_message = AsyncMock()
+    recalculator = MagicMock()
+    recalculator.recalculate = AsyncMock()
+    unknown = uuid4()
+    events = [*engagements, unknown]
+
+    async def main():
+        tasks = await _handle_engagements(
+            events,
+            mo=mo,
+            amqpsystem=amqpsystem,
+            settings=MagicMock(person_shards=1),
+            recalculator=recalculator,
+            classifier=LaneClassifier([importer], 10, 10.0),
+        )
+        await asyncio.gather(*(t for ts in tasks for t in ts))
+        return tasks
+
+    tasks = asyncio.run(main())
+
+    # A single query resolves the whole batch
+    mo.get_engagement_person.assert_awaited_once()
+    (uuids,) = mo.get_engagement_person.call_args.args
+    assert set(uuids) == set(engagements) | {unknown}
+    # Reading just the registrations current when read
+    assert mo.get_engagement_person.call_args.kwargs["registered_at"] is not None
+    # Shared persons are handed over once, in the lane of their most urgent event,
+    # rather than recalculated while holding on to the engagement events
+    recalculator.recalculate.assert_not_awaited()
+    published = {
+        work.uuid: (routing_key, work.engagements)
+        for (routing_key, work), _ in amqpsystem.publish_message.call_args_list
+    }
+    assert published == {
+        person: (
+            shard_routing_key(0, INTERACTIVE),
+            sorted(engagements[:2]),
+        ),
+        other: (shard_routing_key(0, BULK), [engagements[2]]),
+    }
+    assert tasks[0] == tasks[1]
+    assert tasks[3] == []
+
+
+def test_interactive_person_skips_queued_bulk_backlog():
+    importer, user = uuid4(), uuid4()
+    bulk = [(uuid4(), uuid4()) for _ in range(100)]
+    edited = (uuid4(), uuid4())
+    mo = MagicMock()
+    amqpsystem = MagicMock()
+    # Queues of the person router, by the routing key each is bound to
+    router = create_person_router(0)
+    queues = {one(keys): deque() for keys in router.registry.values()}
+
+    async def publish_message(routing_key, work):
+        queues[routing_key].append(work)
+
+    amqpsystem.publish_message = publish_message
+
+    async def handle(engagement, person, actor):
+        mo.get_engagement_person = AsyncMock(
+            return_value=GetEngagementPersonEngagements.parse_obj(
+                {"objects": [_engagement(engagement, person, actor)]}
+            )
+        )
+        tasks = await _handle_engagements(
+            [engagement],
+            mo=mo,
+            amqpsystem=amqpsystem,
+            settings=MagicMock(person_shards=1),
+            recalculator=MagicMock(),
+            classifier=LaneClassifier([importer], 1000, 10.0),
+        )
+        await asyncio.gather(*(t for ts in tasks for t in ts))
+
+    async def main():
+        # An import is queued, and then a user edits
+        for engagement, person in bulk:
+            await handle(engagement, person, importer)
+        await handle(*edited, user)
+
+    asyncio.run(main())
+
+    # The edit is first in a queue of its own, rather than last behind the import
+    assert len(queues) == 2
+    assert [w.uuid for w in queues[shard_routing_key(0, BULK)]] == [
+        person for _, person in bulk
+    ]
+    assert [w.uuid for w in queues[shard_routing_key(0, INTERACTIVE)]] == [edited[1]]
+
+
+def test_sharded_person_reads_history_on_owning_replica():
+    person, actor = uuid4(), uuid4()
+    engagement = uuid4()
+    mo = MagicMock()
+    mo.get_engagement_person = AsyncMock(
+        return_value=GetEngagementPersonEngagements.parse_obj(
+            {"objects": [_engagement(engagement, person, actor)]}
+        )
+    )
+    amqpsystem = MagicMock()
+    amqpsystem.publish_message = AsyncMock()
+    recalculator = MagicMock()
+    recalculator.recalculate = AsyncMock()
+    recalculator.breaker.wait_until_not_open = AsyncMock()
+    recalculator.horizon.return_value = None
+
+    async def main():
+        tasks = await _handle_engagements(
+            [engagement],
+            mo=mo,
+            amqpsystem=amqpsystem,
+            settings=MagicMock(person_shards=4),
+            recalculator=recalculator,
+            classifier=LaneClassifier([], 10, 10.0),
+        )
+        await asyncio.gather(*(t for ts in tasks for t in ts))
+
+    asyncio.run(main())
+
+    # The person is handed over along with the engagements to read it through
+    recalculator.recalculate.assert_not_awaited()
+    shard = shard_for(person, 4)
+    routing_key, work = amqpsystem.publish_message.call_args.args
+    assert routing_key == shard_routing_key(shard, INTERACTIVE)
+    assert work == PersonWork(uuid=person, engagements=[engagement])
+
+    # The owning replica reads the history itself, rather than going without
+    registry = create_person_router(shard).registry
+    calculate_person = one(c for c, keys in registry.items() if routing_key in keys)
+    asyncio.run(
+        calculate_person(
+            work,
+            routing_key=routing_key,
+            mo=mo,
+            recalculator=recalculator,
+        )
+    )
+    assert mo.get_engagement_person.call_args.args == ([engagement],)
+    person_uuid, _, lane, history = recalculator.recalculate.call_args.args
+    assert (person_uuid, lane) == (person, INTERACTIVE)
+    # The engagement history is read, shaped like MoraHelper's
+    assert history.engagements == [
+        {
+            "uuid": str(engagement),
+            "user_key": "1",
+            "fraction": None,
+            "primary": None,
+            "engagement_type": {"uuid": str(actor)},
+            "validity": {"from": "2024-01-01", "to": None},
+        }
+    ]
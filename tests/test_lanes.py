@@ -0,0 +1,35 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+from unittest.mock import patch
+from uuid import uuid4
+
+from calculate_primary.lanes import BULK
+from calculate_primary.lanes import INTERACTIVE
+from calculate_primary.lanes import LaneClassifier
+
+
+def test_classify_bulk_actors():
+    importer = uuid4()
+    classifier = LaneClassifier([importer], burst_threshold=10, burst_window=10.0)
+
+    assert classifier.classify(importer) == BULK
+    assert classifier.classify(uuid4()) == INTERACTIVE
+    assert classifier.classify(None) == INTERACTIVE
+
+
+def test_classify_bursting_actors():
+    actor, other = uuid4(), uuid4()
+    classifier = LaneClassifier([], burst_threshold=2, burst_window=10.0)
+
+    with patch("calculate_primary.lanes.time.monotonic", return_value=100.0):
+        assert classifier.classify(actor) == INTERACTIVE
+        assert classifier.classify(actor) == INTERACTIVE
+        assert classifier.classify(actor) == BULK
+        # Only the bursting actor is demoted
+        assert classifier.classify(other) == INTERACTIVE
+
+    # Once the burst is over, the actor is interactive again
+    with patch("calculate_primary.lanes.time.monotonic", return_value=110.0):
+        assert classifier.classify(actor) == INTERACTIVE
+    assert set(classifier._recent) == {actor}
@@ -0,0 +1,263 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+
+from calculate_primary.circuit import CircuitBreaker
+from calculate_primary.concurrency import AdaptiveLimiter
+from calculate_primary.digests import DigestStore
+from calculate_primary.lanes import BULK
+from calculate_primary.main import EngagementHistory
+from calculate_primary.main import PersonRecalculator
+from calculate_primary.main import RecalculationWatermarks
+from calculate_primary.main import calculate_user
+from calculate_primary.poison import PoisonPersons
+
+
+def test_watermarks_unknown_person_is_not_stale():
+    watermarks = RecalculationWatermarks()
+    assert watermarks.is_stale(uuid4(), 10.0) is False
+
+
+def test_watermarks_stale_only_before_recalculation_start():
+    uuid = uuid4()
+    watermarks = RecalculationWatermarks()
+    watermarks.record(uuid, 10.0)
+
+    assert watermarks.is_stale(uuid, 9.0) is True
+    assert watermarks.is_stale(uuid, 10.0) is False
+    assert watermarks.is_stale(uuid, 11.0) is False
+    # Other persons are unaffected
+    assert watermarks.is_stale(uuid4(), 9.0) is False
+
+
+def test_watermarks_never_move_back():
+    uuid = uuid4()
+    watermarks = RecalculationWatermarks()
+    watermarks.record(uuid, 10.0)
+    watermarks.record(uuid, 5.0)
+
+    assert watermarks.is_stale(uuid, 9.0) is True
+
+
+def test_watermarks_forget_least_recently_recorded():
+    first, second, third = uuid4(), uuid4(), uuid4()
+    watermarks = RecalculationWatermarks(max_size=2)
+    watermarks.record(first, 10.0)
+    watermarks.record(second, 10.0)
+    watermarks.record(first, 11.0)
+    watermarks.record(third, 10.0)
+
+    assert watermarks.is_stale(first, 9.0) is True
+    assert watermarks.is_stale(second, 9.0) is False
+    assert watermarks.is_stale(third, 9.0) is True
+
+
+def test_calculate_user_records_watermark():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    watermarks = RecalculationWatermarks()
+
+    received_at = RecalculationWatermarks.now()
+    calculate_user(updater, uuid, watermarks)
+
+    updater.recalculate_user.assert_called_once_with(uuid, window=None)
+    assert watermarks.is_stale(uuid, received_at) is True
+
+
+def test_calculate_user_failure_does_not_record_watermark():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.side_effect = ValueError("MO is down")
+    watermarks = RecalculationWatermarks()
+
+    received_at = RecalculationWatermarks.now()
+    with pytest.raises(ValueError):
+        calculate_user(updater, uuid, watermarks)
+
+    assert watermarks.is_stale(uuid, received_at) is False
+
+
+def test_person_recalculator_skips_covered_events():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0)
+    poison = PoisonPersons(max_attempts=1, max_size=10)
+    recalculator = PersonRecalculator(updater, limiter, breaker, poison, AsyncMock())
+
+    received_at = RecalculationWatermarks.now()
+    asyncio.run(recalculator.recalculate(uuid, received_at))
+    # The same event, or any event received before the recalculation, is covered
+    asyncio.run(recalculator.recalculate(uuid, received_at))
+    assert updater.recalculate_user.call_count == 1
+
+    # Whereas later events are not
+    asyncio.run(recalculator.recalculate(uuid, RecalculationWatermarks.now()))
+    assert updater.recalculate_user.call_count == 2
+
+
+def test_calculate_user_from_history_records_read_time():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    watermarks = RecalculationWatermarks()
+    history = EngagementHistory(10.0, [{"uuid": "engagement_uuid"}])
+
+    calculate_user(updater, uuid, watermarks, history)
+
+    updater.recalculate_user.assert_called_once_with(
+        uuid, mo_engagements=history.engagements, window=None
+    )
+    # Only events received before the history was read are covered
+    assert watermarks.is_stale(uuid, 9.0) is True
+    assert watermarks.is_stale(uuid, 11.0) is False
+
+
+def test_person_recalculator_uses_latest_history():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    old = EngagementHistory(1.0, [{"uuid": "old"}])
+    new = EngagementHistory(2.0, [{"uuid": "new"}])
+
+    async def main(*calls):
+        limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1.0)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0)
+        poison = PoisonPersons(max_attempts=1, max_size=10)
+        recalculator = PersonRecalculator(
+            updater, limiter, breaker, poison, AsyncMock()
+        )
+        # Held back by the limiter, until every call has been handed over
+        async with limiter.slot():
+            tasks = [
+                asyncio.create_task(recalculator.recalculate(uuid, *args))
+                for args in calls
+            ]
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main((0.5, BULK, old), (0.0, BULK, new)))
+    updater.recalculate_user.assert_called_once_with(
+        uuid, mo_engagements=new.engagements, window=None
+    )
+
+    # Events received after the latest history was read require a fresh read
+    updater.reset_mock()
+    asyncio.run(main((0.5, BULK, old), (3.0, BULK, None), (1.5, BULK, new)))
+    updater.recalculate_user.assert_called_once_with(uuid, window=None)
+
+
+def test_person_recalculator_bounds_recalculation_to_changes():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0)
+    poison = PoisonPersons(max_attempts=1, max_size=10)
+    recalculator = PersonRecalculator(updater, limiter, breaker, poison, AsyncMock())
+    engagement = {
+        "uuid": "engagement_uuid",
+        "validity": {"from": "2020-01-01", "to": None},
+    }
+    changed = dict(engagement, validity={"from": "2021-01-01", "to": None})
+
+    # Unknown persons are recalculated in full
+    asyncio.run(
+        recalculator.recalculate(uuid, 0.0, BULK, EngagementHistory(1.0, [engagement]))
+    )
+    assert updater.recalculate_user.call_args.kwargs["window"] is None
+
+    # Unchanged histories are not recalculated at all
+    asyncio.run(
+        recalculator.recalculate(uuid, 2.0, BULK, EngagementHistory(3.0, [engagement]))
+    )
+    assert updater.recalculate_user.call_count == 1
+    assert recalculator.watermarks.is_stale(uuid, 2.5) is True
+
+    # Changed histories only within the window of the changes
+    asyncio.run(
+        recalculator.recalculate(uuid, 4.0, BULK, EngagementHistory(5.0, [changed]))
+    )
+    assert updater.recalculate_user.call_args.kwargs["window"] == (
+        datetime(2020, 1, 1),
+        datetime(9999, 12, 30),
+    )
+
+
+def test_person_recalculator_bounds_recalculation_to_horizon():
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.recalculate_user.return_value = {str(uuid): 0}
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0)
+    poison = PoisonPersons(max_attempts=1, max_size=10)
+    recalculator = PersonRecalculator(
+        updater,
+        limiter,
+        breaker,
+        poison,
+        AsyncMock(),
+        history_horizon=timedelta(days=30),
+    )
+    horizon = recalculator.horizon()
+    assert horizon == datetime.combine(date.today(), datetime.min.time()) - timedelta(
+        days=30
+    )
+
+    asyncio.run(recalculator.recalculate(uuid, RecalculationWatermarks.now()))
+    assert updater.recalculate_user.call_args.kwargs == {
+        "window": (horizon, datetime(9999, 12, 30))
+    }
+
+    # Unless a full recalculation is requested
+    asyncio.run(recalculator.recalculate(uuid, 0.0, full=True))
+    assert updater.recalculate_user.call_args.kwargs == {"window": None}
+
+
+def test_person_recalculator_skips_verified_persons(tmp_path):
+    uuid = uuid4()
+    updater = MagicMock()
+    updater.history_digest.side_effect = lambda engagements: engagements[0]["uuid"]
+    updater.primary_decision.return_value = []
+    history = EngagementHistory(1.0, [{"uuid": "verified"}])
+
+    def recalculate(history, edits, history_horizon=None):
+        updater.reset_mock(return_value=False, side_effect=False)
+        updater.recalculate_user.return_value = {str(uuid): edits}
+        # A recalculator per call, as if restarted in between
+        limiter = AdaptiveLimiter(min_limit=1, max_limit=1, latency_target=1.0)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0)
+        poison = PoisonPersons(max_attempts=1, max_size=10)
+        recalculator = PersonRecalculator(
+            updater,
+            limiter,
+            breaker,
+            poison,
+            AsyncMock(),
+            history_horizon=history_horizon,
+            digests=DigestStore(tmp_path / "digests.db"),
+        )
+        asyncio.run(recalculator.recalculate(uuid, 0.0, BULK, history))
+        return updater.recalculate_user.called
+
+    # Histories which were just edited are not verified
+    assert recalculate(history, 1) is True
+    assert recalculate(history, 0) is True
+    assert recalculate(history, 0) is False
+    # Until the history changes
+    assert recalculate(EngagementHistory(2.0, [{"uuid": "changed"}]), 0) is True
+    # Recalculations bounded to a window verify just that
+    windowed = EngagementHistory(3.0, [{"uuid": "windowed"}])
+    assert recalculate(windowed, 0, timedelta(days=30)) is True
+    assert recalculate(windowed, 0, timedelta(days=30)) is True
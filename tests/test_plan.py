@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import datetime
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from calculate_primary.plan import PlanWriter
+from calculate_primary.plan import apply_plan
+from calculate_primary.plan import edit_key
+from calculate_primary.plan import progress_path
+from calculate_primary.plan import read_plan
+from tests.test_primary import DUMMY_SETTINGS
+from tests.test_primary import MOPrimaryEngagementUpdaterTest
+
+
+def test_plan_records_edits_instead_of_making_them(tmp_path):
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    updater.helper.find_cut_dates.return_value = [
+        datetime.datetime(2930, 1, 1),
+        datetime.datetime(9999, 12, 30, 0, 0),
+    ]
+    engagements = [
+        {"uuid": "engagement_uuid", "primary": {"uuid": "non_primary_uuid"}},
+        {"uuid": "other_uuid", "primary": {"uuid": "non_primary_uuid"}},
+    ]
+    updater._read_engagement = lambda user_uuid, date: engagements
+
+    with PlanWriter(tmp_path / "plan.jsonl") as plan:
+        status = updater.recalculate_user("user_uuid", plan=plan)
+
+    assert status == {"user_uuid": 1}
+    assert plan.count == 1
+    updater.helper._mo_post.assert_not_called()
+    assert list(read_plan(tmp_path / "plan.jsonl")) == [
+        (
+            1,
+            {
+                "person": "user_uuid",
+                "engagement": "engagement_uuid",
+                "validity": {"from": "2930-01-01", "to": None},
+                "primary": "primary_uuid",
+                "reason": "non_primary -> primary",
+            },
+        )
+    ]
+
+
+def test_apply_plan_resumes_and_keeps_engagement_order(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    edits = [
+        {"engagement": "a", "validity": {"from": "2020-01-01", "to": None}},
+        {"engagement": "b", "validity": {"from": "2020-01-01", "to": None}},
+        {"engagement": "a", "validity": {"from": "2021-01-01", "to": None}},
+        {"engagement": "c", "validity": {"from": "2020-01-01", "to": None}},
+        {"engagement": "a", "validity": {"from": "2022-01-01", "to": None}},
+    ]
+    path.write_text(
+        "".join(json.dumps(dict(edit, primary="primary_uuid")) + "\n" for edit in edits)
+    )
+    # Line 2 was applied by a previous, interrupted apply
+    progress_path(path).write_text(
+        edit_key(2, dict(edits[1], primary="primary_uuid")) + "\n"
+    )
+
+    updater = MagicMock()
+    updater.settings.dry_run = False
+    written = []
+
+    def write_edit(payload):
+        if (
+            payload["uuid"] == "a"
+            and payload["data"]["validity"]["from"] == "2021-01-01"
+        ):
+            raise ValueError("Bad payload")
+        written.append((payload["uuid"], payload["data"]["validity"]["from"]))
+        return True
+
+    updater.write_edit.side_effect = write_edit
+
+    assert apply_plan(updater, path, concurrency=2) == 1
+    assert sorted(written) == [("a", "2020-01-01"), ("c", "2020-01-01")]
+    applied = progress_path(path).read_text().split()
+    assert sorted(int(key.split(":")[0]) for key in applied) == [1, 2, 4]
+
+    # Applying again retries just the edits left, in order
+    written.clear()
+    updater.write_edit.side_effect = lambda payload: written.append(
+        (payload["uuid"], payload["data"]["validity"]["from"])
+    )
+    assert apply_plan(updater, path) == 0
+    assert written == [("a", "2021-01-01"), ("a", "2022-01-01")]
+    assert updater.write_edit.call_args.args[0] == {
+        "type": "engagement",
+        "uuid": "a",
+        "data": {
+            "primary": {"uuid": "primary_uuid"},
+            "validity": {"from": "2022-01-01", "to": None},
+        },
+    }
+
+
+def test_apply_plan_does_not_resume_progress_of_earlier_plan(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    updater = MagicMock()
+    updater.settings.dry_run = False
+    written = []
+    updater.write_edit.side_effect = lambda payload: written.append(payload["uuid"])
+
+    def write(engagements):
+        with PlanWriter(path) as plan:
+            for engagement in engagements:
+                plan(
+                    {
+                        "engagement": engagement,
+                        "validity": {"from": "2020-01-01", "to": None},
+                        "primary": "primary_uuid",
+                    }
+                )
+
+    write(["a", "b"])
+    assert apply_plan(updater, path) == 0
+    assert sorted(written) == ["a", "b"]
+
+    # A new plan at the same path is applied in full
+    written.clear()
+    write(["c", "d"])
+    assert not progress_path(path).exists()
+    assert apply_plan(updater, path) == 0
+    assert sorted(written) == ["c", "d"]
+
+    # Even if the earlier progress survives, lines of other edits are not skipped
+    written.clear()
+    progress = progress_path(path).read_text()
+    write(["e", "d"])
+    progress_path(path).write_text(progress)
+    assert apply_plan(updater, path) == 0
+    assert written == ["e"]
+
+
+def test_apply_plan_refuses_to_run_dry(tmp_path):
+    path = tmp_path / "plan.jsonl"
+    with PlanWriter(path) as plan:
+        plan(
+            {
+                "engagement": "a",
+                "validity": {"from": "2020-01-01", "to": None},
+                "primary": "primary_uuid",
+            }
+        )
+    updater = MagicMock()
+    updater.settings.dry_run = True
+
+    with pytest.raises(ValueError):
+        apply_plan(updater, path)
+
+    # Nothing is recorded as applied, for a later apply to skip
+    updater.write_edit.assert_not_called()
+    assert not progress_path(path).exists()
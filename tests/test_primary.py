@@ -7,12 +7,23 @@ from operator import itemgetter
 from unittest import TestCase
 from unittest.mock import MagicMock
 from unittest.mock import call
+from unittest.mock import patch
+from uuid import uuid4
 
 import hypothesis.strategies as st
+import pytest
+import requests
 from hypothesis import given
 from more_itertools import unzip
+from os2mo_helpers.mora_helpers import MoraHelper
 
+from calculate_primary.common import ActiveEngagements
+from calculate_primary.common import InstrumentedMoraHelper
 from calculate_primary.common import MOPrimaryEngagementUpdater
+from calculate_primary.common import changed_window
+from calculate_primary.common import find_cut_dates
+from calculate_primary.common import is_transient
+from calculate_primary.common import stable_primary_counter
 from calculate_primary.config import AMQPConnectionSettings
 from calculate_primary.config import FastRAMQPISettings
 from calculate_primary.config import Settings
@@ -186,7 +197,6 @@ class Test_check_user(TestCase):
 
     def test_mora_cut_dates(self):
         """Test that mora cut-dates work as expected."""
-        from os2mo_helpers.mora_helpers import MoraHelper
 
         mora_helper = MoraHelper()
         mora_helper.read_user_engagement = MagicMock()
@@ -227,6 +237,101 @@ class Test_check_user(TestCase):
             engagement_uuids = list(map(itemgetter("uuid"), filtered_engagements))
             self.assertEqual(engagement_uuids, expected)
 
+    def test_find_cut_dates_mirrors_mora(self):
+        """Test that cut-dates of a history already read match those of mora."""
+
+        mora_helper = MoraHelper()
+        mora_helper.read_user_engagement = MagicMock()
+        mora_helper.read_user_engagement.return_value = self.engagements_fixture()
+
+        self.assertEqual(
+            find_cut_dates(self.engagements_fixture()),
+            mora_helper.find_cut_dates("user_uuid"),
+        )
+
+    def test_active_engagements(self):
+        """Test that swept engagements match how MO handles the `at` parameter."""
+        engagements = self.engagements_fixture()
+        active = ActiveEngagements(engagements)
+        # The last cut date only ends the last interval
+        for date in find_cut_dates(engagements)[:-1]:
+            active.advance(date)
+            self.assertEqual(active.engagements, engagements_at_date(date, engagements))
+
+    def test_active_engagements_signature(self):
+        """Test that the kept signature matches that of the active engagements."""
+        engagements = self.engagements_fixture()
+        signature = self.updater._engagement_signature
+        active = ActiveEngagements(engagements, signature=signature)
+        for date in find_cut_dates(engagements)[:-1]:
+            active.advance(date)
+            self.assertEqual(
+                active.signature,
+                self.updater._decision_signature(
+                    engagements_at_date(date, engagements)
+                ),
+            )
+            # Unchanged engagements are neither listed nor signed again
+            self.assertIs(active.engagements, active.engagements)
+            self.assertIs(active.signature, active.signature)
+
+    def test_active_engagements_ranked(self):
+        """Test that the top engagement is the lowest ranked active one."""
+        engagements = self.engagements_fixture()
+        rank = {"primary_uuid": 2, "fixed_primary_uuid": 1, "special_primary_uuid": 0}
+        active = ActiveEngagements(engagements, rank=lambda e: rank[e["uuid"]])
+        tops = {}
+        for date in find_cut_dates(engagements)[:-1]:
+            active.advance(date)
+            tops[date] = active.top()["uuid"] if active.top() else None
+        self.assertEqual(
+            list(tops.values()),
+            [
+                "primary_uuid",
+                "fixed_primary_uuid",
+                "primary_uuid",
+                "special_primary_uuid",
+                "special_primary_uuid",
+            ],
+        )
+
+    def test_changed_window(self):
+        """Test that the changed window spans the old and new changed validities."""
+        engagements = self.engagements_fixture()
+        self.assertIsNone(changed_window(engagements, engagements[::-1]))
+
+        moved = dict(engagements[1], validity={"from": "1940-1-1", "to": "1946-1-1"})
+        self.assertEqual(
+            changed_window(engagements, [engagements[0], moved, engagements[2]]),
+            (datetime.datetime(1939, 9, 1), datetime.datetime(1946, 1, 2)),
+        )
+        # Removed engagements change their entire validity
+        self.assertEqual(
+            changed_window(engagements, engagements[:2]),
+            (datetime.datetime(1949, 1, 1), datetime.datetime(9999, 12, 30)),
+        )
+
+    def test_check_user_from_history(self):
+        """Test that _check_user on a history agrees with reading it per date."""
+        engagements = [
+            dict(engagement, primary={"uuid": engagement["uuid"]})
+            for engagement in self.engagements_fixture()
+        ]
+        check_filters = [
+            lambda user_uuid, eng: eng["primary"]["uuid"] != "special_primary_uuid"
+        ]
+        self.assertEqual(
+            self.updater._check_user(check_filters, "user_uuid", engagements),
+            {
+                datetime.datetime(1931, 1, 1, 0, 0): (1, 1, 1),
+                datetime.datetime(1939, 9, 1, 0, 0): (2, 2, 2),
+                datetime.datetime(1945, 9, 3, 0, 0): (1, 1, 1),
+                datetime.datetime(1949, 1, 1, 0, 0): (2, 2, 1),
+                datetime.datetime(1950, 1, 2, 0, 0): (1, 1, 0),
+            },
+        )
+        self.updater.helper.find_cut_dates.assert_not_called()
+
     def test_check_user_overlapping(self):
         """Test the result of running _check_user on overlapping engagements."""
         # See test_engagement_at_date for details
@@ -278,8 +383,8 @@ class Test_check_user(TestCase):
         ]
         # It does not normally return an ordered dict, but for testing we want a
         # consistent order.
-        self.updater._check_user = lambda check_filters, user_uuid: OrderedDict(
-            fixture_data
+        self.updater._check_user = (
+            lambda check_filters, user_uuid, history=None: OrderedDict(fixture_data)
         )
 
         _, strings, user_uuids, dates = unzip(
@@ -379,6 +484,101 @@ class Test_recalculate_user(TestCase):
             },
         )
 
+    def test_recalculate_from_history(self):
+        """Test that a history already read is recalculated without reading MO."""
+        engagements = [
+            {
+                "uuid": "engagement_uuid",
+                "primary": {"uuid": "non_primary_uuid"},
+                "validity": {"from": "2930-01-01", "to": None},
+            }
+        ]
+
+        self.assertEqual(
+            self.updater.recalculate_user("user_uuid", mo_engagements=engagements),
+            {"user_uuid": 1},
+        )
+        self.updater.helper.find_cut_dates.assert_not_called()
+        self.updater.helper.read_user_engagements.assert_not_called()
+        self.updater.helper._mo_post.assert_called_once()
+        # The history itself is left untouched
+        self.assertEqual(engagements[0]["primary"], {"uuid": "non_primary_uuid"})
+
+    def test_recalculate_within_window(self):
+        """Test that only intervals overlapping the window are recalculated."""
+        engagements = [
+            {
+                "uuid": "engagement_uuid_1",
+                "primary": {"uuid": "non_primary_uuid"},
+                "validity": {"from": "2930-01-01", "to": "2930-12-31"},
+            },
+            {
+                "uuid": "engagement_uuid_2",
+                "primary": {"uuid": "non_primary_uuid"},
+                "validity": {"from": "2931-01-01", "to": None},
+            },
+        ]
+        window = (datetime.datetime(2931, 6, 1), datetime.datetime(2931, 7, 1))
+
+        self.assertEqual(
+            self.updater.recalculate_user(
+                "user_uuid", mo_engagements=engagements, window=window
+            ),
+            {"user_uuid": 1},
+        )
+        # Written only within the window
+        self.updater._ensure_primary.assert_called_once_with(
+            engagements[1], "primary_uuid", {"from": "2931-06-01", "to": "2931-06-30"}
+        )
+
+    def test_recalculate_reuses_decisions_for_unchanged_engagements(self):
+        """Test that equal engagements at different dates are decided once."""
+        self.updater._decide_primary = MagicMock(wraps=self.updater._decide_primary)
+        engagements = [
+            {
+                "uuid": "engagement_uuid_1",
+                "primary": {"uuid": "primary_uuid"},
+                "validity": {"from": "2930-01-01", "to": "2930-12-31"},
+            },
+            {
+                "uuid": "engagement_uuid_1",
+                "primary": {"uuid": "primary_uuid"},
+                "validity": {"from": "2931-01-01", "to": "2931-12-31"},
+            },
+            {
+                "uuid": "engagement_uuid_2",
+                "primary": {"uuid": "non_primary_uuid"},
+                "validity": {"from": "2932-01-01", "to": None},
+            },
+        ]
+
+        self.updater.recalculate_user("user_uuid", mo_engagements=engagements)
+        self.assertEqual(self.updater._decide_primary.call_count, 2)
+        self.assertEqual(self.updater._ensure_primary.call_count, 3)
+
+    def test_decision_signature_narrowed_by_decision_attributes(self):
+        """Test that only the decision attributes are part of the signature."""
+        engagement = {"uuid": "engagement_uuid", "fraction": 1, "job": "a"}
+        changed = dict(engagement, job="b", validity={"from": "2930-01-01"})
+        self.assertNotEqual(
+            self.updater._decision_signature([engagement]),
+            self.updater._decision_signature([changed]),
+        )
+        self.updater.decision_attributes = ("uuid", "fraction")
+        self.assertEqual(
+            self.updater._decision_signature([engagement]),
+            self.updater._decision_signature([changed]),
+        )
+
+    def test_decision_signature_of_decision_attributes_values(self):
+        """Test that engagements are signed by the values of decision attributes."""
+        self.updater.decision_attributes = ("uuid", "primary", "fraction")
+        engagement = {"uuid": "a", "primary": {"uuid": "primary_uuid"}, "job": "b"}
+        self.assertEqual(
+            self.updater._decision_signature([engagement]),
+            (("a", (("uuid", "primary_uuid"),), None),),
+        )
+
     def test_recalculate_multiple_engagements(self):
         """Test that non-primary engagements yield one primary after recalculate.
 
@@ -519,3 +719,214 @@ class Test_recalculate_user(TestCase):
             ]
         )
         self.updater.helper._mo_post.assert_not_called()
+
+
+def test_instrumented_mora_helper_notifies_observers():
+    helper = InstrumentedMoraHelper()
+    observer = MagicMock()
+    helper.observers.append(observer)
+
+    with patch("calculate_primary.common.requests.post") as post:
+        post.return_value = AttrDict({"status_code": 400})
+        helper._mo_post("details/edit", {})
+        post.return_value = AttrDict({"status_code": 503})
+        helper._mo_post("details/edit", {})
+        post.side_effect = ConnectionError()
+        with pytest.raises(ConnectionError):
+            helper._mo_post("details/edit", {})
+
+    assert [ok for (_, ok), _ in observer.call_args_list] == [True, False, False]
+
+
+def test_instrumented_mora_helper_raises_gateway_errors_before_decoding():
+    helper = InstrumentedMoraHelper(timeout=2.5)
+    bad_gateway = requests.Response()
+    bad_gateway.status_code = 502
+    bad_gateway._content = b"<html>Bad Gateway</html>"
+
+    with patch("calculate_primary.common.requests.get") as get:
+        get.return_value = bad_gateway
+        with pytest.raises(requests.exceptions.HTTPError) as excinfo:
+            helper._mo_lookup("user_uuid", "e/{}/details/engagement")
+
+    assert is_transient(excinfo.value)
+    assert get.call_count == 1
+    assert get.call_args.kwargs["timeout"] == 2.5
+
+
+@pytest.mark.parametrize(
+    "exception,expected",
+    [
+        (requests.exceptions.ConnectionError(), True),
+        (requests.exceptions.ReadTimeout(), True),
+        (requests.exceptions.HTTPError(response=MagicMock(status_code=502)), True),
+        (requests.exceptions.HTTPError(response=MagicMock(status_code=404)), False),
+        (ValueError(), False),
+    ],
+)
+def test_is_transient(exception, expected):
+    assert is_transient(exception) is expected
+
+
+def test_ensure_primary_retries_transient_failures():
+    settings = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration="DEFAULT",
+        mo_retry_max_wait=0.001,
+    )
+    updater = MOPrimaryEngagementUpdaterTest(settings)
+    ok = AttrDict({"status_code": 200})
+    unavailable = MagicMock(status_code=503)
+    unavailable.raise_for_status.side_effect = requests.exceptions.HTTPError(
+        response=unavailable
+    )
+    updater.helper._mo_post.side_effect = [
+        requests.exceptions.ReadTimeout(),
+        unavailable,
+        ok,
+    ]
+
+    engagement = {"uuid": "engagement_uuid", "primary": {"uuid": "non_primary_uuid"}}
+    validity = {"from": "2930-01-01", "to": None}
+    assert updater._ensure_primary(engagement, "primary_uuid", validity) is True
+    assert updater.helper._mo_post.call_count == 3
+
+
+def test_ensure_primary_does_not_retry_client_errors():
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    updater.helper._mo_post.side_effect = ValueError("Bad payload")
+
+    engagement = {"uuid": "engagement_uuid", "primary": {"uuid": "non_primary_uuid"}}
+    validity = {"from": "2930-01-01", "to": None}
+    with pytest.raises(ValueError):
+        updater._ensure_primary(engagement, "primary_uuid", validity)
+    assert updater.helper._mo_post.call_count == 1
+
+
+def test_read_engagement_digest_ignores_order_but_not_changes():
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    engagements = [
+        {"uuid": "engagement_uuid_1", "primary": {"uuid": "primary_uuid"}},
+        {"uuid": "engagement_uuid_2", "primary": {"uuid": "non_primary_uuid"}},
+    ]
+    updater.helper.read_user_engagements.return_value = engagements
+    digest = updater.read_engagement_digest("user_uuid")
+
+    updater.helper.read_user_engagements.return_value = engagements[::-1]
+    assert updater.read_engagement_digest("user_uuid") == digest
+
+    engagements[0]["primary"]["uuid"] = "non_primary_uuid"
+    assert updater.read_engagement_digest("user_uuid") != digest
+
+
+def test_history_digest_ignores_irrelevant_attributes():
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    updater.decision_attributes = ("uuid", "primary")
+    validity = {"from": "2024-01-01", "to": None}
+    engagements = [
+        {"uuid": "1", "primary": {"uuid": "primary_uuid"}, "validity": validity},
+        {"uuid": "2", "primary": {"uuid": "non_primary_uuid"}, "validity": validity},
+    ]
+    digest = updater.history_digest(engagements)
+
+    assert updater.history_digest(engagements[::-1]) == digest
+    renamed = [dict(engagement, name="renamed") for engagement in engagements]
+    assert updater.history_digest(renamed) == digest
+    moved = [engagements[0], dict(engagements[1], validity={"from": "2024-01-02"})]
+    assert updater.history_digest(moved) != digest
+
+    assert updater.primary_decision(engagements) == [["1", "2024-01-01", None]]
+
+
+def test_history_digest_changes_with_decision_settings():
+    engagements = [{"uuid": "1", "validity": {"from": "2024-01-01", "to": None}}]
+    digest = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS).history_digest(engagements)
+
+    assert (
+        MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS).history_digest(engagements)
+        == digest
+    )
+    reordered = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration="DEFAULT",
+        eng_types_primary_order=[uuid4()],
+    )
+    assert (
+        MOPrimaryEngagementUpdaterTest(reordered).history_digest(engagements) != digest
+    )
+    opus = Settings(fastramqpi=DUMMY_FASTRAMQPI, integration="OPUS")
+    assert MOPrimaryEngagementUpdaterTest(opus).history_digest(engagements) != digest
+
+
+class RankedPrimaryEngagementUpdaterTest(MOPrimaryEngagementUpdaterTest):
+    def _primary_rank(self, engagement):
+        return engagement["rank"]
+
+    def _find_primary(self, mo_engagements):
+        return min(mo_engagements, key=self._primary_rank)["uuid"]
+
+
+@pytest.mark.parametrize(
+    "prefer_current_primary,ranks,expected",
+    [
+        (False, (1, 1), "first"),
+        (True, (1, 1), "second"),
+        (True, (1, 2), "first"),
+    ],
+)
+def test_decide_primary_prefers_current_primary(
+    prefer_current_primary, ranks, expected
+):
+    settings = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration="DEFAULT",
+        prefer_current_primary=prefer_current_primary,
+    )
+    updater = RankedPrimaryEngagementUpdaterTest(settings)
+    mo_engagements = [
+        {"uuid": "first", "rank": ranks[0], "primary": {"uuid": "non_primary_uuid"}},
+        {"uuid": "second", "rank": ranks[1], "primary": {"uuid": "primary_uuid"}},
+    ]
+    assert updater._decide_primary(mo_engagements) == (expected, "primary")
+
+
+@pytest.mark.parametrize(
+    "current,stable",
+    [
+        # The equally ranked current primary is kept, skipping two flips
+        ("second", 2),
+        # The current primary is found anyway, thus no flip was avoided
+        ("first", 0),
+    ],
+)
+def test_recalculate_counts_flips_avoided_by_current_primary(current, stable):
+    settings = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration="DEFAULT",
+        prefer_current_primary=True,
+    )
+    updater = RankedPrimaryEngagementUpdaterTest(settings)
+    engagements = [
+        {
+            "uuid": uuid,
+            "rank": 1,
+            "primary": {
+                "uuid": "primary_uuid" if uuid == current else "non_primary_uuid"
+            },
+            "validity": {"from": "2930-01-01", "to": None},
+        }
+        for uuid in ("first", "second")
+    ]
+    # A change irrelevant to primarity, splitting the history in two intervals
+    engagements.append(
+        dict(engagements[1], validity={"from": "2931-01-01", "to": None})
+    )
+    engagements[1] = dict(
+        engagements[1], validity={"from": "2930-01-01", "to": "2930-12-31"}
+    )
+
+    before = stable_primary_counter._value.get()
+    assert updater.recalculate_user("user_uuid", mo_engagements=engagements) == {
+        "user_uuid": 0
+    }
+    assert stable_primary_counter._value.get() - before == stable
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import csv
+import datetime
+import json
+
+from calculate_primary.report import Report
+from tests.test_primary import DUMMY_SETTINGS
+from tests.test_primary import MOPrimaryEngagementUpdaterTest
+
+
+def _history():
+    return [
+        {
+            "uuid": uuid,
+            "primary": {"uuid": uuid},
+            "validity": {"from": start, "to": end},
+        }
+        for uuid, start, end in [
+            ("primary_uuid", "1931-01-01", "1950-01-01"),
+            ("fixed_primary_uuid", "1939-09-01", "1945-09-02"),
+            ("non_primary_uuid", "1951-01-01", None),
+        ]
+    ]
+
+
+def test_check_user_writes_findings_to_report(tmp_path, capsys):
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    capsys.readouterr()
+
+    with Report(tmp_path / "report.ndjson") as report:
+        updater.check_user("user_uuid", _history(), report)
+
+    assert capsys.readouterr().out == ""
+    records = list(
+        map(json.loads, (tmp_path / "report.ndjson").read_text().split("\n")[:-1])
+    )
+    assert records == [
+        {
+            "kind": "finding",
+            "person": "user_uuid",
+            "date": "1939-09-01",
+            "finding": "Too many primaries",
+        },
+        {
+            "kind": "finding",
+            "person": "user_uuid",
+            "date": "1951-01-01",
+            "finding": "No primary",
+        },
+        {
+            "kind": "summary",
+            "findings": {"Too many primaries": 1, "No primary": 1},
+            "edits": {},
+        },
+    ]
+
+
+def test_dry_run_recalculation_writes_edits_to_csv_report(tmp_path):
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    updater.helper.find_cut_dates.return_value = [
+        datetime.datetime(2930, 1, 1),
+        datetime.datetime(9999, 12, 30, 0, 0),
+    ]
+    engagement = {"uuid": "engagement_uuid", "primary": {"uuid": "non_primary_uuid"}}
+    updater._read_engagement = lambda user_uuid, date: [engagement]
+
+    with Report(tmp_path / "report.csv", "csv") as report:
+        updater.recalculate_users(["user_uuid"], plan=report)
+
+    updater.helper._mo_post.assert_not_called()
+    with (tmp_path / "report.csv").open(newline="") as report_file:
+        rows = [
+            {k: v for k, v in row.items() if v} for row in csv.DictReader(report_file)
+        ]
+    assert rows == [
+        {
+            "kind": "edit",
+            "person": "user_uuid",
+            "engagement": "engagement_uuid",
+            "from": "2930-01-01",
+            "primary": "primary_uuid",
+            "reason": "non_primary -> primary",
+        },
+        {"kind": "summary", "reason": "non_primary -> primary", "count": "1"},
+    ]
+
+
+def test_check_all_reads_each_history_once_and_aggregates(tmp_path):
+    updater = MOPrimaryEngagementUpdaterTest(DUMMY_SETTINGS)
+    updater.helper.read_all_users.return_value = [
+        {"uuid": f"user_{i}"} for i in range(20)
+    ]
+    updater.helper.read_user_engagements.side_effect = lambda **kwargs: _history()
+
+    with Report(tmp_path / "report.ndjson") as report:
+        findings = updater.check_all(report=report, concurrency=4)
+
+    assert findings == {"Too many primaries": 20, "No primary": 20}
+    assert report.findings == findings
+    assert updater.helper.read_user_engagements.call_count == 20
+    assert updater.helper.read_user_engagements.call_args.kwargs["read_all"] is True
+    updater.helper.find_cut_dates.assert_not_called()
+    # Findings are reported in the order of the users, however checked
+    persons = [
+        json.loads(line).get("person")
+        for line in (tmp_path / "report.ndjson").read_text().splitlines()
+    ]
+    assert persons[:-1] == [f"user_{i}" for i in range(20) for _ in range(2)]
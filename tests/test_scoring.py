@@ -0,0 +1,182 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import hypothesis.strategies as st
+import pytest
+from hypothesis import given
+
+from calculate_primary.common import MultipleFixedPrimaries
+from calculate_primary.common import NoPrimaryFound
+from calculate_primary.config import Settings
+from calculate_primary.default import DefaultPrimaryEngagementUpdater
+from calculate_primary.opus import OPUSPrimaryEngagementUpdater
+from calculate_primary.sd import SDPrimaryEngagementUpdater
+from tests.test_primary import DUMMY_FASTRAMQPI
+
+np = pytest.importorskip("numpy")
+
+from calculate_primary.scoring import EngagementColumns  # noqa: E402
+from calculate_primary.scoring import find_primaries  # noqa: E402
+
+# Strings, as given by MO, unlike the UUIDs of eng_types_primary_order
+ENGAGEMENT_TYPES = [str(uuid4()) for _ in range(3)]
+PRIMARY_TYPES = {
+    "fixed_primary": "fixed_primary_uuid",
+    "primary": "primary_uuid",
+    "non_primary": "non_primary_uuid",
+}
+
+
+class UpdaterTestMixin:
+    def _get_mora_helper(self, settings):
+        return MagicMock()
+
+    def _find_primary_types(self):
+        return PRIMARY_TYPES, [PRIMARY_TYPES["fixed_primary"], PRIMARY_TYPES["primary"]]
+
+
+UPDATERS = {
+    "DEFAULT": type("Default", (UpdaterTestMixin, DefaultPrimaryEngagementUpdater), {}),
+    "SD": type("SD", (UpdaterTestMixin, SDPrimaryEngagementUpdater), {}),
+    "OPUS": type("OPUS", (UpdaterTestMixin, OPUSPrimaryEngagementUpdater), {}),
+}
+
+engagement_strategy = st.fixed_dictionaries(
+    {
+        "user_key": st.sampled_from(["1", "2", "05", "10", "abc", "ABC"]),
+        "fraction": st.sampled_from([None, 0, 1, 10, 100]),
+        # The last engagement type is not in eng_types_primary_order
+        "engagement_type": st.builds(dict, uuid=st.sampled_from(ENGAGEMENT_TYPES)),
+        "primary": st.builds(dict, uuid=st.sampled_from(list(PRIMARY_TYPES.values()))),
+    }
+)
+
+
+@pytest.mark.parametrize("integration", UPDATERS)
+@given(groups=st.lists(st.lists(engagement_strategy, min_size=1, max_size=5)))
+def test_find_primaries_agrees_with_decide_primary(integration, groups):
+    settings = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration=integration,
+        eng_types_primary_order=ENGAGEMENT_TYPES[:2],
+    )
+    updater = UPDATERS[integration](settings)
+
+    rows = []
+    expected = []
+    for person, group in enumerate(groups):
+        group = [dict(e, uuid=f"{person}-{i}") for i, e in enumerate(group)]
+        rows.extend((person, 0, engagement) for engagement in group)
+        try:
+            expected.append(updater._decide_primary(group))
+        except (MultipleFixedPrimaries, NoPrimaryFound):
+            expected.append(None)
+
+    columns = EngagementColumns.from_engagements(
+        rows, PRIMARY_TYPES["fixed_primary"], settings.eng_types_primary_order
+    )
+    primaries = find_primaries(integration, columns)
+
+    assert list(primaries.person) == list(range(len(groups)))
+    actual = [
+        None
+        if conflict
+        else (rows[row][2]["uuid"], "fixed_primary" if fixed else "primary")
+        for row, fixed, conflict in zip(
+            primaries.row, primaries.fixed, primaries.conflict
+        )
+    ]
+    assert actual == expected
+
+
+def test_find_primaries_groups_by_person_and_interval():
+    rows = [
+        (1, 1, {"uuid": "a", "user_key": "1", "fraction": 10}),
+        (0, 0, {"uuid": "b", "user_key": "2", "fraction": 10}),
+        (1, 0, {"uuid": "c", "user_key": "3", "fraction": 10}),
+        (1, 1, {"uuid": "d", "user_key": "4", "fraction": 20}),
+    ]
+    columns = EngagementColumns.from_engagements(rows, "fixed_primary_uuid")
+    primaries = find_primaries("SD", columns)
+
+    assert list(zip(primaries.person, primaries.interval)) == [(0, 0), (1, 0), (1, 1)]
+    assert [rows[row][2]["uuid"] for row in primaries.row] == ["b", "c", "d"]
+
+    assert (
+        len(find_primaries("SD", EngagementColumns.from_engagements([], "")).row) == 0
+    )
+
+
+@pytest.mark.parametrize("user_key", [None, "abc", 12.5])
+def test_find_primaries_ranks_invalid_opus_user_keys_last(user_key):
+    settings = Settings(
+        fastramqpi=DUMMY_FASTRAMQPI,
+        integration="OPUS",
+        eng_types_primary_order=ENGAGEMENT_TYPES[:1],
+    )
+    updater = UPDATERS["OPUS"](settings)
+    engagement_type = {"uuid": ENGAGEMENT_TYPES[0]}
+    primary = {"uuid": PRIMARY_TYPES["primary"]}
+    group = [
+        {"uuid": "a", "user_key": user_key, "engagement_type": engagement_type},
+        {"uuid": "b", "user_key": "7", "engagement_type": engagement_type},
+    ]
+    group = [dict(e, fraction=None, primary=primary) for e in group]
+
+    columns = EngagementColumns.from_engagements(
+        [(0, 0, e) for e in group],
+        PRIMARY_TYPES["fixed_primary"],
+        settings.eng_types_primary_order,
+    )
+    primaries = find_primaries("OPUS", columns)
+
+    assert updater._decide_primary(group) == ("b", "primary")
+    assert [group[row]["uuid"] for row in primaries.row] == ["b"]
+
+
+history_strategy = st.lists(
+    st.tuples(
+        engagement_strategy,
+        st.sampled_from(["2020-01-01", "2021-01-01", "2022-01-01"]),
+        st.sampled_from([None, "2020-12-31", "2021-06-30"]),
+    ),
+    min_size=1,
+    max_size=4,
+)
+
+
+@pytest.mark.parametrize("integration", UPDATERS)
+@given(histories=st.lists(history_strategy, min_size=1, max_size=4))
+def test_batched_scoring_plans_the_same_edits(integration, histories):
+    def recalculate(batched_scoring):
+        settings = Settings(
+            fastramqpi=DUMMY_FASTRAMQPI,
+            integration=integration,
+            eng_types_primary_order=ENGAGEMENT_TYPES[:2],
+            batched_scoring=batched_scoring,
+        )
+        updater = UPDATERS[integration](settings)
+        store = MagicMock()
+        store.history.side_effect = lambda user: users[user]
+        updater.recalculate_user = MagicMock(wraps=updater.recalculate_user)
+        edits = []
+        updater.recalculate_users(users, store=store, plan=edits.append)
+        # Batched scoring did not fail, leaving the users to be decided one by one
+        for call in updater.recalculate_user.call_args_list:
+            assert (call.kwargs["find_primary"] is not None) == batched_scoring
+        return edits
+
+    users = {}
+    for history in histories:
+        users[uuid4()] = [
+            dict(
+                engagement,
+                uuid=f"engagement-{i}",
+                validity={"from": start, "to": end if end and end > start else None},
+            )
+            for i, (engagement, start, end) in enumerate(history)
+        ]
+
+    assert recalculate(True) == recalculate(False)
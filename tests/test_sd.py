@@ -5,6 +5,7 @@ from datetime import datetime
 from unittest.mock import MagicMock
 from uuid import uuid4
 
+from calculate_primary.common import ActiveEngagements
 from calculate_primary.sd import SDPrimaryEngagementUpdater
 
 
@@ -207,3 +208,22 @@ def test_sd_by_user_key(dummy_settings):
             },
         },
     )
+
+
+def test_sd_ranked_history_agrees_with_find_primary(dummy_settings):
+    updater = SDPrimaryEngagementUpdaterTest(dummy_settings)
+    mo_engagements = [
+        {"uuid": "a", "user_key": "10", "fraction": 1},
+        {"uuid": "b", "user_key": "abc", "fraction": 100},
+        {"uuid": "c", "user_key": "5", "fraction": 100},
+        {"uuid": "d", "user_key": "7", "fraction": None},
+    ]
+
+    validity = {"from": "2024-01-14", "to": None}
+    active = ActiveEngagements(
+        [dict(engagement, validity=validity) for engagement in mo_engagements],
+        rank=updater._primary_rank,
+    )
+    active.advance(datetime.fromisoformat("2024-01-14"))
+
+    assert active.top()["uuid"] == updater._find_primary(mo_engagements) == "c"
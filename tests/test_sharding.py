@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+from collections import Counter
+from uuid import UUID
+from uuid import uuid4
+
+import pytest
+from pydantic import ValidationError
+
+from calculate_primary.config import Settings
+from calculate_primary.sharding import jump_hash
+from calculate_primary.sharding import shard_for
+from calculate_primary.sharding import shard_routing_key
+
+
+def test_jump_hash_reference_values():
+    # Values from the C++ reference implementation by Lamping and Veach
+    assert jump_hash(0, 1) == 0
+    assert [jump_hash(key, 10) for key in range(5)] == [0, 6, 6, 8, 1]
+    assert jump_hash(2**64 - 1, 1000) == 313
+
+
+def test_shard_for_is_stable():
+    person_uuid = UUID("23d2dfc7-6ceb-47cf-97ed-db6beadcb09b")
+    assert shard_for(person_uuid, 4) == shard_for(person_uuid, 4)
+    assert shard_for(person_uuid, 1) == 0
+
+
+def test_shard_for_distribution_and_minimal_movement():
+    persons = [uuid4() for _ in range(4000)]
+    before = {person: shard_for(person, 4) for person in persons}
+    after = {person: shard_for(person, 5) for person in persons}
+
+    assert set(Counter(before.values())) == {0, 1, 2, 3}
+    assert all(count > 800 for count in Counter(before.values()).values())
+    # Growing the number of shards only moves persons onto the new shard
+    moved = [person for person in persons if before[person] != after[person]]
+    assert all(after[person] == 4 for person in moved)
+    assert len(moved) < 1000
+
+
+def test_shard_routing_key():
+    assert shard_routing_key(3, "bulk") == "calculate_primary.person.3.bulk"
+    assert shard_routing_key(3) == "calculate_primary.person.3.*"
+
+
+def test_person_shard_must_be_within_person_shards(load_settings_overrides):
+    assert Settings(person_shards=3, person_shard=2).person_shard == 2
+    with pytest.raises(ValidationError):
+        Settings(person_shards=3, person_shard=3)
@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: Magenta ApS <https://magenta.dk>
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+
+from calculate_primary.autogenerated_graphql_client import GetEngagementsEngagements
+from calculate_primary.diff import main
+from calculate_primary.snapshot import main as snapshot_main
+from calculate_primary.store import EngagementStore
+from calculate_primary.store import changed_persons
+from calculate_primary.store import stream_snapshot
+
+
+def _validity(person, engagement, start, end=None, fraction=None, primary=None):
+    return {
+        "uuid": str(engagement),
+        "user_key": "1234",
+        "fraction": fraction,
+        "primary": {"uuid": str(primary)} if primary else None,
+        "engagement_type": {"uuid": "a7a8d5a8-0f5e-4bd4-a11e-a9b2f93e1a4e"},
+        "validity": {"from": f"{start}T00:00:00+01:00", "to": end},
+        "person": [{"uuid": str(person)}],
+    }
+
+
+def _page(validities, next_cursor=None):
+    return GetEngagementsEngagements.parse_obj(
+        {
+            "objects": [{"validities": validities}],
+            "page_info": {"next_cursor": next_cursor},
+        }
+    )
+
+
+def test_store_serves_history_per_person():
+    person, other = uuid4(), uuid4()
+    engagement, other_engagement = uuid4(), uuid4()
+    primary = uuid4()
+    mo = MagicMock()
+    mo.get_engagements = AsyncMock(
+        side_effect=[
+            _page(
+                [
+                    _validity(person, engagement, "2020-01-01", "2020-12-31T00:00:00"),
+                    _validity(other, other_engagement, "2021-01-01", fraction=500),
+                ],
+                next_cursor="MQ==",
+            ),
+            _page([_validity(person, engagement, "2021-01-01", primary=primary)]),
+        ]
+    )
+
+    store = asyncio.run(EngagementStore.load(mo, page_size=2))
+
+    assert mo.get_engagements.call_args_list[1].kwargs == {"cursor": "MQ==", "limit": 2}
+    assert len(store) == 3
+    assert set(store.persons()) == {person, other}
+    assert store.history(person) == [
+        {
+            "uuid": str(engagement),
+            "user_key": "1234",
+            "fraction": None,
+            "primary": None,
+            "engagement_type": {"uuid": "a7a8d5a8-0f5e-4bd4-a11e-a9b2f93e1a4e"},
+            "validity": {"from": "2020-01-01", "to": "2020-12-31"},
+        },
+        {
+            "uuid": str(engagement),
+            "user_key": "1234",
+            "fraction": None,
+            "primary": {"uuid": str(primary)},
+            "engagement_type": {"uuid": "a7a8d5a8-0f5e-4bd4-a11e-a9b2f93e1a4e"},
+            "validity": {"from": "2021-01-01", "to": None},
+        },
+    ]
+    assert [e["fraction"] for e in store.history(other)] == [500]
+    assert store.history(uuid4()) == []
+    assert store.history(primary) == []
+
+
+def test_snapshot_roundtrip(tmp_path):
+    persons = [uuid4() for _ in range(3)]
+    store = EngagementStore()
+    page = _page(
+        [
+            _validity(persons[2], uuid4(), "2020-01-01", fraction=10),
+            _validity(persons[0], uuid4(), "2021-01-01", primary=uuid4()),
+            _validity(persons[2], uuid4(), "2022-01-01", "2022-06-30T00:00:00"),
+        ]
+    )
+    for validity in page.objects[0].validities:
+        store.add(validity.person[0].uuid, validity)
+
+    path = tmp_path / "engagements.snapshot"
+    store.write_snapshot(path)
+    snapshot = EngagementStore.open_snapshot(path)
+
+    assert len(snapshot) == len(store) == 3
+    assert list(snapshot.persons()) == list(store.persons())
+    for person in persons:
+        assert snapshot.history(person) == store.history(person)
+    assert snapshot.history(persons[1]) == []
+    assert snapshot.nbytes == store.nbytes
+
+    # Snapshots of snapshots are identical
+    snapshot.write_snapshot(tmp_path / "copy.snapshot")
+    assert (tmp_path / "copy.snapshot").read_bytes() == path.read_bytes()
+
+
+def test_snapshot_command_streams_pages_to_snapshot(tmp_path, capsys):
+    persons = [uuid4() for _ in range(3)]
+    pages = [
+        _page(
+            [
+                _validity(persons[2], uuid4(), "2020-01-01", fraction=10),
+                _validity(persons[0], uuid4(), "2021-01-01", primary=uuid4()),
+            ],
+            next_cursor="MQ==",
+        ),
+        _page([_validity(persons[2], uuid4(), "2022-01-01", "2022-06-30T00:00:00")]),
+        _page([]),
+    ]
+    pages[1].page_info.next_cursor = "Mg=="
+    mo = MagicMock()
+    mo.get_engagements = AsyncMock(side_effect=pages)
+
+    @asynccontextmanager
+    async def open_graphql_client(settings):
+        yield mo
+
+    path = tmp_path / "engagements.snapshot"
+    with patch("calculate_primary.snapshot.Settings"), patch(
+        "calculate_primary.snapshot.open_graphql_client", open_graphql_client
+    ):
+        snapshot_main([str(path), "--page-size", "2"])
+
+    assert "Engagement validities: 3" in capsys.readouterr().out
+    assert mo.get_engagements.call_args_list[2].kwargs == {"cursor": "Mg==", "limit": 2}
+    # Spill files are cleaned up
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+    # Identical to loading the engagements into memory, and writing those
+    mo.get_engagements = AsyncMock(side_effect=pages)
+    store = asyncio.run(EngagementStore.load(mo))
+    store.write_snapshot(tmp_path / "loaded.snapshot")
+    assert path.read_bytes() == (tmp_path / "loaded.snapshot").read_bytes()
+    snapshot = EngagementStore.open_snapshot(path)
+    assert sorted(snapshot.persons()) == sorted([persons[0], persons[2]])
+    assert snapshot.history(persons[2]) == store.history(persons[2])
+
+    # Organisations without engagements have empty snapshots
+    mo.get_engagements = AsyncMock(return_value=_page([]))
+    asyncio.run(stream_snapshot(mo, path))
+    assert len(EngagementStore.open_snapshot(path)) == 0
+
+
+def test_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "engagements.snapshot"
+    EngagementStore().write_snapshot(path)
+    assert len(EngagementStore.open_snapshot(path)) == 0
+
+    data = path.read_bytes()
+    path.write_bytes(data[:6] + b"\xff\xff" + data[8:])
+    with pytest.raises(ValueError, match="version"):
+        EngagementStore.open_snapshot(path)
+
+    path.write_bytes(b"not a snapshot")
+    with pytest.raises(ValueError, match="Not an engagement snapshot"):
+        EngagementStore.open_snapshot(path)
+
+
+def test_changed_persons_compares_relevant_attributes(tmp_path, capsys):
+    moved, refractioned, unchanged, removed, added = sorted(uuid4() for _ in range(5))
+    engagements = {person: uuid4() for person in (moved, refractioned, unchanged)}
+
+    def store(*validities):
+        store = EngagementStore()
+        for validity in _page(list(validities)).objects[0].validities:
+            store.add(validity.person[0].uuid, validity)
+        return store
+
+    old = store(
+        _validity(moved, engagements[moved], "2020-01-01"),
+        _validity(refractioned, engagements[refractioned], "2020-01-01", fraction=1),
+        _validity(unchanged, engagements[unchanged], "2020-01-01"),
+        _validity(removed, uuid4(), "2020-01-01"),
+    )
+    new = store(
+        _validity(added, uuid4(), "2020-01-01"),
+        _validity(unchanged, engagements[unchanged], "2020-01-01"),
+        _validity(refractioned, engagements[refractioned], "2020-01-01", fraction=2),
+        _validity(moved, engagements[moved], "2020-02-01"),
+    )
+
+    assert changed_persons(old, new) == [moved, refractioned, removed, added]
+    opus = ("uuid", "user_key", "engagement_type", "primary")
+    assert changed_persons(old, new, opus) == [moved, removed, added]
+    with pytest.raises(ValueError):
+        changed_persons(old, new, ("name",))
+
+    old.write_snapshot(tmp_path / "old")
+    new.write_snapshot(tmp_path / "new")
+    capsys.readouterr()
+    main([str(tmp_path / "old"), str(tmp_path / "new"), "--integration", "OPUS"])
+    assert capsys.readouterr().out.split() == list(map(str, [moved, removed, added]))
@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: Magenta ApS
+#
+# SPDX-License-Identifier: MPL-2.0
+import asyncio
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+from calculate_primary.autogenerated_graphql_client import (
+    GetChangedEngagementsEngagements,
+)
+from calculate_primary.lanes import BULK
+from calculate_primary.sharding import shard_for
+from calculate_primary.sweep import FullSweep
+from calculate_primary.sweep import HighWaterMark
+from calculate_primary.sweep import Reconciliation
+
+
+def test_full_sweep_recalculates_persons_of_shard_in_full():
+    uuids = [uuid4() for _ in range(20)]
+    recalculator = MagicMock()
+    recalculator.updater.helper.read_all_users.return_value = [
+        {"uuid": str(uuid)} for uuid in uuids
+    ]
+    recalculator.recalculate = AsyncMock(
+        side_effect=[None, ValueError("Bad data")] * 20
+    )
+    sweep = FullSweep(recalculator, interval=60.0, shards=2, shard=1, chunk_size=3)
+
+    asyncio.run(sweep.sweep())
+
+    swept = [c.args[0] for c in recalculator.recalculate.call_args_list]
+    assert swept == [uuid for uuid in uuids if shard_for(uuid, 2) == 1]
+    for c in recalculator.recalculate.call_args_list:
+        assert c.args[2] == BULK
+        assert c.kwargs == {"full": True}
+
+
+def _changed_page(person_uuids, next_cursor=None, registered="2999-01-01"):
+    return GetChangedEngagementsEngagements.parse_obj(
+        {
+            "objects": [
+                {
+                    "validities": [{"person": [{"uuid": str(uuid)}]}],
+                    "registrations": [{"start": f"{registered}T00:00:00+00:00"}],
+                }
+                for uuid in person_uuids
+            ],
+            "page_info": {"next_cursor": next_cursor},
+        }
+    )
+
+
+def test_reconciliation_recalculates_changed_persons_since_mark(tmp_path):
+    uuids = [uuid4() for _ in range(3)]
+    recalculator = MagicMock()
+    recalculator.recalculate = AsyncMock()
+    graphql_client = MagicMock()
+    graphql_client.get_changed_engagements = AsyncMock(
+        side_effect=[
+            _changed_page(uuids[:2], next_cursor="MQ=="),
+            _changed_page(uuids[1:]),
+        ]
+    )
+    mark = HighWaterMark(tmp_path / "mark")
+    reconciliation = Reconciliation(
+        recalculator, {"graphql_client": graphql_client}, interval=60.0, mark=mark
+    )
+
+    # The first reconciliation only marks where to start from, with an overlap
+    asyncio.run(reconciliation.sweep())
+    since = mark.get()
+    assert since <= datetime.now(timezone.utc) - reconciliation.overlap
+    graphql_client.get_changed_engagements.assert_not_called()
+
+    asyncio.run(reconciliation.sweep())
+    assert graphql_client.get_changed_engagements.call_args.args == (since,)
+    reconciled = {c.args[0] for c in recalculator.recalculate.call_args_list}
+    assert reconciled == set(uuids)
+    assert HighWaterMark(tmp_path / "mark").get() > since
+
+
+def test_reconciliation_keeps_mark_on_failure():
+    recalculator = MagicMock()
+    recalculator.recalculate = AsyncMock(side_effect=ValueError("Bad data"))
+    graphql_client = MagicMock()
+    graphql_client.get_changed_engagements = AsyncMock(
+        return_value=_changed_page([uuid4()])
+    )
+    mark = HighWaterMark()
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    mark.set(since)
+    reconciliation = Reconciliation(
+        recalculator, {"graphql_client": graphql_client}, interval=60.0, mark=mark
+    )
+
+    asyncio.run(reconciliation.sweep())
+
+    recalculator.recalculate.assert_called_once()
+    assert mark.get() == since
+
+
+def test_reconciliation_excludes_engagements_registered_before_mark():
+    changed, unchanged = uuid4(), uuid4()
+    recalculator = MagicMock()
+    recalculator.recalculate = AsyncMock()
+    graphql_client = MagicMock()
+    page = _changed_page([changed])
+    # Registered before the mark, and still current at it
+    page.objects += _changed_page([unchanged], registered="2023-12-31").objects
+    graphql_client.get_changed_engagements = AsyncMock(return_value=page)
+    mark = HighWaterMark()
+    mark.set(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    reconciliation = Reconciliation(
+        recalculator, {"graphql_client": graphql_client}, interval=60.0, mark=mark
+    )
+
+    asyncio.run(reconciliation.sweep())
+
+    reconciled = {c.args[0] for c in recalculator.recalculate.call_args_list}
+    assert reconciled == {changed}